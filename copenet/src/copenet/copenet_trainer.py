@@ -4,8 +4,12 @@ This file runs the main training/val loop, etc... using Lightning Trainer
 from pytorch_lightning import Trainer, seed_everything
 from argparse import ArgumentParser
 from copenet.copenet_twoview import copenet_twoview
+from copenet.utils.amp import check_amp_args, amp_trainer_kwargs
 from pytorch_lightning.loggers import TensorBoardLogger
 from pytorch_lightning.callbacks import ModelCheckpoint
+from copenet.utils.distributed import ddp_trainer_kwargs
+from copenet.utils.preemption import PreemptionCheckpoint
+from copenet.utils.step_profiler import StepProfiler
 
 from config import device
 if device == "cuda":
@@ -40,7 +44,13 @@ def main(args):
     model = copenet_model(hparams=args)
 
     # model checkpoint
-    ckpt_callback = ModelCheckpoint(monitor="val_loss",save_top_k=1, save_last=True, every_n_epochs=20)
+    if args.val_monitor == "subset":
+        # val_loss of the subset validation, checked after the steps it runs at
+        if args.val_subset_steps <= 0:
+            sys.exit("--val_monitor subset needs --val_subset_steps")
+        ckpt_callback = ModelCheckpoint(monitor="val_loss",save_top_k=1, save_last=True, every_n_train_steps=args.val_subset_steps)
+    else:
+        ckpt_callback = ModelCheckpoint(monitor="val_loss",save_top_k=1, save_last=True, every_n_epochs=20)
 
     # create logger
     logger = TensorBoardLogger(args.log_dir, name=args.name, version=args.version)
@@ -53,28 +63,33 @@ def main(args):
     else:
         last_ckpt = args.resume_from_checkpoint
 
+    # mid-epoch checkpoint to last.ckpt and exit code 3 on SIGTERM / SIGUSR1 / Ctrl-C
+    preempt_callback = PreemptionCheckpoint(os.path.join(exp_dir,"checkpoints","last.ckpt"),
+                                                every_n_minutes=args.ckpt_every_minutes)
+
+    callbacks = [ckpt_callback, preempt_callback]
+    if args.step_profile:
+        # per-step section timings to TensorBoard and step_profile.csv, optional torch.profiler trace
+        window = tuple(int(x) for x in args.profiler_window.split(":")) if args.profiler_window else None
+        callbacks.append(StepProfiler(every_n_steps=args.step_profile_every, profiler_window=window))
+
     global gpu
     trainer = Trainer.from_argparse_args(args,
+                                            **amp_trainer_kwargs(args),
                                             default_root_dir=exp_dir,
-                                            gpus = gpu,
+                                            **ddp_trainer_kwargs(args, gpu),
                                             max_epochs=176,  # old value: 176
                                             resume_from_checkpoint=last_ckpt,  # old value: last_ckpt
-                                            callbacks = [ckpt_callback],
+                                            callbacks = callbacks,
                                             logger=logger)
     
-    try:
-        trainer.fit(model)
-        pass
-    except KeyboardInterrupt:
-        import ipdb; ipdb.set_trace()
-        trainer.save_checkpoint(os.path.join(exp_dir, "checkpoints", "last.ckpt"))
+    trainer.fit(model)
 
     try:
         trainer.save_checkpoint(os.path.join(exp_dir, "checkpoints", "last.ckpt"))
     except:
         pass
 
-    import ipdb; ipdb.set_trace()
     # res = trainer.test()
     # res["fig"].write_html(os.path.join("copenet_logs",args.name,"fig.html"))
 
@@ -84,6 +99,15 @@ if __name__ == '__main__':
 
     # add args from trainer
     parser = Trainer.add_argparse_args(parser)
+    # data parallel training: --strategy ddp --accelerator cpu --devices <processes per node> --num_nodes <nodes>
+    parser.add_argument('--dist_backend', type=str, default="gloo", help='process group backend with --strategy ddp (gloo or nccl)')
+    # preemptible jobs: periodic mid-epoch checkpoints in addition to the one on SIGTERM / SIGUSR1
+    parser.add_argument('--ckpt_every_minutes', type=float, default=None, help='save a mid-epoch last.ckpt this often')
+    parser.add_argument('--step_profile', action='store_true', help='time the sections of every training step')
+    parser.add_argument('--step_profile_every', type=int, default=50, help='steps averaged per TensorBoard point of the step profile')
+    parser.add_argument('--profiler_window', type=str, default=None, help='first:last global steps traced with torch.profiler')
+    # validation schedule: --val_subset_steps <N> (stratified subset), --check_val_every_n_epoch <M> (full pass),
+    # --val_monitor subset|full picks the val_loss of the checkpoints
 
     # give the module a chance to add own params
     # good practice to define LightningModule speficic params in the module
@@ -91,5 +115,6 @@ if __name__ == '__main__':
 
     # parse params
     args = parser.parse_args()
+    check_amp_args(parser, args)
     # import ipdb; ipdb.set_trace()
     main(args)
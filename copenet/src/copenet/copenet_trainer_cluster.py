@@ -1,6 +1,7 @@
 from pytorch_lightning import Trainer, seed_everything
 from argparse import ArgumentParser
 from copenet.copenet_twoview import copenet_twoview
+from copenet.utils.amp import check_amp_args, amp_trainer_kwargs
 
 import os, sys
 import is_cluster_mixedmap
@@ -11,6 +12,7 @@ def main(args):
     from pytorch_lightning import Trainer, seed_everything
     from pytorch_lightning import Callback
     from pytorch_lightning.callbacks import ModelCheckpoint
+    from copenet.utils.preemption import PreemptionCheckpoint
     import os, sys, time
     os.environ["PYOPENGL_PLATFORM"] = 'egl'
     os.environ['EGL_DEVICE_ID'] = os.environ['GPU_DEVICE_ORDINAL'].split(',')[0]
@@ -61,13 +63,16 @@ def main(args):
 
     # most basic trainer, uses good defaults
     trainer = Trainer.from_argparse_args(args, 
+                                            **amp_trainer_kwargs(args),
                                             gpus = 1,
                                             logger = logger,
                                             progress_bar_refresh_rate=100,
                                             resume_from_checkpoint=last_ckpt,
                                             default_root_dir = exp_dir,
                                             checkpoint_callback=ckpt_callback,
-                                            callbacks = [ClusterCallback()])
+                                            callbacks = [ClusterCallback(),
+                                                # condor vacate (SIGTERM) mid-epoch: checkpoint and exit 3 as well
+                                                PreemptionCheckpoint(os.path.join(exp_dir,"final.ckpt"))])
 
     trainer.fit(model)
     trainer.save_checkpoint(os.path.join(exp_dir,"final.ckpt"))
@@ -86,6 +91,7 @@ if __name__ == '__main__':
 
     # parse params
     args = parser.parse_args()
+    check_amp_args(parser, args, check_device=False)
     
     # submit to cluster
     is_cluster_mixedmap.mixedmap(main,
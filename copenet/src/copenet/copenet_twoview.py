@@ -15,15 +15,24 @@ import numpy as np
 import torchgeometry as tgm
 
 import copy
+import functools
 from .models import model_copenet
 from .dsets import aerialpeople
 import cv2
 import torchvision
 from .smplx.smplx import SMPLX, lbs
+from .utils.body_model import get_smplx, get_smplx_body, checkpointed_forward
+from .utils.metrics import LossAggregator, mean_losses
+from .utils.val_schedule import val_subset_loader, subset_validation, is_subset_step, log_val_loss
+from .utils.distributed import process_device
+from .utils.evaluation import test_evaluator
+from .utils.preemption import ResumableSampler
+from .utils.summary_worker import SummaryWorker, summary_view, render_summary
 import pickle as pk
 from .utils.renderer import Renderer
 from . import constants as CONSTANTS
 from .utils.utils import transform_smpl, add_noise_input_cams,add_noise_input_smpltrans
+from .utils.amp import autocast_forward, amp_dtype
 from .utils.geometry import batch_rodrigues, perspective_projection, estimate_translation, rot6d_to_rotmat
 
 import pytorch_lightning as pl
@@ -31,19 +40,13 @@ import pytorch_lightning as pl
 from .config import device
 
 smplx = None
-smplx_test = None
-
-def create_smplx(copenet_home,train_batch_size,val_batch_size):
-    global smplx 
-    smplx = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
-
-    global smplx_test 
-    smplx_test = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=val_batch_size,
-                         create_transl=False)
+smplx_body = None
 
+def create_smplx(copenet_home, pose_blend=True):
+    global smplx
+    global smplx_body
+    smplx = get_smplx(copenet_home, process_device(device))
+    smplx_body = get_smplx_body(copenet_home, process_device(device), pose_blend)
 
 
 
@@ -53,16 +56,16 @@ class copenet_twoview(pl.LightningModule):
         super(copenet_twoview, self).__init__()
 
         global smplx
-        global smplx_test
 
         # not the best model...
         self.save_hyperparameters(hparams)
+        self.train_losses = LossAggregator()
+        self.summary_worker = None
+        self.val_subset_dl = None
         self.model = model_copenet.getcopenet(os.path.join(self.hparams.copenet_home,"src/copenet/data/smpl_mean_params.npz"))
+        self.model.checkpoint_backbone = self.hparams.get("checkpoint_backbone", False)
 
-        create_smplx(self.hparams.copenet_home,self.hparams.batch_size,self.hparams.val_batch_size)
-        
-        smplx.to(device)
-        smplx_test.to(device)
+        create_smplx(self.hparams.copenet_home, not self.hparams.get("no_pose_blend"))
 
         smplx_hand_idx = pk.load(open(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/MANO_SMPLX_vertex_ids.pkl"),'rb'))
         smplx_face_idx = np.load(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/SMPL-X__FLAME_vertex_ids.npy"))
@@ -75,9 +78,14 @@ class copenet_twoview(pl.LightningModule):
 
         self.focal_length = CONSTANTS.FOCAL_LENGTH
         self.renderer = Renderer(focal_length=self.focal_length, img_res=CONSTANTS.IMG_SIZE, faces=smplx.faces)
+        self.body_renderer = Renderer(focal_length=self.focal_length, img_res=CONSTANTS.IMG_SIZE, faces=smplx_body.faces)
 
     def forward(self, **kwargs):
-        return self.model(**kwargs)
+        return autocast_forward(self.model, amp_dtype(self.hparams), **kwargs)
+
+    def get_renderer(self, vertices):
+        # training and validation outputs hold the body-only vertices
+        return self.renderer if vertices.shape[1] == smplx.v_template.shape[0] else self.body_renderer
         
 
     def get_loss(self,input_batch, 
@@ -97,8 +105,11 @@ class copenet_twoview(pl.LightningModule):
         gt_smpltrans_rel1 = input_batch['smpltrans_rel1'] # SMPL trans parameters
         gt_smplorient_rel0 = input_batch['smplorient_rel0'] # SMPL orientation parameters
         gt_smplorient_rel1 = input_batch['smplorient_rel1'] # SMPL orientation parameters
-        gt_vertices0 = input_batch['smpl_vertices'].squeeze(1)
-        gt_vertices1 = input_batch['smpl_vertices'].squeeze(1)
+        gt_vertices = input_batch['smpl_vertices'].squeeze(1)
+        if not self.hparams.get("full_body_loss"):
+            gt_vertices = gt_vertices[:,smplx_body.vertex_idx]
+        gt_vertices0 = gt_vertices
+        gt_vertices1 = gt_vertices
         gt_joints0 = input_batch['smpl_joints'].squeeze(1)
         gt_joints1 = input_batch['smpl_joints'].squeeze(1)
         gt_joints_2d_cam0 = input_batch['smpl_joints_2d0'].squeeze(1)
@@ -149,14 +160,14 @@ class copenet_twoview(pl.LightningModule):
 
         loss *= 60
 
-        losses = {'loss': loss.detach().item(),
-                  'loss_regr_trans': loss_regr_trans.detach().item(),
-                  'loss_keypoints': loss_keypoints.detach().item(),
-                  'loss_keypoints_3d': loss_keypoints_3d.detach().item(),
-                  'loss_regr_shape': loss_regr_shape.detach().item(),
-                  'loss_rootrot': loss_rootrot.detach().item(),
-                  'loss_regr_pose': loss_regr_pose.detach().item(),
-                  'loss_regul_betas': loss_regul_betas.detach().item()}
+        losses = {'loss': loss.detach(),
+                  'loss_regr_trans': loss_regr_trans.detach(),
+                  'loss_keypoints': loss_keypoints.detach(),
+                  'loss_keypoints_3d': loss_keypoints_3d.detach(),
+                  'loss_regr_shape': loss_regr_shape.detach(),
+                  'loss_rootrot': loss_rootrot.detach(),
+                  'loss_regr_pose': loss_regr_pose.detach(),
+                  'loss_regul_betas': loss_regul_betas.detach()}
 
         return loss, losses
 
@@ -208,7 +219,8 @@ class copenet_twoview(pl.LightningModule):
                                                             bb1 = bb1,
                                                             init_position0 = in_smpltrans0,
                                                             init_position1 = in_smpltrans1,
-                                                            iters = self.hparams.reg_iters)
+                                                            iters = self.hparams.reg_iters,
+                                                            exit_threshold = None if self.training else self.hparams.get("reg_exit_threshold"))
                                                                         
 
         pred_smpltrans0 = pred_pose0[:,:3]
@@ -233,8 +245,10 @@ class copenet_twoview(pl.LightningModule):
         # pred_rotmat1 = torch.cat([gt_smplorient_rel1,gt_smplpose_rotmat],dim=1).view(batch_size,22,3,3)
         # #################################
         
+        # training and validation skin only the body vertices and joints used by the losses
+        body_model = smplx if is_test or self.hparams.get("full_body_loss") else smplx_body
         if is_val or is_test:
-            pred_output_cam0 = smplx_test.forward(betas=pred_betas0, 
+            pred_output_cam0 = body_model.forward(betas=pred_betas0, 
                                     body_pose=pred_rotmat0[:,1:],
                                     global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -245,7 +259,7 @@ class copenet_twoview(pl.LightningModule):
                                                 pred_output_cam0.vertices.squeeze(1),
                                                 pred_output_cam0.joints.squeeze(1))
 
-            pred_output_cam1 = smplx_test.forward(betas=pred_betas1, 
+            pred_output_cam1 = body_model.forward(betas=pred_betas1, 
                                     body_pose=pred_rotmat1[:,1:],
                                     global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -256,7 +270,7 @@ class copenet_twoview(pl.LightningModule):
                                                 pred_output_cam1.vertices.squeeze(1),
                                                 pred_output_cam1.joints.squeeze(1))
             if is_test:
-                pred_output_cam_in0 = smplx_test.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas0), 
+                pred_output_cam_in0 = smplx.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas0), 
                                         body_pose=pred_rotmat0[:,1:],
                                         global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                         transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -267,7 +281,7 @@ class copenet_twoview(pl.LightningModule):
                                                     pred_output_cam_in0.vertices.squeeze(1),
                                                     pred_output_cam_in0.joints.squeeze(1))
 
-                pred_output_cam_in1 = smplx_test.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas1), 
+                pred_output_cam_in1 = smplx.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas1), 
                                         body_pose=pred_rotmat1[:,1:],
                                         global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                         transl = torch.zeros(batch_size,3).float().type_as(pred_betas1),
@@ -278,7 +292,11 @@ class copenet_twoview(pl.LightningModule):
                                                     pred_output_cam_in1.vertices.squeeze(1),
                                                     pred_output_cam_in1.joints.squeeze(1))
         else:
-            pred_output_cam0 = smplx.forward(betas=pred_betas0, 
+            body_forward = body_model.forward
+            if self.hparams.get("checkpoint_smplx"):
+                # the skinning is recomputed in the backward instead of keeping its activations
+                body_forward = functools.partial(checkpointed_forward, body_model)
+            pred_output_cam0 = body_forward(betas=pred_betas0, 
                                 body_pose=pred_rotmat0[:,1:],
                                 global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                 transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -291,7 +309,7 @@ class copenet_twoview(pl.LightningModule):
                                                 pred_output_cam0.vertices.squeeze(1),
                                                 pred_output_cam0.joints.squeeze(1))
             
-            pred_output_cam1 = smplx.forward(betas=pred_betas1, 
+            pred_output_cam1 = body_forward(betas=pred_betas1, 
                                 body_pose=pred_rotmat1[:,1:],
                                 global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                 transl = torch.zeros(batch_size,3).float().type_as(pred_betas1),
@@ -377,41 +395,45 @@ class copenet_twoview(pl.LightningModule):
         
         
         output, losses, loss = self.fwd_pass_and_loss(batch,is_val=False, is_test=False)
+        self.train_losses.update(losses)
 
         with torch.no_grad():
         # logging
             if batch_idx % self.hparams.summary_steps == 0:
-                train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-                self.logger.experiment.add_image('train_pred_shape_cam', train_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('train_input_images',train_summ_in_image, self.global_step)
-                for loss_name, val in losses.items():
+                self.log_summaries('train', batch, output)
+                for loss_name, val in self.train_losses.compute().items():
                     self.logger.experiment.add_scalar(loss_name + '/train', val, self.global_step)
 
         return {"loss" : loss}
 
+    def on_train_batch_start(self, batch, batch_idx, dataloader_idx=0):
+        # validation on the stratified subset every val_subset_steps
+        if not is_subset_step(self):
+            return
+        if self.val_subset_dl is None:
+            _, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath,img_res=self.hparams.img_res)
+            self.val_subset_dl = val_subset_loader(val_dset, self.hparams)
+        val_losses, val_loss = subset_validation(self, self.val_subset_dl)
+        for loss_name, mean_val in val_losses.items():
+            self.logger.experiment.add_scalar(loss_name + '/val_subset', mean_val, self.global_step)
+        log_val_loss(self, val_loss, subset=True)
+
     def validation_step(self, batch, batch_idx):
         # OPTIONAL
         with torch.no_grad():
             output, losses, loss = self.fwd_pass_and_loss(batch,is_val=True, is_test=False)
 
             if batch_idx % self.hparams.val_summary_steps == 0:
-                val_summ_pred_image, val_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-
-                # logging
-                self.logger.experiment.add_image('val_pred_shape_cam', val_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('val_input_images',val_summ_in_image, self.global_step)
+                self.log_summaries('val', batch, output)
         
         return {'val_losses': losses,"val_loss":loss}
 
     def validation_epoch_end(self, outputs):
-        for loss_name, val in outputs[0]["val_losses"].items():
-            val_list = []
-            for x in outputs:
-                val_list.append(x["val_losses"][loss_name])
-            mean_val = np.mean(val_list)
+        for loss_name, mean_val in mean_losses([x["val_losses"] for x in outputs]).items():
             self.logger.experiment.add_scalar(loss_name + '/val', mean_val, self.global_step)
-        self.log("val_loss", np.mean([x["val_loss"].cpu().numpy() for x in outputs]))
-        return {"val_loss":np.mean([x["val_loss"].cpu().numpy() for x in outputs])}
+        avg_loss = torch.stack([x["val_loss"] for x in outputs]).mean()
+        log_val_loss(self, avg_loss)
+        return {"val_loss":avg_loss}
 
     def configure_optimizers(self):
         # REQUIRED
@@ -426,79 +448,54 @@ class copenet_twoview(pl.LightningModule):
 
     def train_dataloader(self):
         # REQUIRED
-        train_dset, _ = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath)
+        train_dset, _ = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath,img_res=self.hparams.img_res)
         return DataLoader(train_dset, batch_size=self.hparams.batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
-                            shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            sampler=ResumableSampler(train_dset, shuffle=self.hparams.shuffle_train),
+                            drop_last=False)
 
     def val_dataloader(self):
         # OPTIONAL
-        _, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath)
+        _, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath,img_res=self.hparams.img_res)
         return DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
                             shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            drop_last=False)
 
-    def summaries(self, input_batch,output, losses, is_test):
-        batch_size = input_batch['im0'].shape[0]
-        skip_factor = 4    # number of samples to be logged
-        img_downsize_factor = 5
-        
-        
-        with torch.no_grad():
-            im0 = input_batch['im0'][::int(batch_size/skip_factor)] * torch.tensor([0.229, 0.224, 0.225], device=self.device).reshape(1,3,1,1)
-            im0 = im0 + torch.tensor([0.485, 0.456, 0.406], device=self.device).reshape(1,3,1,1)
-            images0 = []
-            for i in range(0,batch_size,int(batch_size/skip_factor)):
-                blank_img = torch.zeros(3,1080,1920).float()
-                blank_img[:,input_batch["crop_info0"][i,0,0]:input_batch["crop_info0"][i,1,0],
-                    input_batch["crop_info0"][i,0,1]:input_batch["crop_info0"][i,1,1]] = torch.from_numpy(cv2.imread(input_batch['im0_path'][i])[:,:,::-1]/255.).float().permute(2,0,1)
-                images0.append(blank_img)
-            images0 = torch.stack(images0)
-            pred_vertices_cam0 = output['pred_vertices_cam0'][::int(batch_size/skip_factor)]
-            # pred_vertices_cam = input_batch['smpl_vertices_rel'][::int(batch_size/skip_factor)].squeeze(1)
-            
-            images_pred_cam0 = self.renderer.visualize_tb(pred_vertices_cam0,
-                                                        torch.zeros(batch_size,3,device=self._device).float(),
-                                                        torch.eye(3,device=self._device).float().unsqueeze(0).repeat(batch_size,1,1),
-                                                        images0)
-            
-            summ_pred_image0 = images_pred_cam0[:,::img_downsize_factor,::img_downsize_factor]
-            
-            summ_in_image0 = torchvision.utils.make_grid(im0)
-
-            im1 = input_batch['im1'][::int(batch_size/skip_factor)] * torch.tensor([0.229, 0.224, 0.225], device=self.device).reshape(1,3,1,1)
-            im1 = im1 + torch.tensor([0.485, 0.456, 0.406], device=self.device).reshape(1,3,1,1)
-
-            images1= []
-            for i in range(0,batch_size,int(batch_size/skip_factor)):
-                blank_img = torch.zeros(3,1080,1920).float()
-                blank_img[:,input_batch["crop_info1"][i,0,0]:input_batch["crop_info1"][i,1,0],
-                    input_batch["crop_info1"][i,0,1]:input_batch["crop_info1"][i,1,1]] = torch.from_numpy(cv2.imread(input_batch['im1_path'][i])[:,:,::-1]/255.).float().permute(2,0,1)
-                images1.append(blank_img)
-            images1 = torch.stack(images1)
-            pred_vertices_cam1 = output['pred_vertices_cam1'][::int(batch_size/skip_factor)]
-            
-            
-            images_pred_cam1 = self.renderer.visualize_tb(pred_vertices_cam1,
-                                                        torch.zeros(batch_size,3,device=self._device).float(),
-                                                        torch.eye(3,device=self._device).float().unsqueeze(0).repeat(batch_size,1,1),
-                                                        images1)
-            
-            summ_pred_image1 = images_pred_cam1[:,::img_downsize_factor,::img_downsize_factor]
-            
-            summ_in_image1 = torchvision.utils.make_grid(im1)
+    def summary_views(self, input_batch, output):
+        """ CPU copies of the logged samples, rendered by render_summary """
+        return [
+            summary_view(input_batch, output, self.get_renderer(output['pred_vertices_cam0']), 'im0', 'pred_vertices_cam0', background="crop_in_frame", downsize=5),
+            summary_view(input_batch, output, self.get_renderer(output['pred_vertices_cam1']), 'im1', 'pred_vertices_cam1', background="crop_in_frame", downsize=5)]
 
-            summ_in_image = torch.cat((summ_in_image0, summ_in_image1),1)
-            summ_pred_image = torch.cat((summ_pred_image0, summ_pred_image1),1)
-            # import ipdb; ipdb.set_trace()
-            if is_test and self.hparams.testdata.lower() == "aircapdata":
-                import ipdb; ipdb.set_trace()
-            
-            return summ_pred_image, summ_in_image
+    def summaries(self, input_batch,output, losses, is_test):
+        summ_pred_image, summ_in_image = render_summary(self.summary_views(input_batch, output))
+        if is_test and self.hparams.testdata.lower() == "aircapdata":
+            import ipdb; ipdb.set_trace()
+
+        return summ_pred_image, summ_in_image
+
+    def log_summaries(self, prefix, input_batch, output):
+        """ queue the image summaries on the summary worker, or render them here with --sync_summaries """
+        if self.global_rank != 0:
+            return
+        views = self.summary_views(input_batch, output)
+        if self.hparams.get("sync_summaries", False):
+            summ_pred_image, summ_in_image = render_summary(views)
+            self.logger.experiment.add_image(prefix + '_pred_shape_cam', summ_pred_image, self.global_step)
+            self.logger.experiment.add_image(prefix + '_input_images', summ_in_image, self.global_step)
+            return
+        if self.summary_worker is None:
+            self.summary_worker = SummaryWorker(self.logger.log_dir, self.hparams.get("summary_queue", 2))
+        self.summary_worker.submit(prefix, self.global_step, views)
+
+    def on_fit_end(self):
+        if self.summary_worker is not None:
+            self.summary_worker.close()
+            print("image summaries: {} rendered, {} dropped".format(self.summary_worker.n_submitted, self.summary_worker.n_dropped))
+            self.summary_worker = None
 
 
     def test_dataloader(self):
@@ -510,21 +507,24 @@ class copenet_twoview(pl.LightningModule):
                                 pin_memory=self.hparams.pin_memory,
                                 drop_last=False)
         else:
-            train_dset, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath)
+            train_dset, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath,img_res=self.hparams.img_res)
             train_dloader = DataLoader(train_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
             test_dloader = DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
 
             return [test_dloader, train_dloader]
 
 
+    def on_test_epoch_start(self):
+        self.evaluator = test_evaluator(self, views=["0","1"], body_model=smplx_body)
+
     def test_step(self, batch, batch_idx, dset_idx=0):
         # OPTIONAL
         output, losses, loss = self.fwd_pass_and_loss(batch,is_val=True,is_test=True)
@@ -533,97 +533,13 @@ class copenet_twoview(pl.LightningModule):
         #     train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=True)
         # cv2.imwrite(train_summ_pred_image.permute(1,2,0).data.numpy())
         
-        return {"test_loss" : loss,
-                "output" : output}
+        # metrics and spilled fields are accumulated here, the outputs are not kept until test_epoch_end
+        self.evaluator.update(dset_idx, output)
+        return {"test_loss" : loss}
 
     def test_epoch_end(self, outputs):
-        # OPTIONAL
-        global smplx
-        test_err_smpltrans0 = np.array([(x["output"]["pred_smpltrans0"] - 
-            x["output"]["gt_smpltrans0"]).cpu().numpy() for x in outputs[0]]).reshape(-1,3)
-        mean_test_err_smpltrans0 = np.mean(np.sqrt(np.sum(test_err_smpltrans0**2,1)))
-        test_err_smpltrans1 = np.array([(x["output"]["pred_smpltrans1"] - 
-            x["output"]["gt_smpltrans1"]).cpu().numpy() for x in outputs[0]]).reshape(-1,3)
-        mean_test_err_smpltrans1 = np.mean(np.sqrt(np.sum(test_err_smpltrans1**2,1)))
-
-        train_err_smpltrans0 = np.array([(x["output"]["pred_smpltrans0"] - 
-            x["output"]["gt_smpltrans0"]).cpu().numpy() for x in outputs[1]]).reshape(-1,3)
-        mean_train_err_smpltrans0 = np.mean(np.sqrt(np.sum(train_err_smpltrans0**2,1)))
-        train_err_smpltrans1 = np.array([(x["output"]["pred_smpltrans1"] - 
-            x["output"]["gt_smpltrans1"]).cpu().numpy() for x in outputs[1]]).reshape(-1,3)
-        mean_train_err_smpltrans1 = np.mean(np.sqrt(np.sum(train_err_smpltrans1**2,1)))
-
-
-        smplpose_rotmat = torch.stack([x["output"]["smplpose_rotmat"].to(device) for x in outputs[0]])
-        smplorient_rel0 = torch.stack([x["output"]["smplorient_rel0"].to(device) for x in outputs[0]])  
-        smplorient_rel1 = torch.stack([x["output"]["smplorient_rel1"].to(device) for x in outputs[0]])
-
-        pred_angles0_test = torch.cat([x["output"]["pred_angles0"].to(device) for x in outputs[0]])
-        pred_angles1_test = torch.cat([x["output"]["pred_angles1"].to(device) for x in outputs[0]])
-        pred_rotmat0_test = tgm.angle_axis_to_rotation_matrix(pred_angles0_test.view(-1,3)).view(smplpose_rotmat.shape[0],smplpose_rotmat.shape[1],22,4,4)
-        pred_rotmat1_test = tgm.angle_axis_to_rotation_matrix(pred_angles1_test.view(-1,3)).view(smplpose_rotmat.shape[0],smplpose_rotmat.shape[1],22,4,4)
-
-        # pred_angles0_train = torch.cat([x["output"]["pred_angles0"].to(device) for x in outputs[1]])
-        # pred_angles1_train = torch.cat([x["output"]["pred_angles1"].to(device) for x in outputs[1]])
-        # pred_rotmat0_train = tgm.angle_axis_to_rotation_matrix(pred_angles0_train.view(-1,3)).view(pred_angles0_train.shape[0],22,4,4)
-        # pred_rotmat1_train = tgm.angle_axis_to_rotation_matrix(pred_angles1_train.view(-1,3)).view(pred_angles1_train.shape[0],22,4,4)
-    
-
-        joints3d = []
-        from tqdm import tqdm
-        for i in tqdm(range(smplpose_rotmat.shape[0])):
-            out_gt0 = smplx.forward(body_pose=smplpose_rotmat[i],
-                                    global_orient= smplorient_rel0[i],pose2rot=False)
-            out_gt1 = smplx.forward(body_pose=smplpose_rotmat[i],
-                                    global_orient= smplorient_rel1[i],pose2rot=False)
-            out_pred0 = smplx.forward(body_pose=pred_rotmat0_test[i,:,1:22,:3,:3],
-                                    global_orient= pred_rotmat0_test[i,:,0:1,:3,:3],pose2rot=False)
-            out_pred1 = smplx.forward(body_pose=pred_rotmat1_test[i,:,1:22,:3,:3],
-                                    global_orient= pred_rotmat1_test[i,:,0:1,:3,:3],pose2rot=False)
-            
-            joints3d.append(np.stack([out_gt0.joints.detach().cpu().numpy(),
-                        out_gt1.joints.detach().cpu().numpy(),
-                        out_pred0.joints.detach().cpu().numpy(),
-                        out_pred1.joints.detach().cpu().numpy()]).transpose(1,0,2,3))
-
-        j3d = np.stack(joints3d).reshape(-1,4,127,3)[:,:,:22]
-        print("test_mpjpe0: {}".format(np.mean(np.sqrt(np.sum((j3d[:,0] - j3d[:,2])**2,2))[:,:22])))
-        print("test_mpjpe1: {}".format(np.mean(np.sqrt(np.sum((j3d[:,1] - j3d[:,3])**2,2))[:,:22])))
-        print("test_mpe00: {}".format(mean_test_err_smpltrans0))
-        print("test_mpe1: {}".format(mean_train_err_smpltrans0))
-
-        # print("train_mpe00: {}".format(mean_test_err_smpltrans1))
-        # print("train_mpjpe0: {}".format(mean_test_err_smplangles1))
-        # print("train_mpe1: {}".format(mean_train_err_smpltrans1))
-        # print("train_mpjpe1: {}".format(mean_train_err_smplangles1))
-
-        # import ipdb; ipdb.set_trace()
-        return {"outputs":outputs}
-
-
-    def viz_3d(self,batch,output,viz_idx=[0]):
-        import meshcat
-        import meshcat.geometry as g
-
-        if not hasattr(self,"vizualizer_3d"):
-            self.vizualizer_3d = meshcat.Visualizer()
-
-        import ipdb; ipdb.set_trace()
-        pred_vertices0_wrt_origin,_,_,_ = transform_smpl(torch.inverse(batch["extr0"].squeeze(1)),output["pred_vertices_cam0"])
-        pred_vertices1_wrt_origin,_,_,_ = transform_smpl(torch.inverse(batch["extr1"].squeeze(1)),output["pred_vertices_cam1"])
-
-        for idx in viz_idx:
-            self.vizualizer_3d["mesh0_"+str(idx)].set_object(g.TriangularMeshGeometry(pred_vertices0_wrt_origin.cpu().numpy()[idx],smplx.faces),
-                            g.MeshLambertMaterial(
-                                color=0xff22dd,
-                                reflectivity=0.8))
-
-            self.vizualizer_3d["mesh1_"+str(idx)].set_object(g.TriangularMeshGeometry(pred_vertices1_wrt_origin.cpu().numpy()[idx],smplx.faces),
-                            g.MeshLambertMaterial(
-                                color=0xff22dd,
-                                reflectivity=0.8))
-        
-        import ipdb;ipdb.set_trace()
+        # test set and training set, or only the aircap set
+        self.evaluator.log(self)
 
 
     @staticmethod
@@ -653,13 +569,30 @@ class copenet_twoview(pl.LightningModule):
         train.add_argument('--log_dir', default='/is/ps3/nsaini/projects/copenet/airpose_logs', help='Directory to store logs')
         train.add_argument('--testdata', type=str, default="aerialpeople", help='test dataset')
         train.add_argument("--lr", type=float, default=5e-5, help="Learning rate")
+        amp = train.add_mutually_exclusive_group()
+        amp.add_argument('--fp16', action='store_true', help='backbone and regressor in float16 autocast (cuda) with loss scaling, SMPL-X and the losses in fp32')
+        amp.add_argument('--bf16', action='store_true', help='backbone and regressor in bfloat16 autocast (torch >= 1.10), SMPL-X and the losses in fp32')
+        train.add_argument('--checkpoint_backbone', action='store_true', help='activation checkpointing of the backbone layer1..layer4')
+        train.add_argument('--checkpoint_smplx', action='store_true', help='activation checkpointing of the SMPL-X forward in the training loss')
         train.add_argument('--batch_size', type=int, default=30, help='Batch size')  # 30
         train.add_argument('--val_batch_size', type=int, default=30, help='Validation data batch size')  # 30
+        train.add_argument('--eval_chunk', type=int, default=1024, help='frames per joints-only SMPL-X forward of the test evaluation')
+        train.add_argument('--eval_spill_fields', type=str, default='', help='comma separated test outputs (e.g. pred_vertices_cam0) written to the result store in eval_spill_dir')
+        train.add_argument('--eval_spill_dir', type=str, default=None, help='result store of the spilled test outputs, <log dir>/test_results by default')
+        train.add_argument('--eval_spill_dtype', type=str, default='float16', help='dtype of the spilled floating point fields, none keeps it')
         train.add_argument('--summary_steps', type=int, default=100, help='Summary saving frequency')  # 500
         train.add_argument('--val_summary_steps', type=float, default=50, help='validation summary frequency')
+        train.add_argument('--val_subset_steps', type=int, default=0, help='validation on a stratified subset every this many training steps, 0 disables it')
+        train.add_argument('--val_subset_size', type=int, default=500, help='number of samples of the validation subset')
+        train.add_argument('--val_subset_dist_bins', type=int, default=4, help='camera distance bins the subset is stratified on, besides the subject')
+        train.add_argument('--val_monitor', type=str, default='full', choices=['full','subset'], help='validation pass logged as val_loss (the checkpoint monitor)')
+        train.add_argument('--sync_summaries', action='store_true', help='render the image summaries in the training loop instead of the summary worker')
+        train.add_argument('--summary_queue', type=int, default=2, help='image summaries waiting for the summary worker, more are dropped')
         train.add_argument('--checkpoint_steps', type=int, default=10000, help='Checkpoint saving frequency')
         train.add_argument('--img_res', type=int, default=224, help='Rescale bounding boxes to size [img_res, img_res] before feeding them in the network') 
         train.add_argument('--shape_loss_weight', default=50, type=float, help='Weight of per-vertex loss') 
+        train.add_argument('--full_body_loss', action='store_true', help='Compute the training and validation losses on the full SMPL-X instead of the body-only model')
+        train.add_argument('--no_pose_blend', action='store_true', help='Skip the pose corrective blend shapes of the body-only model, faster but less accurate')
         train.add_argument('--keypoint2d_loss_weight', default=0.002, type=float, help='Weight of 2D keypoint loss')
         train.add_argument('--keypoint3d_loss_weight', default=1, type=float, help='Weight of 3D keypoint loss')
         train.add_argument('--limbs3d_loss_weight', default=3., type=float, help='Weight of limbs 3D keypoint loss')
@@ -673,6 +606,7 @@ class copenet_twoview(pl.LightningModule):
         train.add_argument('--beta_loss_weight', default=1, type=float, help='Weight of SMPL betas loss')
         train.add_argument('--cams_loss_weight', default=1, type=float, help='Weight of cams params loss')
         train.add_argument('--reg_iters', default=3, type=int, help='number of regressor iterations')
+        train.add_argument('--reg_exit_threshold', default=None, type=float, help='at inference stop regressor iterations per sample once the max param change is below this')
         train.add_argument('--gt_train_weight', default=1., help='Weight for GT keypoints during training')
         train.add_argument('--train_reg_only_epochs', default=-1, help='number of epochs the regressor only part to be initially trained')  
 
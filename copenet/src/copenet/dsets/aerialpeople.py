@@ -29,17 +29,19 @@ def get_aerialpeople_seqsplit_old(datapath='',train_test_ratio=0.5):
     
     return train_dset, test_dset
 
-def get_aerialpeople_seqsplit(datapath='/home/nsaini/Datasets/AerialPeople/agora_copenet_uniform_new_cropped'):
+def get_aerialpeople_seqsplit(datapath='/home/nsaini/Datasets/AerialPeople/agora_copenet_uniform_new_cropped',img_res=CONSTANTS.IMG_RES):
     
-    train_dset = aerialpeople_crop(datapath=os.path.join(datapath,"dataset",'train_pkls.pkl'))
-    test_dset = aerialpeople_crop(datapath=os.path.join(datapath,"dataset",'test_pkls.pkl'))
+    train_dset = aerialpeople_crop(datapath=os.path.join(datapath,"dataset",'train_pkls.pkl'),img_res=img_res)
+    test_dset = aerialpeople_crop(datapath=os.path.join(datapath,"dataset",'test_pkls.pkl'),img_res=img_res)
     
     return train_dset, test_dset
 
 class aerialpeople_crop(Dataset):
-    def __init__(self,datapath,rottrans=False):
+    def __init__(self,datapath,rottrans=False,img_res=CONSTANTS.IMG_RES):
         super().__init__()
         
+        self.img_res = img_res
+        
         if os.path.exists(datapath):
             with open(datapath,'rb') as f:
                 print('loading aerialpeople data...')
@@ -78,11 +80,25 @@ class aerialpeople_crop(Dataset):
     def __len__(self):
         return self.db_len
 
+    def strata(self, n_dist_bins=4):
+        """ (subject, camera distance bin) of every sample, the subject is gender and shape,
+        the distance the mean over the cameras binned at its quantiles """
+        subjects = []
+        dists = []
+        for path in self.db:
+            with open(path,'rb') as f:
+                db = pk.load(f)
+            subjects.append(db['smplgender'].upper() + str(np.round(db['smplshape'].reshape(10),2).tolist()))
+            extr = [np.array(db['cam'+str(i)]['extr']).reshape(-1,4) for i in range(self.num_cams)]
+            dists.append(np.mean([np.linalg.norm(e[:3,:3].dot(db['smpltrans'].reshape(3)) + e[:3,3]) for e in extr]))
+        dist_bins = np.digitize(dists, np.quantile(dists, np.linspace(0,1,n_dist_bins+1)[1:-1]))
+        return [(s, int(b)) for s, b in zip(subjects, dist_bins)]
+
     def __getitem__(self,idx):
 
         with open(self.db[idx],'rb') as f:
             db = pk.load(f)
-        
+
         intr = {}
         extr = {}
         for i in range(self.num_cams):
@@ -138,7 +154,8 @@ class aerialpeople_crop(Dataset):
         pad = {}
         for i in range(self.num_cams):
             try:
-                im[str(i)],s[str(i)],pad[str(i)] = resize_with_pad(im[str(i)],size=224)
+                im[str(i)],s[str(i)],pad[str(i)] = resize_with_pad(im[str(i)],size=self.img_res)
+                s[str(i)] = s[str(i)]*CONSTANTS.IMG_RES/self.img_res
             except:
                 print('!!!!!!!!!!!!!!'+db['im'+str(i)]+'!!!!!!!!!!!!!!!!!!')
                 print(im[str(i)].shape)
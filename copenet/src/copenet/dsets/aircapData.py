@@ -20,16 +20,18 @@ sys.path.append("/is/ps3/nsaini/AirCap_WS/aerial-pose-tracker/aerial_pose")
 from camera_and_NN import processCamsNNs
 
 
-def get_copenet_real_traintest(datapath="/ps/project/datasets/AirCap_ICCV19/ICCV_28Feb_rerun2/",train_range=range(0,4000),test_range=range(4001,4615),shuffle_cams=False,first_cam=0):
-    train_dset = aircapData_crop(train_range,datapath)
-    test_dset = aircapData_crop(test_range,datapath)
+def get_copenet_real_traintest(datapath="/ps/project/datasets/AirCap_ICCV19/ICCV_28Feb_rerun2/",train_range=range(0,4000),test_range=range(4001,4615),shuffle_cams=False,first_cam=0,img_res=CONSTANTS.IMG_RES):
+    train_dset = aircapData_crop(train_range,datapath,img_res=img_res)
+    test_dset = aircapData_crop(test_range,datapath,img_res=img_res)
     return train_dset, test_dset
 
 
 class aircapData_crop(Dataset):
-    def __init__(self, drange:range, datapath="/ps/project/datasets/AirCap_ICCV19/ICCV_28Feb_rerun2/", rottrans=False):
+    def __init__(self, drange:range, datapath="/ps/project/datasets/AirCap_ICCV19/ICCV_28Feb_rerun2/", rottrans=False, img_res=CONSTANTS.IMG_RES):
         super().__init__()
         
+        self.img_res = img_res
+        
         if os.path.exists(datapath):
             self.num_cams,self.n_NNs,self.camsdata,self.NNs,self.tstamps2cam = processCamsNNs(datapath,
                                                     ["alphapose"],[0,1])
@@ -103,8 +105,10 @@ class aircapData_crop(Dataset):
         img1_crop = full_img1[bb1[0][1]:bb1[1][1],bb1[0][0]:bb1[1][0]]
         
         # preprocess input images
-        im0_crop_resized,s0,pad0 = resize_with_pad(img0_crop)
-        im1_crop_resized,s1,pad1 = resize_with_pad(img1_crop)
+        im0_crop_resized,s0,pad0 = resize_with_pad(img0_crop,size=self.img_res)
+        im1_crop_resized,s1,pad1 = resize_with_pad(img1_crop,size=self.img_res)
+        s0 = s0*CONSTANTS.IMG_RES/self.img_res
+        s1 = s1*CONSTANTS.IMG_RES/self.img_res
         im0_crop_in = self.normalize(torch.from_numpy(im0_crop_resized).float().permute(2,0,1))
         im1_crop_in = self.normalize(torch.from_numpy(im1_crop_resized).float().permute(2,0,1))
 
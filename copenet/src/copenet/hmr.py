@@ -20,10 +20,18 @@ from .dsets import aerialpeople
 import cv2
 import torchvision
 from .smplx.smplx import SMPLX, lbs
+from .utils.body_model import get_smplx, get_smplx_body
+from .utils.metrics import LossAggregator, mean_losses
+from .utils.val_schedule import val_subset_loader, subset_validation, is_subset_step, log_val_loss
+from .utils.distributed import process_device
+from .utils.evaluation import test_evaluator
+from .utils.preemption import ResumableSampler
+from .utils.summary_worker import SummaryWorker, summary_view, render_summary
 import pickle as pk
 from .utils.renderer import Renderer
 from . import constants as CONSTANTS
 from .utils.utils import transform_smpl, add_noise_input_cams,add_noise_input_smpltrans
+from .utils.amp import autocast_forward, amp_dtype
 from .utils.geometry import batch_rodrigues, perspective_projection, estimate_translation, rot6d_to_rotmat
 
 import pytorch_lightning as pl
@@ -31,18 +39,15 @@ import pytorch_lightning as pl
 from .config import device
 
 smplx = None
-smplx_test = None
+smplx_body = None
+
+def create_smplx(copenet_home, pose_blend=True):
+    global smplx
+    global smplx_body
+    smplx = get_smplx(copenet_home, process_device(device))
+    smplx_body = get_smplx_body(copenet_home, process_device(device), pose_blend)
 
-def create_smplx(copenet_home,train_batch_size,val_batch_size):
-    global smplx 
-    smplx = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
 
-    global smplx_test 
-    smplx_test = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
 
 class hmr(pl.LightningModule):
 
@@ -50,12 +55,13 @@ class hmr(pl.LightningModule):
         super(hmr, self).__init__()
         # not the best model...
         self.save_hyperparameters(hparams)
+        self.train_losses = LossAggregator()
+        self.summary_worker = None
+        self.val_subset_dl = None
         self.model = model_hmr.getcopenet(os.path.join(self.hparams.copenet_home,"src/copenet/data/smpl_mean_params.npz"))
 
-        create_smplx(self.hparams.copenet_home,self.hparams.batch_size,self.hparams.val_batch_size)
+        create_smplx(self.hparams.copenet_home, not self.hparams.get("no_pose_blend"))
         
-        smplx.to(device)
-        smplx_test.to(device)
         
         smplx_hand_idx = pk.load(open(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/MANO_SMPLX_vertex_ids.pkl"),'rb'))
         smplx_face_idx = np.load(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/SMPL-X__FLAME_vertex_ids.npy"))
@@ -67,16 +73,23 @@ class hmr(pl.LightningModule):
         self.mseloss = nn.MSELoss(reduction='none')
 
         self.focal_length = CONSTANTS.FOCAL_LENGTH
-        self.renderer = Renderer(focal_length=self.focal_length, img_res=[self.hparams.img_res,self.hparams.img_res], faces=smplx.faces)
+        self.renderer = Renderer(focal_length=[f*self.hparams.img_res/CONSTANTS.IMG_RES for f in self.focal_length], img_res=[self.hparams.img_res,self.hparams.img_res], faces=smplx.faces)
+        self.body_renderer = Renderer(focal_length=[f*self.hparams.img_res/CONSTANTS.IMG_RES for f in self.focal_length], img_res=[self.hparams.img_res,self.hparams.img_res], faces=smplx_body.faces)
 
     def forward(self, **kwargs):
-        return self.model(**kwargs)
+        return autocast_forward(self.model, amp_dtype(self.hparams), **kwargs)
+
+    def get_renderer(self, vertices):
+        # training and validation outputs hold the body-only vertices
+        return self.renderer if vertices.shape[1] == smplx.v_template.shape[0] else self.body_renderer
         
     def get_loss(self,input_batch, pred_camera, pred_rotmat, pred_betas, pred_output_cam, pred_joints_2d_cam):
         
         gt_smplpose_rotmat = input_batch['smplpose_rotmat'] # SMPL pose rotation matrices
         gt_smplorient_rel = input_batch['smplorient_rel0'] # SMPL orientation parameters
         gt_vertices = input_batch['smpl_vertices'].squeeze(1)
+        if not self.hparams.get("full_body_loss"):
+            gt_vertices = gt_vertices[:,smplx_body.vertex_idx]
         gt_joints = input_batch['smpl_joints'].squeeze(1)
         gt_joints_2d_cam = input_batch['smpl_joints_2d_crop0'].squeeze(1)
         
@@ -114,13 +127,13 @@ class hmr(pl.LightningModule):
 
         loss *= 60
 
-        losses = {'loss': loss.detach().item(),
-                  'loss_keypoints': loss_keypoints.detach().item(),
-                  'loss_keypoints_3d': loss_keypoints_3d.detach().item(),
-                  'loss_regr_shape': loss_regr_shape.detach().item(),
-                  'loss_rootrot': loss_rootrot.detach().item(),
-                  'loss_regr_pose': loss_regr_pose.detach().item(),
-                  'loss_regul_betas': loss_regul_betas.detach().item()}
+        losses = {'loss': loss.detach(),
+                  'loss_keypoints': loss_keypoints.detach(),
+                  'loss_keypoints_3d': loss_keypoints_3d.detach(),
+                  'loss_regr_shape': loss_regr_shape.detach(),
+                  'loss_rootrot': loss_rootrot.detach(),
+                  'loss_regr_pose': loss_regr_pose.detach(),
+                  'loss_regul_betas': loss_regul_betas.detach()}
 
         return loss, losses
 
@@ -133,22 +146,24 @@ class hmr(pl.LightningModule):
             batch_size = im.shape[0]
 
         
-        pred_pose, pred_betas, pred_camera = self.model.forward(x = im,
-                                                        iters = self.hparams.reg_iters)                                                                
+        pred_pose, pred_betas, pred_camera = self.forward(x = im,
+                                                  iters = self.hparams.reg_iters)                                                                
         # #####################
         # pred_pose = torch.cat([input_batch["smplorient_rel"],
         #                             input_batch["smplpose_rotmat"]],dim=1).view(batch_size,22,3,3)
         # #####################
         pred_rotmat = pred_pose
 
+        # training and validation skin only the body vertices and joints used by the losses
+        body_model = smplx if is_test or self.hparams.get("full_body_loss") else smplx_body
         if is_val or is_test:
-            pred_output_cam = smplx_test.forward(betas=pred_betas, 
+            pred_output_cam = body_model.forward(betas=pred_betas, 
                                     body_pose=pred_pose[:,1:],
                                     global_orient=torch.eye(3).float().unsqueeze(0).unsqueeze(0).repeat(batch_size,1,1,1).type_as(pred_betas),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas),
                                     pose2rot=False)
         else:
-            pred_output_cam = smplx.forward(betas=pred_betas, 
+            pred_output_cam = body_model.forward(betas=pred_betas, 
                                 body_pose=pred_pose[:,1:],
                                 global_orient=torch.eye(3).float().unsqueeze(0).unsqueeze(0).repeat(batch_size,1,1,1).type_as(pred_betas),
                                 transl = torch.zeros(batch_size,3).float().type_as(pred_betas),
@@ -162,7 +177,7 @@ class hmr(pl.LightningModule):
                                                 pred_output_cam.joints.squeeze(1))
         pred_cam_t = torch.stack([pred_camera[:,1],
                                   pred_camera[:,2],
-                                  2*self.focal_length[0]/(self.hparams.img_res * pred_camera[:,0] +1e-9)],dim=-1)
+                                  2*self.focal_length[0]/(CONSTANTS.IMG_RES * pred_camera[:,0] +1e-9)],dim=-1)
         
         pred_joints_2d_cam = perspective_projection(pred_joints,
                                                    rotation=torch.eye(3).float().unsqueeze(0).repeat(batch_size,1,1).type_as(pred_betas),
@@ -197,7 +212,7 @@ class hmr(pl.LightningModule):
             
             in_cam_t = torch.stack([self.model.init_cam[0,1].expand(batch_size),
                                   self.model.init_cam[0,2].expand(batch_size),
-                                  2*self.focal_length[0]/(self.hparams.img_res * self.model.init_cam[0,0].expand(batch_size) +1e-9)],dim=-1)
+                                  2*self.focal_length[0]/(CONSTANTS.IMG_RES * self.model.init_cam[0,0].expand(batch_size) +1e-9)],dim=-1)
             in_cam_trans0 = torch.bmm(torch.inverse(intr0),torch.bmm(modif_intr0,in_cam_t.unsqueeze(2)))
             in_cam_trans_z0 = (in_cam_t/((self.focal_length[0]/bb0[:,2])/self.focal_length[0]).unsqueeze(1))[:,2]
             in_cam_trans0 = (in_cam_trans0.squeeze(2)*in_cam_trans_z0.unsqueeze(1)/in_cam_trans0[:,2])
@@ -229,41 +244,46 @@ class hmr(pl.LightningModule):
         self.model.train()
         
         output, losses, loss = self.fwd_pass_and_loss(batch, is_val=False,is_test=False)
+        self.train_losses.update(losses)
 
         with torch.no_grad():
         # logging
             if batch_idx % self.hparams.summary_steps == 0:
-                train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-                self.logger.experiment.add_image('train_pred_shape_cam', train_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('train_input_images',train_summ_in_image, self.global_step)
-                for loss_name, val in losses.items():
+                self.log_summaries('train', batch, output)
+                for loss_name, val in self.train_losses.compute().items():
                     self.logger.experiment.add_scalar(loss_name + '/train', val, self.global_step)
 
         return {"loss" : loss}
 
+    def on_train_batch_start(self, batch, batch_idx, dataloader_idx=0):
+        # validation on the stratified subset every val_subset_steps
+        if not is_subset_step(self):
+            return
+        if self.val_subset_dl is None:
+            _, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath,img_res=self.hparams.img_res)
+            self.val_subset_dl = val_subset_loader(val_dset, self.hparams)
+        val_losses, val_loss = subset_validation(self, self.val_subset_dl)
+        for loss_name, mean_val in val_losses.items():
+            self.logger.experiment.add_scalar(loss_name + '/val_subset', mean_val, self.global_step)
+        log_val_loss(self, val_loss, subset=True)
+
     def validation_step(self, batch, batch_idx):
         # OPTIONAL
         with torch.no_grad():
             output, losses, loss = self.fwd_pass_and_loss(batch,is_val=True, is_test=False)
 
             if batch_idx % self.hparams.val_summary_steps == 0:
-                val_summ_pred_image, val_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-
-                # logging
-                self.logger.experiment.add_image('val_pred_shape_cam', val_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('val_input_images',val_summ_in_image, self.global_step)
+                self.log_summaries('val', batch, output)
         
         return {'val_losses': losses,"val_loss":loss}
 
     def validation_epoch_end(self, outputs):
-        for loss_name, val in outputs[0]["val_losses"].items():
-            val_list = []
-            for x in outputs:
-                val_list.append(x["val_losses"][loss_name])
-            mean_val = np.mean(val_list)
+        for loss_name, mean_val in mean_losses([x["val_losses"] for x in outputs]).items():
             self.logger.experiment.add_scalar(loss_name + '/val', mean_val, self.global_step)
         
-        return {"val_loss":np.mean([x["val_loss"].cpu().numpy() for x in outputs])}
+        avg_loss = torch.stack([x["val_loss"] for x in outputs]).mean()
+        log_val_loss(self, avg_loss)
+        return {"val_loss":avg_loss}
 
     def configure_optimizers(self):
         # REQUIRED
@@ -278,51 +298,53 @@ class hmr(pl.LightningModule):
 
     def train_dataloader(self):
         # REQUIRED
-        train_dset, _ = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath)
+        train_dset, _ = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath,img_res=self.hparams.img_res)
         return DataLoader(train_dset, batch_size=self.hparams.batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
-                            shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            sampler=ResumableSampler(train_dset, shuffle=self.hparams.shuffle_train),
+                            drop_last=False)
 
     def val_dataloader(self):
         # OPTIONAL
-        _, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath)
+        _, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath,img_res=self.hparams.img_res)
         return DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
                             shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            drop_last=False)
+
+    def summary_views(self, input_batch, output):
+        """ CPU copies of the logged samples, rendered by render_summary """
+        return [
+            summary_view(input_batch, output, self.get_renderer(output['pred_vertices_cam']), 'im0', 'pred_vertices_cam', 'pred_cam_t')]
 
     def summaries(self, input_batch,output, losses, is_test):
-        batch_size = input_batch['im0'].shape[0]
-        skip_factor = 4    # number of samples to be logged
-        img_downsize_factor = 5
-        
-        
-        with torch.no_grad():
-            im = input_batch['im0'][::int(batch_size/skip_factor)] * torch.tensor([0.229, 0.224, 0.225], device=self.device).reshape(1,3,1,1)
-            im = im + torch.tensor([0.485, 0.456, 0.406], device=self.device).reshape(1,3,1,1)
-            # images = []
-            # for i in range(0,batch_size,int(batch_size/skip_factor)):
-            #     images.append(torch.from_numpy(cv2.imread(input_batch['im1_path'][i])[:,:,::-1]/255.).permute(2,0,1).float())
-            pred_vertices_cam = output['pred_vertices_cam'][::int(batch_size/skip_factor)]
-            pred_cam_t = output['pred_cam_t'][::int(batch_size/skip_factor)]
-            # pred_vertices_cam = input_batch['smpl_vertices_rel'][::int(batch_size/skip_factor)].squeeze(1)
-            
-            images_pred_cam = self.renderer.visualize_tb(pred_vertices_cam,
-                                                        pred_cam_t,
-                                                        torch.eye(3,device=self._device).float().unsqueeze(0).repeat(batch_size,1,1),
-                                                        im)
-            
-            summ_pred_image = images_pred_cam
-            
-            summ_in_image = torchvision.utils.make_grid(im)
-            # import ipdb; ipdb.set_trace()
-            if is_test and self.hparams.testdata.lower() == "aircapdata":
-                import ipdb; ipdb.set_trace()
-            
-            return summ_pred_image, summ_in_image
+        summ_pred_image, summ_in_image = render_summary(self.summary_views(input_batch, output))
+        if is_test and self.hparams.testdata.lower() == "aircapdata":
+            import ipdb; ipdb.set_trace()
+
+        return summ_pred_image, summ_in_image
+
+    def log_summaries(self, prefix, input_batch, output):
+        """ queue the image summaries on the summary worker, or render them here with --sync_summaries """
+        if self.global_rank != 0:
+            return
+        views = self.summary_views(input_batch, output)
+        if self.hparams.get("sync_summaries", False):
+            summ_pred_image, summ_in_image = render_summary(views)
+            self.logger.experiment.add_image(prefix + '_pred_shape_cam', summ_pred_image, self.global_step)
+            self.logger.experiment.add_image(prefix + '_input_images', summ_in_image, self.global_step)
+            return
+        if self.summary_worker is None:
+            self.summary_worker = SummaryWorker(self.logger.log_dir, self.hparams.get("summary_queue", 2))
+        self.summary_worker.submit(prefix, self.global_step, views)
+
+    def on_fit_end(self):
+        if self.summary_worker is not None:
+            self.summary_worker.close()
+            print("image summaries: {} rendered, {} dropped".format(self.summary_worker.n_submitted, self.summary_worker.n_dropped))
+            self.summary_worker = None
 
 
     def test_dataloader(self):
@@ -334,22 +356,25 @@ class hmr(pl.LightningModule):
                                 pin_memory=self.hparams.pin_memory,
                                 drop_last=False)
         else:
-            train_dset, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath)
+            train_dset, val_dset = aerialpeople.get_aerialpeople_seqsplit(self.hparams.datapath,img_res=self.hparams.img_res)
             train_dloader = DataLoader(train_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
             test_dloader = DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
 
             return [test_dloader, train_dloader]
 
 
 
+    def on_test_epoch_start(self):
+        self.evaluator = test_evaluator(self, views=[""], body_model=smplx_body)
+
     def test_step(self, batch, batch_idx, dset_idx=0):
         # OPTIONAL
         output, losses, loss = self.fwd_pass_and_loss(batch,is_test=True, is_val=True)
@@ -358,34 +383,14 @@ class hmr(pl.LightningModule):
         # if self.hparams.testdata.lower() == "aircapdata":
         # train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=True)
         # cv2.imwrite(train_summ_pred_image.permute(1,2,0).data.numpy())
-        return {"test_loss" : loss,
-                "output" : output}
+        # metrics and spilled fields are accumulated here, the outputs are not kept until test_epoch_end
+        self.evaluator.update(dset_idx, output)
+        return {"test_loss" : loss}
 
 
     def test_epoch_end(self, outputs):
-        # OPTIONAL
-        test_err_smpltrans = np.array([(x["output"]["pred_smpltrans"] - 
-            x["output"]["gt_smpltrans"]).cpu().numpy() for x in outputs[0]]).reshape(-1,3)
-        test_err_smplangles = np.array([(x["output"]["pred_angles"] - 
-            x["output"]["gt_angles"]).cpu().numpy() for x in outputs[0]]).reshape(-1,22,3)
-
-        mean_test_err_smpltrans = np.mean(np.sqrt(np.sum(test_err_smpltrans**2,1)))
-        mean_test_err_smplangles = np.mean(np.sqrt(np.sum(test_err_smplangles**2,2)))
-
-        train_err_smpltrans = np.array([(x["output"]["pred_smpltrans"] - 
-            x["output"]["gt_smpltrans"]).cpu().numpy() for x in outputs[1]]).reshape(-1,3)
-        train_err_smplangles = np.array([(x["output"]["pred_angles"] - 
-            x["output"]["gt_angles"]).cpu().numpy() for x in outputs[1]]).reshape(-1,22,3)
-
-        mean_train_err_smpltrans = np.mean(np.sqrt(np.sum(train_err_smpltrans**2,1)))
-        mean_train_err_smplangles = np.mean(np.sqrt(np.sum(train_err_smplangles**2,2)))
-
-        print("mean_test_err_smpltrans: {}".format(mean_test_err_smpltrans))
-        print("mean_test_err_smplangles: {}".format(mean_test_err_smplangles))
-        print("mean_train_err_smpltrans: {}".format(mean_train_err_smpltrans))
-        print("mean_train_err_smplangles: {}".format(mean_train_err_smplangles))
-        import ipdb; ipdb.set_trace()
-        # return {"outputs":outputs}
+        # test set and training set, or only the aircap set
+        self.evaluator.log(self)
 
 
     @staticmethod
@@ -415,13 +420,28 @@ class hmr(pl.LightningModule):
         train.add_argument('--testdata', type=str, default="aerialpeople", help='test dataset')
         train.add_argument('--log_dir', default='/is/cluster/nsaini/copenet_logs', help='Directory to store logs')
         train.add_argument("--lr", type=float, default=5e-5, help="Learning rate")
+        amp = train.add_mutually_exclusive_group()
+        amp.add_argument('--fp16', action='store_true', help='backbone and regressor in float16 autocast (cuda) with loss scaling, SMPL-X and the losses in fp32')
+        amp.add_argument('--bf16', action='store_true', help='backbone and regressor in bfloat16 autocast (torch >= 1.10), SMPL-X and the losses in fp32')
         train.add_argument('--batch_size', type=int, default=30, help='Batch size')
         train.add_argument('--val_batch_size', type=int, default=30, help='Validation data batch size')
+        train.add_argument('--eval_chunk', type=int, default=1024, help='frames per joints-only SMPL-X forward of the test evaluation')
+        train.add_argument('--eval_spill_fields', type=str, default='', help='comma separated test outputs (e.g. pred_vertices_cam0) written to the result store in eval_spill_dir')
+        train.add_argument('--eval_spill_dir', type=str, default=None, help='result store of the spilled test outputs, <log dir>/test_results by default')
+        train.add_argument('--eval_spill_dtype', type=str, default='float16', help='dtype of the spilled floating point fields, none keeps it')
         train.add_argument('--summary_steps', type=int, default=100, help='Summary saving frequency')
         train.add_argument('--val_summary_steps', type=float, default=10, help='validation summary frequency')
+        train.add_argument('--val_subset_steps', type=int, default=0, help='validation on a stratified subset every this many training steps, 0 disables it')
+        train.add_argument('--val_subset_size', type=int, default=500, help='number of samples of the validation subset')
+        train.add_argument('--val_subset_dist_bins', type=int, default=4, help='camera distance bins the subset is stratified on, besides the subject')
+        train.add_argument('--val_monitor', type=str, default='full', choices=['full','subset'], help='validation pass logged as val_loss (the checkpoint monitor)')
+        train.add_argument('--sync_summaries', action='store_true', help='render the image summaries in the training loop instead of the summary worker')
+        train.add_argument('--summary_queue', type=int, default=2, help='image summaries waiting for the summary worker, more are dropped')
         train.add_argument('--checkpoint_steps', type=int, default=10000, help='Checkpoint saving frequency')
         train.add_argument('--img_res', type=int, default=224, help='Rescale bounding boxes to size [img_res, img_res] before feeding them in the network') 
         train.add_argument('--shape_loss_weight', default=1, type=float, help='Weight of per-vertex loss') 
+        train.add_argument('--full_body_loss', action='store_true', help='Compute the training and validation losses on the full SMPL-X instead of the body-only model')
+        train.add_argument('--no_pose_blend', action='store_true', help='Skip the pose corrective blend shapes of the body-only model, faster but less accurate')
         train.add_argument('--keypoint2d_loss_weight', default=0.001, type=float, help='Weight of 2D keypoint loss')
         train.add_argument('--keypoint3d_loss_weight', default=1, type=float, help='Weight of 3D keypoint loss')
         train.add_argument('--limbs3d_loss_weight', default=3., type=float, help='Weight of limbs 3D keypoint loss')
@@ -3,8 +3,31 @@ import torch.nn as nn
 import torchvision.models.resnet as resnet
 import numpy as np
 import math
+from torch.utils.checkpoint import checkpoint
 from ..utils.geometry import rot6d_to_rotmat
 
+def checkpoint_bn(layer, x):
+    """
+    checkpoint(layer, x) with the BatchNorm running stats updated once per step. The backward
+    recomputes the layer in train mode, which would update them a second time, so they are restored
+    after the recomputation (its outputs only use the batch stats)
+    """
+    def run(x):
+        # checkpoint runs the forward under no_grad and the recomputation with grad enabled
+        if not torch.is_grad_enabled():
+            return layer(x)
+        bns = [m for m in layer.modules()
+                if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training and m.track_running_stats]
+        saved = [(m.running_mean.clone(), m.running_var.clone(), m.num_batches_tracked.clone()) for m in bns]
+        out = layer(x)
+        with torch.no_grad():
+            for m, (mean, var, n) in zip(bns, saved):
+                m.running_mean.copy_(mean)
+                m.running_var.copy_(var)
+                m.num_batches_tracked.copy_(n)
+        return out
+    return checkpoint(run, x)
+
 class Bottleneck(nn.Module):
     """ Redefinition of Bottleneck residual block
         Adapted from the official PyTorch implementation
@@ -63,7 +86,9 @@ class copenet(nn.Module):
         self.layer2 = self._make_layer(block, 128, layers[1], stride=2)
         self.layer3 = self._make_layer(block, 256, layers[2], stride=2)
         self.layer4 = self._make_layer(block, 512, layers[3], stride=2)
-        self.avgpool = nn.AvgPool2d(7, stride=1)
+        # recompute layer1..layer4 in the backward instead of keeping their activations
+        self.checkpoint_backbone = False
+        self.avgpool = nn.AdaptiveAvgPool2d(1)
         self.fc1 = nn.Linear(512 * block.expansion + 3 + 3 + 6 + npose + 10 + npose + 10, 1024)
         self.drop1 = nn.Dropout()
         self.fc2 = nn.Linear(1024, 1024)
@@ -114,8 +139,16 @@ class copenet(nn.Module):
                  init_position0, init_position1,
                  init_theta0=None, init_theta1=None, 
                  init_shape0=None, init_shape1=None, 
-                 iters = 3):
-        batch_size = x0.shape[0]
+                 iters = 3, exit_threshold = None,
+                 xf0 = None, xf1 = None):
+        """
+        exit_threshold: if given, a sample stops iterating once the max abs change of its
+        position/pose/shape in both views falls below it. Finished samples are removed
+        from the active set so they cost no more regressor FLOPs. The number of
+        iterations run per sample is stored in self.n_iters.
+        xf0, xf1: precomputed forward_feat_ext features, x0 and x1 are not used then
+        """
+        batch_size = bb0.shape[0]
 
         
         if init_theta0 is None:
@@ -137,8 +170,10 @@ class copenet(nn.Module):
         
         
          # Feed images in the network to predict camera and SMPL parameters 
-        xf0 = self.forward_feat_ext(x0)
-        xf1 = self.forward_feat_ext(x1)
+        if xf0 is None:
+            xf0 = self.forward_feat_ext(x0)
+        if xf1 is None:
+            xf1 = self.forward_feat_ext(x1)
 
 
         pred_pose0, pred_betas0, pred_pose1, pred_betas1 = self.forward_reg(xf0, xf1,
@@ -148,13 +183,51 @@ class copenet(nn.Module):
                                                 init_art_pose0, init_art_pose1,
                                                 init_shape0, init_shape1)
 
-        for it in range(int(iters)-1):
-            pred_pose0, pred_betas0, pred_pose1, pred_betas1 = self.forward_reg(xf0, xf1,
+        self.n_iters = torch.ones(batch_size, device=bb0.device)
+
+        if exit_threshold is None:
+            for it in range(int(iters)-1):
+                pred_pose0, pred_betas0, pred_pose1, pred_betas1 = self.forward_reg(xf0, xf1,
+                                                        bb0, bb1,
+                                                        pred_pose0[:,:3], pred_pose1[:,:3],
+                                                        pred_pose0[:,3:9], pred_pose1[:,3:9],
+                                                        pred_pose0[:,9:], pred_pose1[:,9:],
+                                                        pred_betas0, pred_betas1)
+            self.n_iters += int(iters)-1
+        else:
+            pred_pose0, pred_betas0, pred_pose1, pred_betas1 = self.forward_reg_adaptive(xf0, xf1,
                                                     bb0, bb1,
-                                                    pred_pose0[:,:3], pred_pose1[:,:3],
-                                                    pred_pose0[:,3:9], pred_pose1[:,3:9],
-                                                    pred_pose0[:,9:], pred_pose1[:,9:],
-                                                    pred_betas0, pred_betas1)
+                                                    pred_pose0, pred_betas0, pred_pose1, pred_betas1,
+                                                    int(iters)-1, exit_threshold)
+
+        return pred_pose0, pred_betas0, pred_pose1, pred_betas1
+
+    def forward_reg_adaptive(self, xf0, xf1,
+                    bb0, bb1,
+                    pred_pose0, pred_betas0, pred_pose1, pred_betas1,
+                    iters, exit_threshold):
+        pred_pose0, pred_betas0 = pred_pose0.clone(), pred_betas0.clone()
+        pred_pose1, pred_betas1 = pred_pose1.clone(), pred_betas1.clone()
+        active = torch.arange(xf0.shape[0], device=xf0.device)
+
+        for it in range(iters):
+            if len(active) == 0:
+                break
+            prev_pose0, prev_betas0 = pred_pose0[active], pred_betas0[active]
+            prev_pose1, prev_betas1 = pred_pose1[active], pred_betas1[active]
+            new_pose0, new_betas0, new_pose1, new_betas1 = self.forward_reg(xf0[active], xf1[active],
+                                                    bb0[active], bb1[active],
+                                                    prev_pose0[:,:3], prev_pose1[:,:3],
+                                                    prev_pose0[:,3:9], prev_pose1[:,3:9],
+                                                    prev_pose0[:,9:], prev_pose1[:,9:],
+                                                    prev_betas0, prev_betas1)
+            pred_pose0[active], pred_betas0[active] = new_pose0, new_betas0
+            pred_pose1[active], pred_betas1[active] = new_pose1, new_betas1
+            self.n_iters[active] += 1
+
+            delta = torch.cat([new_pose0 - prev_pose0, new_betas0 - prev_betas0,
+                               new_pose1 - prev_pose1, new_betas1 - prev_betas1],1).abs().max(1)[0]
+            active = active[delta >= exit_threshold]
 
         return pred_pose0, pred_betas0, pred_pose1, pred_betas1
 
@@ -165,10 +238,16 @@ class copenet(nn.Module):
         x = self.relu(x)
         x = self.maxpool(x)
 
-        x1 = self.layer1(x)
-        x2 = self.layer2(x1)
-        x3 = self.layer3(x2)
-        x4 = self.layer4(x3)
+        if self.checkpoint_backbone and torch.is_grad_enabled() and x.requires_grad:
+            x1 = checkpoint_bn(self.layer1, x)
+            x2 = checkpoint_bn(self.layer2, x1)
+            x3 = checkpoint_bn(self.layer3, x2)
+            x4 = checkpoint_bn(self.layer4, x3)
+        else:
+            x1 = self.layer1(x)
+            x2 = self.layer2(x1)
+            x3 = self.layer3(x2)
+            x4 = self.layer4(x3)
 
         xf = self.avgpool(x4)
         xf = xf.view(xf.size(0), -1)
@@ -205,6 +284,21 @@ class copenet(nn.Module):
         
         # pred_rotmat = rot6d_to_rotmat(pred_pose).view(batch_size, 24, 3, 3)
 
+    def forward_reg_view(self, xf, bb,
+                    pred_position, pred_orient, pred_art_pose, pred_shape,
+                    peer_art_pose, peer_shape):
+        """ one view's half of forward_reg, the peer view only contributes its art pose and shape """
+        xc = torch.cat([xf, bb, pred_position, pred_orient, pred_art_pose, pred_shape, peer_art_pose, peer_shape],1)
+        xc = self.fc1(xc)
+        xc = self.drop1(xc)
+        xc = self.fc2(xc)
+        xc = self.drop2(xc)
+
+        pred_shape = pred_shape + self.decshape(xc)
+        pred_pose = torch.cat([pred_position, pred_orient, pred_art_pose],1) + self.decpose(xc)
+
+        return pred_pose, pred_shape
+
     def create_ftl_mat(self, batch_size, extr_inv, bb):
         mat = torch.zeros((batch_size, 15,15),device=extr_inv.device).float()
         mat[:,:3,:3] = extr_inv[:,:3,:3]
@@ -0,0 +1,376 @@
+import os
+import collections
+import pickle as pk
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+import torch.nn.functional as F
+
+from ..smplx.smplx import SMPLX
+from .geometry import batch_rodrigues
+
+"""
+One SMPL-X body model per device, usable with any batch size. SMPLX keeps its default parameters
+(expression, hand, jaw and eye poses, ...) with batch_size rows and fails for any other batch
+size, so the model is created with batch_size=1 and the defaults of the parameters which are
+not passed are expanded to the batch size of the call. BodyOnlySMPLX is the same model reduced to
+the body vertices and joints, for the losses, JointsOnlySMPLX only poses the joints, for the
+consumers which never look at the vertices, and ShapeCalibratedSMPLX caches the shape of tracked
+subjects for streaming.
+"""
+
+NUM_BODY_JOINTS = 22
+
+SMPLX_PARAMS = ["betas", "global_orient", "body_pose", "left_hand_pose", "right_hand_pose",
+                    "jaw_pose", "leye_pose", "reye_pose", "expression", "transl"]
+
+_instances = {}
+
+
+class SMPLXAnyBatch(SMPLX):
+    def __init__(self, model_path, **kwargs):
+        kwargs["batch_size"] = 1
+        super(SMPLXAnyBatch, self).__init__(model_path, **kwargs)
+
+    def forward(self, **kwargs):
+        given = [kwargs[k] for k in SMPLX_PARAMS if torch.is_tensor(kwargs.get(k))]
+        batch_size = max([v.shape[0] for v in given]) if len(given) > 0 else 1
+        for k in SMPLX_PARAMS:
+            default = getattr(self, k, None)
+            if kwargs.get(k) is None and torch.is_tensor(default):
+                kwargs[k] = default[:1].expand(batch_size, *default.shape[1:]).contiguous()
+        # anything in SMPLX still sized by self.batch_size follows the call
+        self.batch_size = batch_size
+        return super(SMPLXAnyBatch, self).forward(**kwargs)
+
+
+BodyOutput = collections.namedtuple("BodyOutput", ["vertices", "joints"])
+
+
+def kinematic_chain(rot_mats, joints, parents):
+    """ world transforms [B,J,4,4] of the rest pose joints [B,J,3] posed with the relative rotations [B,J,3,3] """
+    rel_joints = joints.clone()
+    rel_joints[:,1:] -= joints[:,parents[1:]]
+    transforms_mat = torch.cat([F.pad(rot_mats,[0,0,0,1]),
+                                F.pad(rel_joints.unsqueeze(-1),[0,0,0,1],value=1)],dim=3)
+    parents = parents.tolist()
+    chain = [transforms_mat[:,0]]
+    for i in range(1,len(parents)):
+        chain.append(torch.matmul(chain[parents[i]],transforms_mat[:,i]))
+    return torch.stack(chain,dim=1)
+
+
+def rigid_transforms(rot_mats, joints, parents):
+    """
+    kinematic chain of the rest pose joints [B,J,3] with the relative rotations [B,J,3,3].
+    Returns the posed joints [B,J,3] and the skinning transforms [B,J,4,4]
+    """
+    transforms = kinematic_chain(rot_mats, joints, parents)
+    posed_joints = transforms[:,:,:3,3]
+    rel_transforms = transforms - F.pad(torch.matmul(transforms,F.pad(joints,[0,1]).unsqueeze(-1)),[3,0,0,0,0,0,0,0])
+    return posed_joints, rel_transforms
+
+
+def posed_joints(rot_mats, joints, parents):
+    """
+    posed joints [B,J,3] of the rest pose joints [B,J,3] with the relative rotations [B,J,3,3].
+    Only rotations and positions are chained, no 4x4 transforms and no skinning transforms
+    """
+    parents = parents.tolist()
+    rel_joints = joints[:,1:] - joints[:,parents[1:]]
+    rots = [rot_mats[:,0]]
+    posed = [joints[:,0]]
+    for i in range(1,len(parents)):
+        posed.append(posed[parents[i]] + torch.matmul(rots[parents[i]],rel_joints[:,i-1].unsqueeze(-1)).squeeze(-1))
+        rots.append(torch.matmul(rots[parents[i]],rot_mats[:,i]))
+    return torch.stack(posed,dim=1)
+
+
+def sparse_regressor(regressor):
+    """
+    sparse (COO) copy of a dense [J,V] vertex regressor (J_regressor, SMPLX_to_J14), mostly zeros.
+    COO and torch.sparse.mm are in every supported torch, CSR (to_sparse_csr) only from torch 1.10
+    """
+    return regressor.to_sparse().coalesce()
+
+
+def regress_joints(regressor, vertices):
+    """ joints [B,J,3] of vertices [B,V,3] with a dense or sparse (COO) [J,V] regressor """
+    if regressor.layout == torch.strided:
+        return torch.einsum("jv,bvk->bjk", regressor, vertices)
+    batch_size, num_verts = vertices.shape[:2]
+    joints = torch.sparse.mm(regressor, vertices.permute(1,0,2).reshape(num_verts,batch_size*3))
+    return joints.view(-1,batch_size,3).permute(1,0,2)
+
+
+class JointsOnlySMPLX(nn.Module):
+    """
+    Forward kinematics of the first num_joints SMPL-X joints without any vertex: the shape blend
+    shapes are applied to the joint regressor (J_regressor @ shapedirs) and the rest joints are
+    posed along the kinematic chain. For the same betas and body pose the joints are those of the
+    full model at [:num_joints]. Jaw and eyes (num_joints up to 25) stay at their zero default pose,
+    the hand joints would depend on the hand pose and are not supported.
+    """
+    def __init__(self, smplx, num_joints=NUM_BODY_JOINTS):
+        super(JointsOnlySMPLX, self).__init__()
+        assert num_joints <= NUM_BODY_JOINTS + 3, "only the body, jaw and eye joints"
+        self.num_joints = num_joints
+        num_betas = getattr(smplx, "num_betas", 10)
+        with torch.no_grad():
+            shapedirs = smplx.shapedirs[:,:,:num_betas]
+            J_regressor = smplx.J_regressor[:num_joints]
+        self.register_buffer("parents", smplx.parents[:num_joints].clone())
+        self.register_buffer("J_template", torch.matmul(J_regressor, smplx.v_template))
+        self.register_buffer("J_shapedirs", torch.einsum("jv,vkl->jkl", J_regressor, shapedirs))
+
+    def rot_mats(self, body_pose, global_orient, pose2rot=True):
+        """ [B,num_joints,3,3] relative rotations, identity past the body """
+        batch_size = body_pose.shape[0]
+        if pose2rot:
+            body_pose = batch_rodrigues(body_pose.reshape(-1,3)).view(batch_size,-1,3,3)
+            global_orient = batch_rodrigues(global_orient.reshape(-1,3)).view(batch_size,1,3,3)
+        rot_mats = torch.cat([global_orient.reshape(batch_size,1,3,3), body_pose.reshape(batch_size,-1,3,3)],dim=1)
+        if self.num_joints > NUM_BODY_JOINTS:
+            eye = torch.eye(3).type_as(rot_mats).expand(batch_size,self.num_joints-NUM_BODY_JOINTS,3,3)
+            rot_mats = torch.cat([rot_mats,eye],dim=1)
+        return rot_mats
+
+    def rest_joints(self, betas):
+        return self.J_template + torch.einsum("bl,jkl->bjk", betas, self.J_shapedirs)
+
+    def forward(self, betas=None, body_pose=None, global_orient=None, transl=None, pose2rot=True, **kwargs):
+        """ same arguments as SMPLX.forward for the body, returns vertices None and joints [B,num_joints,3] """
+        rot_mats = self.rot_mats(body_pose, global_orient, pose2rot)
+        if betas is None:
+            betas = torch.zeros(rot_mats.shape[0],self.J_shapedirs.shape[2]).type_as(rot_mats)
+        joints = posed_joints(rot_mats, self.rest_joints(betas), self.parents)
+        if transl is not None:
+            joints = joints + transl.unsqueeze(1)
+        return BodyOutput(None, joints)
+
+
+class BodyOnlySMPLX(JointsOnlySMPLX):
+    """
+    SMPL-X reduced to the body: the vertices outside the hands and the face and the 22 body joints.
+    Hands, face and expression are kept at the defaults of the full model, which are folded into
+    the template, so for the same betas and body pose the vertices and joints are those of the
+    full model at vertex_idx and [:22]. Hand and face joints keep their parent's transform, so
+    their skinning weights are added to their closest body ancestor.
+    pose_blend=False skips the pose corrective blend shapes, a faster but less accurate mode.
+    """
+    def __init__(self, smplx, vertex_idx, pose_blend=True):
+        super(BodyOnlySMPLX, self).__init__(smplx, NUM_BODY_JOINTS)
+        self.pose_blend = pose_blend
+        vertex_idx = torch.as_tensor(vertex_idx).long().to(smplx.v_template.device)
+        num_verts = smplx.v_template.shape[0]
+        num_betas = getattr(smplx, "num_betas", 10)
+
+        with torch.no_grad():
+            eye = torch.eye(3).type_as(smplx.v_template)
+            rest = smplx.forward(betas=torch.zeros(1,num_betas).type_as(smplx.v_template),
+                                body_pose=eye.expand(1,NUM_BODY_JOINTS-1,3,3).contiguous(),
+                                global_orient=eye.expand(1,1,3,3).contiguous(),
+                                transl=torch.zeros(1,3).type_as(smplx.v_template),
+                                pose2rot=False)
+            shapedirs = smplx.shapedirs[:,:,:num_betas]
+            posedirs = smplx.posedirs.view(-1,num_verts,3)[:(NUM_BODY_JOINTS-1)*9,vertex_idx]
+
+            lbs_weights = smplx.lbs_weights.clone()
+            for j in range(NUM_BODY_JOINTS, lbs_weights.shape[1]):
+                ancestor = j
+                while ancestor >= NUM_BODY_JOINTS:
+                    ancestor = int(smplx.parents[ancestor])
+                lbs_weights[:,ancestor] += lbs_weights[:,j]
+
+            faces = torch.as_tensor(np.asarray(smplx.faces,dtype=np.int64))
+            new_idx = -torch.ones(num_verts).long()
+            new_idx[vertex_idx.cpu()] = torch.arange(vertex_idx.shape[0])
+            faces = new_idx[faces]
+            faces = faces[(faces >= 0).all(1)]
+
+        self.register_buffer("vertex_idx", vertex_idx)
+        self.register_buffer("v_template", rest.vertices[0,vertex_idx].clone())
+        self.register_buffer("shapedirs", shapedirs[vertex_idx].clone())
+        self.register_buffer("posedirs", posedirs.reshape(posedirs.shape[0],-1).clone())
+        self.register_buffer("lbs_weights", lbs_weights[vertex_idx,:NUM_BODY_JOINTS].clone())
+        self.faces = faces.numpy()
+
+    def forward(self, betas, body_pose, global_orient, transl=None, pose2rot=True, **kwargs):
+        """ same arguments as SMPLX.forward for the body, returns vertices [B,V_body,3] and joints [B,22,3] """
+        batch_size = betas.shape[0]
+        rot_mats = self.rot_mats(body_pose, global_orient, pose2rot)
+
+        v_posed = self.v_template + torch.einsum("bl,vkl->bvk", betas, self.shapedirs)
+        J = self.rest_joints(betas)
+        if self.pose_blend:
+            pose_feature = (rot_mats[:,1:] - torch.eye(3).type_as(rot_mats)).view(batch_size,-1)
+            v_posed = v_posed + torch.matmul(pose_feature, self.posedirs).view(batch_size,-1,3)
+
+        joints, A = rigid_transforms(rot_mats, J, self.parents)
+        T = torch.matmul(self.lbs_weights, A.view(batch_size,NUM_BODY_JOINTS,16)).view(batch_size,-1,4,4)
+        vertices = torch.matmul(T[:,:,:3,:3], v_posed.unsqueeze(-1)).squeeze(-1) + T[:,:,:3,3]
+
+        if transl is not None:
+            vertices = vertices + transl.unsqueeze(1)
+            joints = joints + transl.unsqueeze(1)
+        return BodyOutput(vertices, joints)
+
+    def forward_joints(self, *args, **kwargs):
+        """ the joints of forward without skinning the vertices """
+        return JointsOnlySMPLX.forward(self, *args, **kwargs)
+
+
+class ShapeCalibratedSMPLX(nn.Module):
+    """
+    SMPL-X with the shape frozen per tracked subject, for streaming. The betas of the first
+    calib_frames frames of a subject are averaged, then its shaped template v_shaped and rest
+    joints J are computed once and the later frames only run the pose blend shapes and the
+    skinning, whatever betas they come with. Jaw, eyes, hands and expression stay at the defaults
+    of the full model, their constant pose blend shapes are added to the shaped template for the
+    skinning only, J is regressed from v_template + shape blend shapes as in SMPL-X.
+    sparse keeps J_regressor sparse (COO), pose_blend=False skips the pose corrective blend shapes.
+    """
+    def __init__(self, smplx, calib_frames=30, sparse=True, pose_blend=True):
+        super(ShapeCalibratedSMPLX, self).__init__()
+        self.calib_frames = calib_frames
+        self.pose_blend = pose_blend
+        num_verts = smplx.v_template.shape[0]
+        num_betas = getattr(smplx, "num_betas", 10)
+        num_joints = smplx.J_regressor.shape[0]
+        with torch.no_grad():
+            # default rotations of jaw, eyes and the hands (flat or mean hand pose)
+            default_pose = torch.zeros(num_joints-NUM_BODY_JOINTS,3).type_as(smplx.v_template)
+            for name, offset in [("left_hand_mean",3), ("right_hand_mean",18)]:
+                hand_mean = getattr(smplx, name, None)
+                if torch.is_tensor(hand_mean):
+                    default_pose[offset:offset+15] = hand_mean.reshape(15,3)
+            default_rot_mats = batch_rodrigues(default_pose)
+            posedirs = smplx.posedirs.view(-1,num_verts*3)
+            default_feature = (default_rot_mats - torch.eye(3).type_as(default_rot_mats)).view(1,-1)
+            default_offsets = torch.matmul(default_feature, posedirs[(NUM_BODY_JOINTS-1)*9:]).view(num_verts,3)
+
+        self.register_buffer("v_template", smplx.v_template.clone())
+        self.register_buffer("default_offsets", default_offsets)
+        self.register_buffer("shapedirs", smplx.shapedirs[:,:,:num_betas].clone())
+        self.register_buffer("J_regressor", sparse_regressor(smplx.J_regressor) if sparse else smplx.J_regressor.clone())
+        self.register_buffer("posedirs", posedirs[:(NUM_BODY_JOINTS-1)*9].clone())
+        self.register_buffer("default_rot_mats", default_rot_mats)
+        self.register_buffer("lbs_weights", smplx.lbs_weights.clone())
+        self.register_buffer("parents", smplx.parents.clone())
+        self.faces = smplx.faces
+        self.subjects = {}
+
+    def reset(self, subject=None):
+        """ forget the shape of one subject, or of all """
+        if subject is None:
+            self.subjects = {}
+        else:
+            self.subjects.pop(subject, None)
+
+    def is_calibrated(self, subject):
+        return "v_shaped" in self.subjects.get(subject, {})
+
+    def shape(self, betas):
+        """
+        template of betas [B,num_betas] with the default pose offsets [B,V,3], skinned by forward,
+        and its rest joints [B,J,3], regressed without the offsets as in SMPL-X
+        """
+        v_shaped = self.v_template + torch.einsum("bl,vkl->bvk", betas, self.shapedirs)
+        return v_shaped + self.default_offsets, regress_joints(self.J_regressor, v_shaped)
+
+    def shaped(self, subject, betas):
+        """
+        v_shaped [B,V,3] and J [B,J,3] of the subject: the cached ones once calibrated, otherwise
+        those of betas [B,num_betas], which are added to the subject's running mean
+        """
+        state = self.subjects.setdefault(subject, {"betas_sum":0, "n":0})
+        batch_size = betas.shape[0]
+        if "v_shaped" in state:
+            return state["v_shaped"].expand(batch_size,-1,-1), state["J"].expand(batch_size,-1,-1)
+
+        state["betas_sum"] = state["betas_sum"] + betas.detach().sum(0)
+        state["n"] += batch_size
+        if state["n"] >= self.calib_frames:
+            betas_mean = (state["betas_sum"]/state["n"]).unsqueeze(0)
+            state["v_shaped"], state["J"] = self.shape(betas_mean)
+            return self.shaped(subject, betas)
+        return self.shape(betas)
+
+    def forward(self, subject, betas, body_pose, global_orient, transl=None, pose2rot=True, **kwargs):
+        """ SMPLX.forward of the subject's frozen shape, returns vertices [B,V,3] and joints [B,J,3] """
+        batch_size = betas.shape[0]
+        if pose2rot:
+            body_pose = batch_rodrigues(body_pose.reshape(-1,3)).view(batch_size,-1,3,3)
+            global_orient = batch_rodrigues(global_orient.reshape(-1,3)).view(batch_size,1,3,3)
+        rot_mats = torch.cat([global_orient.reshape(batch_size,1,3,3),
+                                body_pose.reshape(batch_size,-1,3,3),
+                                self.default_rot_mats.expand(batch_size,-1,-1,-1)],dim=1)
+
+        v_posed, J = self.shaped(subject, betas)
+        if self.pose_blend:
+            pose_feature = (rot_mats[:,1:NUM_BODY_JOINTS] - torch.eye(3).type_as(rot_mats)).view(batch_size,-1)
+            v_posed = v_posed + torch.matmul(pose_feature, self.posedirs).view(batch_size,-1,3)
+
+        joints, A = rigid_transforms(rot_mats, J, self.parents)
+        T = torch.matmul(self.lbs_weights, A.view(batch_size,A.shape[1],16)).view(batch_size,-1,4,4)
+        vertices = torch.matmul(T[:,:,:3,:3], v_posed.unsqueeze(-1)).squeeze(-1) + T[:,:,:3,3]
+
+        if transl is not None:
+            vertices = vertices + transl.unsqueeze(1)
+            joints = joints + transl.unsqueeze(1)
+        return BodyOutput(vertices, joints)
+
+
+def body_vertex_idx(copenet_home, num_verts):
+    """ indices of the SMPL-X vertices outside the hands and the face """
+    data_dir = os.path.join(copenet_home,"src/copenet/data/smplx")
+    smplx_hand_idx = pk.load(open(os.path.join(data_dir,"MANO_SMPLX_vertex_ids.pkl"),'rb'))
+    smplx_face_idx = np.load(os.path.join(data_dir,"SMPL-X__FLAME_vertex_ids.npy"))
+    mask = np.ones(num_verts, dtype=bool)
+    mask[smplx_hand_idx['left_hand']] = False
+    mask[smplx_hand_idx['right_hand']] = False
+    mask[smplx_face_idx] = False
+    return np.where(mask)[0]
+
+
+def get_smplx_body(copenet_home, device, pose_blend=True):
+    """ shared BodyOnlySMPLX of the model in copenet_home, created once per device """
+    key = ("body", os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"), str(device), pose_blend)
+    if key not in _instances:
+        smplx = get_smplx(copenet_home, device)
+        _instances[key] = BodyOnlySMPLX(smplx, body_vertex_idx(copenet_home, smplx.v_template.shape[0]), pose_blend).to(device)
+    return _instances[key]
+
+
+def get_smplx(copenet_home, device, create_transl=False):
+    """ shared SMPLXAnyBatch of the model in copenet_home, created once per device """
+    model_path = os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx")
+    key = (model_path, str(device), create_transl)
+    if key not in _instances:
+        _instances[key] = SMPLXAnyBatch(model_path, create_transl=create_transl).to(device)
+    return _instances[key]
+
+
+def get_smplx_joints(copenet_home, device, num_joints=NUM_BODY_JOINTS):
+    """ shared JointsOnlySMPLX of the model in copenet_home, created once per device """
+    key = ("joints", os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"), str(device), num_joints)
+    if key not in _instances:
+        _instances[key] = JointsOnlySMPLX(get_smplx(copenet_home, device), num_joints).to(device)
+    return _instances[key]
+
+
+def checkpointed_forward(body_model, betas, body_pose, global_orient, transl, pose2rot=False):
+    """
+    body_model.forward with activation checkpointing, only the inputs are kept for the backward and
+    the skinning is recomputed there. Without autograd it is the plain forward.
+    """
+    def run(betas, body_pose, global_orient, transl):
+        out = body_model.forward(betas=betas, body_pose=body_pose, global_orient=global_orient,
+                                    transl=transl, pose2rot=pose2rot)
+        return tuple(x for x in (out.vertices, out.joints) if x is not None)
+    if torch.is_grad_enabled() and any(x.requires_grad for x in (betas, body_pose, global_orient)):
+        outputs = checkpoint(run, betas, body_pose, global_orient, transl)
+    else:
+        outputs = run(betas, body_pose, global_orient, transl)
+    return BodyOutput(*outputs) if len(outputs) == 2 else BodyOutput(None, outputs[0])
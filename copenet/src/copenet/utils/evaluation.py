@@ -0,0 +1,197 @@
+import os
+import numpy as np
+import torch
+
+from .body_model import NUM_BODY_JOINTS
+from .result_store import ResultWriter
+
+"""
+Evaluation of the test splits, streamed over the test steps. StreamingEvaluator.update takes the
+output of a test step: the small fields the metrics need (angles, rotations, translations) are
+buffered and evaluated every chunk frames, with the joints of ground truth and prediction from a
+joints-only SMPL-X forward (forward_joints), and only the per-split sums are kept. Fields asked
+for in spill_fields (e.g. pred_vertices_cam0) are written to the result store (result_store.py) in
+spill_dir as they come, so the memory does not grow with the size of the split.
+
+mpjpe      mean per joint position error of the first 22 joints
+pa_mpjpe   the same after a similarity (Procrustes) alignment of every frame
+per_joint  mpjpe of every joint
+mpe        translation error, L2 of the smpl translation
+angle_err  L2 of the angle-axis difference, mean over the joints
+
+Views are the suffixes of the output keys, "0" and "1" of the two view models and "" of the single
+view ones. A metric is left out where its ground truth is not in the outputs (e.g. aircap).
+"""
+
+def batched_joints(body_model, body_pose, global_orient, pose2rot, chunk, device):
+    """ [N,22,3] joints of body_model.forward_joints, chunk frames per forward """
+    joints = []
+    with torch.no_grad():
+        for i in range(0, body_pose.shape[0], chunk):
+            out = body_model.forward_joints(body_pose=body_pose[i:i+chunk].to(device),
+                                            global_orient=global_orient[i:i+chunk].to(device),
+                                            pose2rot=pose2rot)
+            joints.append(out.joints[:,:NUM_BODY_JOINTS])
+    return torch.cat(joints)
+
+
+def joint_errors(pred, gt):
+    """ [N,J] euclidean distances """
+    return torch.norm(pred - gt, dim=-1)
+
+
+def procrustes_align(pred, gt):
+    """ pred [N,J,3] aligned to gt [N,J,3] with the best scale, rotation and translation of every frame """
+    mu_pred = pred.mean(dim=1, keepdim=True)
+    mu_gt = gt.mean(dim=1, keepdim=True)
+    x = pred - mu_pred
+    y = gt - mu_gt
+    U, _, V = torch.svd(torch.matmul(x.transpose(1,2), y))
+    # no reflections
+    Z = torch.eye(3).type_as(pred).repeat(pred.shape[0],1,1)
+    Z[:,2,2] = torch.sign(torch.det(torch.matmul(U, V.transpose(1,2))))
+    R = torch.matmul(torch.matmul(V, Z), U.transpose(1,2))
+    x_rot = torch.matmul(x, R.transpose(1,2))
+    scale = (x_rot*y).sum(dim=(1,2)) / (x**2).sum(dim=(1,2)).clamp(min=1e-8)
+    return scale.view(-1,1,1)*x_rot + mu_gt
+
+
+def translation_error(pred, gt):
+    """ [N] euclidean distances of the translations """
+    return torch.norm(pred.reshape(-1,3) - gt.reshape(-1,3), dim=-1)
+
+
+def metric_keys(views):
+    """ output keys the metrics of views are computed from """
+    keys = ["smplpose_rotmat"]
+    for v in views:
+        keys += ["pred_angles" + v, "gt_angles" + v, "smplorient_rel" + v, "pred_smpltrans" + v, "gt_smpltrans" + v]
+    return keys
+
+
+def gt_rotations(fields, view):
+    """ ground truth body pose and global orientation, (body_pose, global_orient, pose2rot) """
+    if "smplpose_rotmat" in fields and "smplorient_rel" + view in fields:
+        return fields["smplpose_rotmat"], fields["smplorient_rel" + view], False
+    if "gt_angles" + view in fields:
+        return fields["gt_angles" + view][:,1:], fields["gt_angles" + view][:,:1], True
+    return None
+
+
+def frame_errors(fields, views, body_model, chunk, device):
+    """ {metric + view: errors of every frame}, [N] or [N,22] for the joint metrics """
+    errors = {}
+    for v in views:
+        if "pred_smpltrans" + v in fields and "gt_smpltrans" + v in fields:
+            errors["mpe" + v] = translation_error(fields["pred_smpltrans" + v], fields["gt_smpltrans" + v])
+        if "pred_angles" + v in fields and "gt_angles" + v in fields:
+            angle_diff = fields["pred_angles" + v] - fields["gt_angles" + v]
+            errors["angle_err" + v] = torch.norm(angle_diff.reshape(-1,NUM_BODY_JOINTS,3), dim=-1).mean(dim=-1)
+
+        gt = gt_rotations(fields, v)
+        if gt is None or "pred_angles" + v not in fields:
+            continue
+        gt_joints = batched_joints(body_model, gt[0], gt[1], gt[2], chunk, device)
+        pred_angles = fields["pred_angles" + v].reshape(-1,NUM_BODY_JOINTS,3)
+        pred_joints = batched_joints(body_model, pred_angles[:,1:], pred_angles[:,:1], True, chunk, device)
+        errors["mpjpe" + v] = joint_errors(pred_joints, gt_joints)
+        errors["pa_mpjpe" + v] = joint_errors(procrustes_align(pred_joints, gt_joints), gt_joints)
+    return errors
+
+
+class StreamingEvaluator(object):
+    """
+    views: suffixes of the output keys
+    body_model: model with forward_joints (the module's smplx_body)
+    chunk: frames per joints-only forward, the metric fields of up to chunk frames are buffered
+    spill_dir, spill_fields: fields of the outputs written to the result store in spill_dir
+    spill_dtype: dtype of the spilled floating point fields (e.g. float16), None keeps it
+    split_names: names of the test dataloaders
+    """
+    def __init__(self, views, body_model, chunk=1024, device="cpu", spill_dir=None, spill_fields=(),
+                    spill_dtype=np.float16, split_names=("test","train")):
+        self.views = views
+        self.body_model = body_model
+        self.chunk = chunk
+        self.device = device
+        spill_fields = [f for f in spill_fields if f]
+        self.writer = ResultWriter(spill_dir, fields=spill_fields, dtype=spill_dtype) if spill_fields else None
+        self.split_names = split_names
+        self.keys = metric_keys(views)
+        self.buffers = {}
+        self.buffered = {}
+        self.sums = {}
+        self.counts = {}
+
+    def split_name(self, dset_idx):
+        return self.split_names[dset_idx] if dset_idx < len(self.split_names) else str(dset_idx)
+
+    def update(self, dset_idx, output):
+        """ output of a test step of dataloader dset_idx """
+        fields = {k:output[k] for k in self.keys if k in output}
+        if fields:
+            self.buffers.setdefault(dset_idx, []).append(fields)
+            self.buffered[dset_idx] = self.buffered.get(dset_idx, 0) + next(iter(fields.values())).shape[0]
+            if self.buffered[dset_idx] >= self.chunk:
+                self.flush(dset_idx)
+        if self.writer is not None:
+            self.writer.write(self.split_name(dset_idx), output)
+
+    def flush(self, dset_idx):
+        """ evaluates the buffered frames of dataloader dset_idx and adds their errors to the sums """
+        buffer = self.buffers.pop(dset_idx, [])
+        self.buffered[dset_idx] = 0
+        if not buffer:
+            return
+        fields = {k:torch.cat([b[k] for b in buffer]) for k in buffer[0]}
+        errors = frame_errors(fields, self.views, self.body_model, self.chunk, self.device)
+        sums = self.sums.setdefault(dset_idx, {})
+        counts = self.counts.setdefault(dset_idx, {})
+        for k, e in errors.items():
+            sums[k] = sums.get(k, 0.) + e.sum(dim=0).cpu().double()
+            counts[k] = counts.get(k, 0) + e.shape[0]
+
+    def compute(self):
+        """ {split: {metric + view: value}}, per_joint + view is an array of the 22 joints """
+        for dset_idx in list(self.buffers.keys()):
+            self.flush(dset_idx)
+        if self.writer is not None:
+            self.writer.close()
+        results = {}
+        for dset_idx in sorted(self.sums.keys()):
+            metrics = {}
+            for k, s in self.sums[dset_idx].items():
+                mean = s/self.counts[dset_idx][k]
+                metrics[k] = mean.mean().item()
+                if k.startswith("mpjpe"):
+                    metrics["per_joint" + k[len("mpjpe"):]] = mean.numpy()
+            results[self.split_name(dset_idx)] = metrics
+        return results
+
+    def log(self, pl_module):
+        """ computes, prints and logs (the scalars as <split>_<metric>) the metrics of every split """
+        results = self.compute()
+        for name, metrics in results.items():
+            for k, v in metrics.items():
+                if isinstance(v, np.ndarray):
+                    print("{}_{}: {}".format(name, k, np.array2string(v, precision=4, max_line_width=200)))
+                else:
+                    print("{}_{}: {}".format(name, k, v))
+                    pl_module.log("{}_{}".format(name, k), v)
+        return results
+
+
+def spill_dtype(name):
+    """ --eval_spill_dtype to a numpy dtype, "none" keeps the dtype of the outputs """
+    return None if name.lower() == "none" else np.dtype(name)
+
+
+def test_evaluator(pl_module, views, body_model):
+    """ StreamingEvaluator of the --eval_* arguments of pl_module, spilling to <log dir>/test_results by default """
+    hparams = pl_module.hparams
+    spill_dir = hparams.get("eval_spill_dir") or os.path.join(pl_module.trainer.log_dir or ".", "test_results")
+    return StreamingEvaluator(views, body_model, chunk=hparams.get("eval_chunk", 1024), device=pl_module.device,
+                                spill_dir=spill_dir,
+                                spill_fields=hparams.get("eval_spill_fields", "").split(","),
+                                spill_dtype=spill_dtype(hparams.get("eval_spill_dtype", "float16")))
+
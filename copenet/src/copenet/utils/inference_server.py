@@ -0,0 +1,263 @@
+import io
+import json
+import time
+import threading
+import collections
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import torch
+
+"""
+Dynamic micro-batching inference for the two view networks. Requests (im0, im1, bb0, bb1 and
+optionally intr0, intr1) are queued, grouped into batches of up to max_batch_size or until the
+oldest request waited max_wait, run through fwd_pass_and_loss(is_test=True) in eval mode and
+answered with the same output fields, one sample each.
+
+Over HTTP the arrays travel as .npz (np.savez), read with allow_pickle=False so a request can only
+carry plain arrays, and the deadline (s) is the X-Deadline header.
+"""
+
+# inputs of a request, intr0 and intr1 are optional
+INPUT_KEYS = ("im0", "im1", "bb0", "bb1", "intr0", "intr1")
+
+
+class ServerBusy(Exception):
+    """ the request queue is full, the client should back off """
+    pass
+
+class DeadlineExceeded(Exception):
+    """ the request could not be served before its deadline """
+    pass
+
+
+class InferenceRequest(object):
+    def __init__(self, inputs, deadline):
+        self.inputs = inputs
+        self.arrival = time.time()
+        self.deadline = deadline
+        self.done = threading.Event()
+        self.output = None
+        self.error = None
+
+    def result(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise DeadlineExceeded("no result within {}s".format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+
+class MicroBatcher(object):
+    """
+    net: a LightningModule with fwd_pass_and_loss (copenet_twoview)
+    max_batch_size: largest batch run at once
+    max_wait: longest time (s) the oldest queued request waits for the batch to fill up
+    max_queue: queued requests beyond this are rejected with ServerBusy (back-pressure)
+    default_deadline: deadline (s after arrival) of requests that do not set one
+    """
+    def __init__(self, net, max_batch_size=16, max_wait=0.01, max_queue=256, default_deadline=1.0,
+                    default_intr=None):
+        self.net = net
+        self.net.eval()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.default_deadline = default_deadline
+        self.default_intr = default_intr
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+
+        self.latencies = collections.deque(maxlen=10000)
+        self.batch_sizes = collections.Counter()
+        self.n_served = 0
+        self.n_rejected = 0
+        self.n_expired = 0
+        # moving estimate of the time a batch takes, used to start batches before deadlines expire
+        self.exec_time = 0.
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def submit(self, inputs, deadline=None):
+        """ queue one sample, returns an InferenceRequest; deadline is in seconds from now """
+        req = InferenceRequest(inputs, time.time() + (self.default_deadline if deadline is None else deadline))
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                self.n_rejected += 1
+                raise ServerBusy("{} requests queued".format(len(self.queue)))
+            self.queue.append(req)
+            self.cond.notify()
+        return req
+
+    def next_batch(self):
+        with self.cond:
+            while self.running and len(self.queue) == 0:
+                self.cond.wait()
+            if not self.running:
+                return []
+            # wait for the batch to fill up, but not past the oldest request's wait budget or
+            # the point where the earliest deadline can't be met any more
+            while len(self.queue) < self.max_batch_size:
+                start_by = min(self.queue[0].arrival + self.max_wait,
+                                min([r.deadline for r in self.queue]) - self.exec_time)
+                remaining = start_by - time.time()
+                if remaining <= 0 or not self.running:
+                    break
+                self.cond.wait(remaining)
+
+            batch = []
+            now = time.time()
+            while len(self.queue) > 0 and len(batch) < self.max_batch_size:
+                req = self.queue.popleft()
+                if req.deadline < now + self.exec_time:
+                    self.n_expired += 1
+                    req.error = DeadlineExceeded("deadline passed while queued")
+                    req.done.set()
+                    continue
+                batch.append(req)
+            return batch
+
+    def collate(self, reqs):
+        batch = {}
+        for k in INPUT_KEYS:
+            vals = []
+            for r in reqs:
+                v = r.inputs.get(k)
+                if v is None:
+                    v = self.default_intr[int(k[-1])]
+                vals.append(torch.as_tensor(np.asarray(v)).float())
+            batch[k] = torch.stack(vals)
+        return {k:v.to(self.net.device) for k,v in batch.items()}
+
+    def run_batch(self, reqs):
+        t0 = time.time()
+        try:
+            with torch.no_grad():
+                output, _, _ = self.net.fwd_pass_and_loss(self.collate(reqs), is_val=False, is_test=True)
+        except Exception as e:
+            for r in reqs:
+                r.error = e
+                r.done.set()
+            return
+        self.exec_time = 0.9*self.exec_time + 0.1*(time.time() - t0) if self.n_served > 0 else time.time() - t0
+
+        now = time.time()
+        for i, r in enumerate(reqs):
+            r.output = {k:v[i].cpu().numpy() for k,v in output.items() if torch.is_tensor(v) and v.dim() > 0}
+            self.latencies.append(now - r.arrival)
+            r.done.set()
+        self.n_served += len(reqs)
+        self.batch_sizes[len(reqs)] += 1
+
+    def loop(self):
+        while self.running:
+            reqs = self.next_batch()
+            if len(reqs) > 0:
+                self.run_batch(reqs)
+
+    def metrics(self):
+        lat = np.array(self.latencies)
+        n_batches = sum(self.batch_sizes.values())
+        return {"served": self.n_served,
+                "rejected": self.n_rejected,
+                "expired": self.n_expired,
+                "queued": len(self.queue),
+                "p50_ms": 1000*float(np.percentile(lat, 50)) if len(lat) > 0 else None,
+                "p99_ms": 1000*float(np.percentile(lat, 99)) if len(lat) > 0 else None,
+                "mean_batch_size": self.n_served/n_batches if n_batches > 0 else None,
+                "exec_ms": 1000*self.exec_time}
+
+
+def encode_arrays(arrays):
+    """ .npz bytes of a dict of numpy arrays """
+    buf = io.BytesIO()
+    np.savez(buf, **{k:np.asarray(v) for k,v in arrays.items()})
+    return buf.getvalue()
+
+
+def decode_arrays(data):
+    """ dict of numpy arrays of .npz bytes, object arrays (pickles) are refused """
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        return {k:npz[k] for k in npz.files}
+
+
+def make_handler(batcher):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        """ POST /infer with the .npz of the numpy inputs (X-Deadline header in s), GET /metrics """
+        def do_POST(self):
+            if self.path != "/infer":
+                self.send_error(404)
+                return
+            try:
+                inputs = decode_arrays(self.rfile.read(int(self.headers["Content-Length"])))
+                deadline = self.headers.get("X-Deadline")
+                deadline = None if deadline is None else float(deadline)
+            except Exception as e:
+                # not an npz of plain arrays, or a bad X-Deadline
+                self.send_error(400, "bad request: {}".format(e))
+                return
+            missing = [k for k in INPUT_KEYS[:4] if k not in inputs]
+            if missing:
+                self.send_error(400, "missing inputs {}".format(missing))
+                return
+            try:
+                req = batcher.submit({k:v for k,v in inputs.items() if k in INPUT_KEYS}, deadline)
+                output = req.result(timeout=max(req.deadline - time.time(), 0) + 1.)
+            except ServerBusy as e:
+                self.send_error(503, str(e))
+                return
+            except DeadlineExceeded as e:
+                self.send_error(504, str(e))
+                return
+            body = encode_arrays(output)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = json.dumps(batcher.metrics()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return InferenceHandler
+
+
+def serve(batcher, host="127.0.0.1", port=8080):
+    """ local HTTP stand-in for the fleet link, returns the server running in a daemon thread """
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def infer_http(url, inputs, deadline=None, timeout=10.):
+    """ client side of serve: inputs is a dict of numpy arrays, returns the output dict """
+    headers = {"Content-Type": "application/octet-stream"}
+    if deadline is not None:
+        headers["X-Deadline"] = str(deadline)
+    req = urllib.request.Request(url + "/infer", data=encode_arrays(inputs), headers=headers)
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return decode_arrays(resp.read())
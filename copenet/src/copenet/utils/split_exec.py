@@ -0,0 +1,381 @@
+import time
+import queue
+import select
+import socket
+import struct
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from ..models import model_copenet
+
+"""
+Split execution of the two view copenet model, one process per view as on the UAVs.
+Each process runs forward_feat_ext and its half of forward_reg (forward_reg_view), and the views
+only exchange their art pose and shape (21*6 + 10 floats per sample) before every regressor
+iteration after the first, through a pluggable transport.
+In the asynchronous mode a view does not block on a late peer message and goes on with the most
+recent peer estimate it has (PeerState); simulate_async_fusion replays this on a simulated link.
+"""
+
+# frame id, iteration, rows, cols
+HEADER = struct.Struct("!iiII")
+
+class QueueTransport(object):
+    """ in-process transport over a pair of multiprocessing queues """
+    def __init__(self, send_q, recv_q):
+        self.send_q = send_q
+        self.recv_q = recv_q
+        self.bytes_sent = 0
+        self.bytes_recv = 0
+        self.n_sent = 0
+
+    def open(self):
+        pass
+
+    def send(self, frame_id, it, arr):
+        self.send_q.put((frame_id, it, arr))
+        self.bytes_sent += HEADER.size + arr.nbytes
+        self.n_sent += 1
+
+    def recv(self, timeout=None):
+        """ returns (frame_id, it, arr), or None if nothing arrived within timeout """
+        try:
+            frame_id, it, arr = self.recv_q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.bytes_recv += HEADER.size + arr.nbytes
+        return frame_id, it, arr
+
+    def stats(self):
+        return {"bytes_sent":self.bytes_sent, "bytes_recv":self.bytes_recv, "n_sent":self.n_sent}
+
+    def close(self):
+        pass
+
+
+class SocketTransport(object):
+    """ TCP transport, one end listens on (host, port) and the other connects to it """
+    def __init__(self, host="127.0.0.1", port=5555, server=False, connect_timeout=30):
+        self.host = host
+        self.port = port
+        self.server = server
+        self.connect_timeout = connect_timeout
+        self.sock = None
+        self.bytes_sent = 0
+        self.bytes_recv = 0
+        self.n_sent = 0
+
+    def open(self):
+        if self.server:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.host, self.port))
+            listener.listen(1)
+            self.sock, _ = listener.accept()
+            listener.close()
+        else:
+            t0 = time.time()
+            while True:
+                try:
+                    self.sock = socket.create_connection((self.host, self.port))
+                    break
+                except ConnectionRefusedError:
+                    if time.time() - t0 > self.connect_timeout:
+                        raise
+                    time.sleep(0.1)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, frame_id, it, arr):
+        arr = np.ascontiguousarray(arr, dtype=np.float32)
+        msg = HEADER.pack(frame_id, it, arr.shape[0], arr.shape[1]) + arr.tobytes()
+        try:
+            self.sock.sendall(msg)
+        except (BrokenPipeError, ConnectionResetError):
+            # the peer is gone, in the asynchronous mode that is just a lost message
+            return
+        self.bytes_sent += len(msg)
+        self.n_sent += 1
+
+    def recv_exact(self, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("peer closed the connection")
+            buf += chunk
+        return buf
+
+    def recv(self, timeout=None):
+        """ returns (frame_id, it, arr), or None if nothing arrived within timeout """
+        if timeout is not None:
+            ready, _, _ = select.select([self.sock], [], [], timeout)
+            if not ready:
+                return None
+            try:
+                header = self.recv_exact(HEADER.size)
+            except ConnectionError:
+                return None
+        else:
+            header = self.recv_exact(HEADER.size)
+        frame_id, it, rows, cols = HEADER.unpack(header)
+        arr = np.frombuffer(self.recv_exact(rows*cols*4), dtype=np.float32).reshape(rows, cols)
+        self.bytes_recv += HEADER.size + arr.nbytes
+        return frame_id, it, arr
+
+    def stats(self):
+        return {"bytes_sent":self.bytes_sent, "bytes_recv":self.bytes_recv, "n_sent":self.n_sent}
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+
+class PeerState(object):
+    """
+    most recent peer estimate received by a view. A message of (frame_id, it) holds the peer
+    state after iteration it-1 of frame frame_id, the one a synchronous view would use at iteration it.
+    get returns the peer state and its staleness: 0 if it is the synchronous one, the number of
+    frames it lags behind otherwise (at least 1 for an older iteration of the current frame).
+    Estimates older than max_age frames are not used, the view falls back to its own art pose and
+    shape (staleness -1), which are view independent.
+    """
+    def __init__(self, max_age=1):
+        self.max_age = max_age
+        self.frame_id = None
+        self.it = None
+        self.state = None
+
+    def update(self, frame_id, it, state):
+        if self.frame_id is None or (frame_id, it) > (self.frame_id, self.it):
+            self.frame_id, self.it, self.state = frame_id, it, state
+
+    def is_current(self, frame_id, it):
+        return self.frame_id is not None and (self.frame_id, self.it) >= (frame_id, it)
+
+    def get(self, frame_id, it, fallback):
+        if self.frame_id is None:
+            return fallback, -1
+        if self.is_current(frame_id, it):
+            return self.state, 0
+        age = max(frame_id - self.frame_id, 1)
+        if age > self.max_age:
+            return fallback, -1
+        return self.state, age
+
+
+class LinkSimulator(object):
+    """
+    one direction of a simulated radio link. Messages are delivered delay_fn() seconds after
+    they were sent, or dropped with probability drop_prob.
+    """
+    def __init__(self, delay_fn=lambda: 0., drop_prob=0., seed=0):
+        self.delay_fn = delay_fn
+        self.drop_prob = drop_prob
+        self.rng = np.random.RandomState(seed)
+        self.in_flight = []
+        self.n_sent = 0
+        self.n_dropped = 0
+
+    def send(self, now, frame_id, it, state):
+        self.n_sent += 1
+        if self.rng.rand() < self.drop_prob:
+            self.n_dropped += 1
+            return
+        self.in_flight.append((now + self.delay_fn(), frame_id, it, state))
+
+    def deliver(self, now):
+        arrived = [m for m in self.in_flight if m[0] <= now]
+        self.in_flight = [m for m in self.in_flight if m[0] > now]
+        return [m[1:] for m in sorted(arrived, key=lambda m: m[0])]
+
+
+def simulate_async_fusion(model, feats, iters=3, max_age=1, links=None, frame_interval=1/30., iter_time=1e-3):
+    """
+    asynchronous two view inference on a simulated clock, both views in this process.
+    feats: [(xf0, bb0, xf1, bb1, init_position0, init_position1), ...] consecutive frames with
+    precomputed features. Frame f is captured at f*frame_interval and iteration it runs at
+    f*frame_interval + it*iter_time, views never wait for the link.
+    links: (view0->view1, view1->view0) LinkSimulator, default is an ideal link.
+    Returns [(pred_pose0, pred_betas0, pred_pose1, pred_betas1, staleness0, staleness1), ...]
+    with the staleness used at every iteration after the first.
+    """
+    if links is None:
+        links = (LinkSimulator(), LinkSimulator())
+    peer_states = [PeerState(max_age), PeerState(max_age)]
+    results = []
+    for frame_id, (xf0, bb0, xf1, bb1, init_position0, init_position1) in enumerate(feats):
+        batch_size = xf0.shape[0]
+        xf = [xf0, xf1]
+        bb = [bb0, bb1]
+        position = [init_position0, init_position1]
+        orient = [model.init_pose[:,:6].expand(batch_size,-1)]*2
+        art_pose = [model.init_pose[:,6:22*6].expand(batch_size,-1)]*2
+        shape = [model.init_shape.expand(batch_size,-1)]*2
+        pred_pose = [None, None]
+        staleness = [[], []]
+        for it in range(iters):
+            now = frame_id*frame_interval + it*iter_time
+            peer = [(art_pose[1], shape[1]), (art_pose[0], shape[0])]
+            if it > 0:
+                own = [torch.cat([art_pose[v], shape[v]],1) for v in range(2)]
+                for v in range(2):
+                    links[v].send(now, frame_id, it, own[v])
+                for v in range(2):
+                    for msg in links[1-v].deliver(now):
+                        peer_states[v].update(*msg)
+                    state, age = peer_states[v].get(frame_id, it, own[v])
+                    peer[v] = (state[:,:21*6], state[:,21*6:])
+                    staleness[v].append(age)
+            for v in range(2):
+                pred_pose[v], shape[v] = model.forward_reg_view(xf[v], bb[v],
+                                                position[v], orient[v], art_pose[v], shape[v],
+                                                peer[v][0], peer[v][1])
+                position[v], orient[v], art_pose[v] = pred_pose[v][:,:3], pred_pose[v][:,3:9], pred_pose[v][:,9:]
+        results.append((pred_pose[0], shape[0], pred_pose[1], shape[1], staleness[0], staleness[1]))
+    return results
+
+
+def get_transport_pair(transport="queue", port=5555):
+    """ the two ends of a transport, one for each view process """
+    if transport == "queue":
+        q01 = mp.get_context("spawn").Queue()
+        q10 = mp.get_context("spawn").Queue()
+        return QueueTransport(q01, q10), QueueTransport(q10, q01)
+    elif transport == "socket":
+        return SocketTransport(port=port, server=True), SocketTransport(port=port, server=False)
+    else:
+        raise ValueError("unknown transport {}".format(transport))
+
+
+def load_view_model(model_state, smpl_mean_params):
+    model = model_copenet.getcopenet(smpl_mean_params, pretrained=False)
+    model.load_state_dict(model_state)
+    model.eval()
+    return model
+
+
+def view_worker(view, model_state, smpl_mean_params, transport, frame_q, result_q, iters=3, num_threads=1, max_age=None, wait=0):
+    """
+    process of one view. frame_q yields (frame_id, x, bb, init_position) and None to stop,
+    result_q gets (view, frame_id, pred_pose, pred_shape, timings) per frame and
+    (view, None, None, None, transport stats) at the end.
+    With max_age None the view blocks on every peer message. Otherwise it waits at most
+    wait seconds and goes on with the most recent peer estimate not older than max_age frames,
+    see PeerState. The staleness used per iteration is in timings["staleness"].
+    """
+    torch.set_num_threads(num_threads)
+    model = load_view_model(model_state, smpl_mean_params)
+    transport.open()
+    peer_state = PeerState(max_age) if max_age is not None else None
+
+    with torch.no_grad():
+        while True:
+            item = frame_q.get()
+            if item is None:
+                break
+            frame_id, x, bb, init_position = item
+            batch_size = x.shape[0]
+
+            t0 = time.time()
+            xf = model.forward_feat_ext(x)
+            t_feat = time.time() - t0
+
+            position = init_position
+            orient = model.init_pose[:,:6].expand(batch_size,-1)
+            art_pose = model.init_pose[:,6:22*6].expand(batch_size,-1)
+            shape = model.init_shape.expand(batch_size,-1)
+            # both views start from the mean, the first iteration needs no exchange
+            peer_art_pose, peer_shape = art_pose, shape
+            rtt = []
+            staleness = []
+            for it in range(iters):
+                if it > 0:
+                    t1 = time.time()
+                    own = torch.cat([art_pose, shape],1)
+                    transport.send(frame_id, it, own.numpy())
+                    if peer_state is None:
+                        _, _, peer = transport.recv()
+                        peer = torch.from_numpy(np.array(peer))
+                    else:
+                        # take whatever has arrived, wait for the matching message only up to wait
+                        msg = transport.recv(timeout=0)
+                        while msg is not None:
+                            peer_state.update(*msg)
+                            msg = transport.recv(timeout=0) if not peer_state.is_current(frame_id, it) else None
+                        if not peer_state.is_current(frame_id, it) and wait > 0:
+                            msg = transport.recv(timeout=wait)
+                            if msg is not None:
+                                peer_state.update(*msg)
+                        peer, age = peer_state.get(frame_id, it, own)
+                        peer = torch.as_tensor(np.array(peer))
+                        staleness.append(age)
+                    rtt.append(time.time() - t1)
+                    peer_art_pose, peer_shape = peer[:,:21*6], peer[:,21*6:]
+                pred_pose, shape = model.forward_reg_view(xf, bb,
+                                                position, orient, art_pose, shape,
+                                                peer_art_pose, peer_shape)
+                position, orient, art_pose = pred_pose[:,:3], pred_pose[:,3:9], pred_pose[:,9:]
+
+            result_q.put((view, frame_id, pred_pose, shape,
+                            {"feat":t_feat, "rtt":rtt, "staleness":staleness, "total":time.time() - t0}))
+
+    result_q.put((view, None, None, None, transport.stats()))
+    transport.close()
+
+
+def run_split_execution(model_state, smpl_mean_params, frames, transport="queue", iters=3, port=5555, num_threads=1, max_age=None, wait=0):
+    """
+    run frames [(x0, bb0, x1, bb1, init_position0, init_position1), ...] through one process per view.
+    Returns the per frame predictions {frame_id: (pred_pose0, pred_betas0, pred_pose1, pred_betas1)}
+    and a dict of link and timing statistics. max_age and wait enable the asynchronous mode of view_worker.
+    """
+    ctx = mp.get_context("spawn")
+    t0, t1 = get_transport_pair(transport, port)
+    frame_qs = [ctx.Queue(), ctx.Queue()]
+    result_q = ctx.Queue()
+    procs = [ctx.Process(target=view_worker, args=(view, model_state, smpl_mean_params, tr, frame_qs[view], result_q, iters, num_threads, max_age, wait))
+                for view, tr in enumerate([t0, t1])]
+    for p in procs:
+        p.start()
+
+    n_frames = 0
+    start = time.time()
+    for frame_id, (x0, bb0, x1, bb1, init_position0, init_position1) in enumerate(frames):
+        frame_qs[0].put((frame_id, x0, bb0, init_position0))
+        frame_qs[1].put((frame_id, x1, bb1, init_position1))
+        n_frames += 1
+    for q in frame_qs:
+        q.put(None)
+
+    outputs = {}
+    timings = []
+    link = {}
+    n_done = 0
+    while n_done < 2:
+        view, frame_id, pred_pose, pred_shape, info = result_q.get()
+        if frame_id is None:
+            link[view] = info
+            n_done += 1
+            continue
+        outputs.setdefault(frame_id, [None]*4)
+        outputs[frame_id][2*view] = pred_pose
+        outputs[frame_id][2*view + 1] = pred_shape
+        timings.append(info)
+    elapsed = time.time() - start
+    for p in procs:
+        p.join()
+
+    rtt = [t for x in timings for t in x["rtt"]]
+    staleness = [a for x in timings for a in x["staleness"]]
+    stats = {"transport": transport,
+                "frames": n_frames,
+                "fps": n_frames/elapsed,
+                "bytes_per_frame": (link[0]["bytes_sent"] + link[1]["bytes_sent"])/max(n_frames, 1),
+                "bytes_total": link[0]["bytes_sent"] + link[1]["bytes_sent"],
+                "rtt_mean": np.mean(rtt) if len(rtt) > 0 else float("nan"),
+                "rtt_p99": np.percentile(rtt, 99) if len(rtt) > 0 else float("nan"),
+                "feat_mean": np.mean([x["feat"] for x in timings]),
+                "view_total_mean": np.mean([x["total"] for x in timings]),
+                "staleness": np.bincount(np.array(staleness) + 1) if len(staleness) > 0 else None}
+    return {k:tuple(v) for k,v in outputs.items()}, stats
@@ -0,0 +1,203 @@
+import os
+import sys
+import time
+import numpy as np
+import torch
+from pytorch_lightning import Callback
+
+"""
+Where the time of a training step goes. StepProfiler wraps (as instance attributes, removed again
+in teardown) the batch transfer, the backbone (forward_feat_ext) and regressor (forward_reg*) of
+the network, the SMPL-X globals of the LightningModule's module, get_loss and the summary logging,
+and takes the backward and optimizer step from the Lightning hooks:
+
+data_wait  end of the previous step to the batch transfer (dataloader)
+h2d        transfer_batch_to_device
+backbone / regressor / smplx / loss / logging
+other      rest of training_step
+backward   loss.backward
+optimizer  end of the backward to the end of the step (the optimizer update)
+
+Every step is a row of step_profile.csv, the means over every_n_steps go to TensorBoard
+(step_time/<section> in ms, step_time/samples_per_s). Sections are timed in the forward of
+training_step only, the recomputation of checkpointed activations counts as backward.
+"""
+
+SECTIONS = ["data_wait","h2d","backbone","regressor","smplx","loss","logging","other","backward","optimizer"]
+FORWARD_SECTIONS = ["backbone","regressor","smplx","loss","logging"]
+BODY_MODELS = ["smplx","smplx_body","smplx_joints"]
+METHODS = {"forward_feat_ext": "backbone",
+            "forward_reg": "regressor",
+            "forward_reg_adaptive": "regressor",
+            "forward_reg_view": "regressor"}
+
+
+def batch_size(batch):
+    for v in (batch.values() if isinstance(batch, dict) else batch):
+        if torch.is_tensor(v):
+            return v.shape[0]
+    return 0
+
+
+class StepProfiler(Callback):
+    """
+    log_dir: directory of the CSV and the torch.profiler trace, the logger's log_dir by default
+    every_n_steps: steps averaged per TensorBoard point
+    sync_cuda: synchronize the GPU at the section boundaries, without it GPU time is attributed to
+    whichever section waits for it
+    profiler_window: (first, last) global steps traced with torch.profiler, None for no trace
+    """
+    def __init__(self, log_dir=None, every_n_steps=50, sync_cuda=True, profiler_window=None):
+        super().__init__()
+        self.log_dir = log_dir
+        self.every_n_steps = every_n_steps
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.profiler_window = profiler_window
+        self.prof = None
+        self.wrapped = []
+        self.active = {}
+        self.in_step = False
+        self.times = {k:0. for k in SECTIONS}
+        self.rows = []
+        self.csv = None
+        self.last_end = None
+
+    def now(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def wrap(self, obj, name, section, always=False):
+        """ obj.name adds its time to section, nested calls of the same section count once """
+        original = getattr(obj, name)
+        def timed(*args, **kwargs):
+            if not (always or self.in_step) or self.active.get(section):
+                return original(*args, **kwargs)
+            self.active[section] = True
+            t0 = self.now()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.times[section] += self.now() - t0
+                self.active[section] = False
+        setattr(obj, name, timed)
+        self.wrapped.append((obj, name))
+
+    def wrap_training_step(self, pl_module):
+        original = pl_module.training_step
+        def timed(*args, **kwargs):
+            self.in_step = True
+            t0 = self.now()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.in_step = False
+                self.times["other"] = self.now() - t0 - sum(self.times[k] for k in FORWARD_SECTIONS)
+        pl_module.training_step = timed
+        self.wrapped.append((pl_module, "training_step"))
+
+    def setup(self, trainer, pl_module, stage=None):
+        if self.wrapped:
+            return
+        self.wrap_training_step(pl_module)
+        self.wrap(pl_module, "transfer_batch_to_device", "h2d", always=True)
+        for module in pl_module.model.modules():
+            for name, section in METHODS.items():
+                if hasattr(module, name):
+                    self.wrap(module, name, section)
+        module_globals = vars(sys.modules[type(pl_module).__module__])
+        for name in BODY_MODELS:
+            if module_globals.get(name) is not None:
+                self.wrap(module_globals[name], "forward", "smplx")
+        self.wrap(pl_module, "get_loss", "loss")
+        for name in ["log_summaries", "summaries"]:
+            if hasattr(pl_module, name):
+                self.wrap(pl_module, name, "logging")
+        if hasattr(pl_module, "train_losses"):
+            self.wrap(pl_module.train_losses, "compute", "logging")
+
+        if trainer.is_global_zero:
+            log_dir = self.log_dir or trainer.logger.log_dir
+            os.makedirs(log_dir, exist_ok=True)
+            self.log_dir = log_dir
+            path = os.path.join(log_dir, "step_profile.csv")
+            new_file = not os.path.exists(path)
+            self.csv = open(path, "a")
+            if new_file:
+                self.csv.write(",".join(["step","batch_size"] + [k + "_ms" for k in SECTIONS] + ["total_ms"]) + "\n")
+
+    def teardown(self, trainer, pl_module, stage=None):
+        for obj, name in reversed(self.wrapped):
+            # the instance attribute shadowed the method of the class
+            delattr(obj, name)
+        self.wrapped = []
+        if self.prof is not None:
+            self.stop_profiler()
+        if self.csv is not None:
+            self.csv.close()
+            self.csv = None
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self.last_end = self.now()
+        self.times["h2d"] = 0.
+
+    def on_validation_end(self, trainer, pl_module):
+        # the validation inside an epoch is not data wait of the next step
+        self.last_end = self.now()
+        self.times["h2d"] = 0.
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx, *args):
+        t = self.now()
+        h2d = self.times["h2d"]
+        self.times = {k:0. for k in SECTIONS}
+        self.times["h2d"] = h2d
+        self.times["data_wait"] = max(0., t - self.last_end - h2d)
+        self.batch_start = t
+        first = self.profiler_window[0] if self.profiler_window is not None else None
+        if first is not None and trainer.global_step == first and self.prof is None and trainer.is_global_zero:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.prof = torch.profiler.profile(activities=activities, record_shapes=True)
+            self.prof.__enter__()
+
+    def on_before_backward(self, trainer, pl_module, loss):
+        self.backward_start = self.now()
+
+    def on_after_backward(self, trainer, pl_module):
+        self.optimizer_start = self.now()
+        self.times["backward"] = self.optimizer_start - self.backward_start
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, *args):
+        t = self.now()
+        self.times["optimizer"] = t - self.optimizer_start
+        total = t - self.batch_start + self.times["data_wait"] + self.times["h2d"]
+        self.last_end = t
+        step = trainer.global_step
+        times = dict(self.times)
+        self.times["h2d"] = 0.
+        if not trainer.is_global_zero:
+            return
+        self.rows.append((batch_size(batch), total, times))
+
+        self.csv.write(",".join([str(step), str(self.rows[-1][0])] +
+                        ["{:.3f}".format(1000*self.rows[-1][2][k]) for k in SECTIONS] +
+                        ["{:.3f}".format(1000*total)]) + "\n")
+        if len(self.rows) >= self.every_n_steps:
+            experiment = trainer.logger.experiment
+            for k in SECTIONS:
+                experiment.add_scalar("step_time/" + k, 1000*np.mean([r[2][k] for r in self.rows]), step)
+            experiment.add_scalar("step_time/total", 1000*np.mean([r[1] for r in self.rows]), step)
+            experiment.add_scalar("step_time/samples_per_s", sum(r[0] for r in self.rows)/sum(r[1] for r in self.rows), step)
+            self.csv.flush()
+            self.rows = []
+        if self.prof is not None and step >= self.profiler_window[1]:
+            self.stop_profiler()
+
+    def stop_profiler(self):
+        self.prof.__exit__(None, None, None)
+        path = os.path.join(self.log_dir, "trace_{}_{}.json".format(*self.profiler_window))
+        self.prof.export_chrome_trace(path)
+        print("torch.profiler trace of steps {}-{} written to {}".format(*self.profiler_window, path))
+        print(self.prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=20))
+        self.prof = None
@@ -0,0 +1,119 @@
+import torch
+
+"""
+Stateful streaming inference for the two view copenet model.
+The estimate of the previous frame is fed back as the initial state of the iterative regressor
+(init_position0/1, init_theta0/1, init_shape0/1), so fewer iterations are needed per frame.
+"""
+
+class StreamingPredictor(object):
+    """Warm started copenet inference over consecutive frames of B independent streams.
+    Args:
+        model: copenet model (models.model_copenet.copenet)
+        iters: regressor iterations for warm started frames
+        cold_iters: regressor iterations for the first frame of a track
+        init_position: initial translation for a cold start, same units as the trainer ([0,0,10])
+        trans_scale: distance scaling applied to the translation inside the network
+        max_bb_jump: reset a stream if its normalized bb center moves more than this between frames
+        max_scale_ratio: reset a stream if its bb scale changes by more than this factor between frames
+    """
+    def __init__(self, model, iters=1, cold_iters=3, init_position=[0,0,10], trans_scale=0.05,
+                    max_bb_jump=0.2, max_scale_ratio=1.5):
+        self.model = model
+        self.iters = iters
+        self.cold_iters = cold_iters
+        self.init_position = torch.tensor(init_position).float()
+        self.trans_scale = trans_scale
+        self.max_bb_jump = max_bb_jump
+        self.max_scale_ratio = max_scale_ratio
+        self.state = None
+
+    def reset(self, mask=None):
+        """ forget the state of all streams, or of the streams where mask is True """
+        if self.state is None or mask is None:
+            self.state = None
+        else:
+            self.state["tracked"][mask] = False
+
+    def track_lost(self, bb0, bb1):
+        """ streams whose bounding boxes jumped since the last frame """
+        lost = torch.zeros(bb0.shape[0], dtype=torch.bool, device=bb0.device)
+        for bb, prev_bb in zip([bb0, bb1], [self.state["bb0"], self.state["bb1"]]):
+            lost |= torch.norm(bb[:,:2] - prev_bb[:,:2], dim=1) > self.max_bb_jump
+            ratio = bb[:,2]/prev_bb[:,2]
+            lost |= (ratio > self.max_scale_ratio) | (ratio < 1/self.max_scale_ratio)
+        return lost
+
+    def step(self, im0, im1, bb0, bb1, valid=None):
+        """
+        run one frame. valid (B bool) marks the streams with a detection in both views,
+        streams without one lose their track and are cold started on their next detection.
+        Returns pred_pose0, pred_betas0, pred_pose1, pred_betas1 as copenet.forward,
+        with the translation in the same units as init_position.
+        """
+        batch_size = im0.shape[0]
+        device = im0.device
+        if valid is None:
+            valid = torch.ones(batch_size, dtype=torch.bool, device=device)
+
+        if self.state is None or self.state["pose0"].shape[0] != batch_size:
+            warm = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        else:
+            warm = self.state["tracked"] & ~self.track_lost(bb0, bb1)
+        warm &= valid
+
+        xf0 = self.model.forward_feat_ext(im0)
+        xf1 = self.model.forward_feat_ext(im1)
+
+        pred_pose0 = torch.zeros(batch_size, 3 + 22*6, device=device)
+        pred_betas0 = torch.zeros(batch_size, 10, device=device)
+        pred_pose1 = torch.zeros(batch_size, 3 + 22*6, device=device)
+        pred_betas1 = torch.zeros(batch_size, 10, device=device)
+
+        # cold start: SMPL mean pose and shape, default translation
+        cold = ~warm
+        if cold.any():
+            n_cold = int(cold.sum())
+            position = (self.trans_scale*self.init_position).to(device).expand(n_cold,-1)
+            out = self.regress(xf0[cold], xf1[cold], bb0[cold], bb1[cold],
+                                position, position,
+                                self.model.init_pose[:,:22*6].expand(n_cold,-1), self.model.init_pose[:,:22*6].expand(n_cold,-1),
+                                self.model.init_shape.expand(n_cold,-1), self.model.init_shape.expand(n_cold,-1),
+                                self.cold_iters)
+            pred_pose0[cold], pred_betas0[cold], pred_pose1[cold], pred_betas1[cold] = out
+
+        # warm start: previous estimate of the stream
+        if warm.any():
+            out = self.regress(xf0[warm], xf1[warm], bb0[warm], bb1[warm],
+                                self.state["pose0"][warm,:3], self.state["pose1"][warm,:3],
+                                self.state["pose0"][warm,3:], self.state["pose1"][warm,3:],
+                                self.state["betas0"][warm], self.state["betas1"][warm],
+                                self.iters)
+            pred_pose0[warm], pred_betas0[warm], pred_pose1[warm], pred_betas1[warm] = out
+
+        # a stream whose estimate went behind the camera is not worth warm starting from
+        tracked = valid & (pred_pose0[:,2] > 0) & (pred_pose1[:,2] > 0)
+        self.state = {"pose0":pred_pose0, "pose1":pred_pose1,
+                        "betas0":pred_betas0, "betas1":pred_betas1,
+                        "bb0":bb0, "bb1":bb1,
+                        "tracked":tracked, "warm":warm}
+
+        pred_pose0 = torch.cat([pred_pose0[:,:3]/self.trans_scale, pred_pose0[:,3:]], 1)
+        pred_pose1 = torch.cat([pred_pose1[:,:3]/self.trans_scale, pred_pose1[:,3:]], 1)
+        return pred_pose0, pred_betas0, pred_pose1, pred_betas1
+
+    def regress(self, xf0, xf1, bb0, bb1, position0, position1, theta0, theta1, shape0, shape1, iters):
+        pred_pose0, pred_betas0, pred_pose1, pred_betas1 = self.model.forward_reg(xf0, xf1,
+                                                bb0, bb1,
+                                                position0, position1,
+                                                theta0[:,:6], theta1[:,:6],
+                                                theta0[:,6:], theta1[:,6:],
+                                                shape0, shape1)
+        for it in range(int(iters)-1):
+            pred_pose0, pred_betas0, pred_pose1, pred_betas1 = self.model.forward_reg(xf0, xf1,
+                                                    bb0, bb1,
+                                                    pred_pose0[:,:3], pred_pose1[:,:3],
+                                                    pred_pose0[:,3:9], pred_pose1[:,3:9],
+                                                    pred_pose0[:,9:], pred_pose1[:,9:],
+                                                    pred_betas0, pred_betas1)
+        return pred_pose0, pred_betas0, pred_pose1, pred_betas1
@@ -0,0 +1,71 @@
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from .metrics import mean_losses
+
+"""
+Validation schedule for the large synthetic set: a cheap pass over a fixed subset, stratified by
+subject and camera distance, every val_subset_steps training steps, and the full pass every
+check_val_every_n_epoch epochs. The subset losses are logged as <loss>/val_subset and
+val_subset_loss, the full pass as <loss>/val and val_full_loss; val_loss (the ModelCheckpoint
+monitor) is the one chosen with --val_monitor.
+"""
+
+def stratified_subset(strata, n, seed=0):
+    """
+    strata: stratum key of every sample
+    indices of about n samples, every stratum in proportion to its size and at least once
+    """
+    rng = np.random.RandomState(seed)
+    groups = {}
+    for idx, key in enumerate(strata):
+        groups.setdefault(key, []).append(idx)
+    frac = min(1., n/max(len(strata), 1))
+    indices = []
+    for key in sorted(groups):
+        members = groups[key]
+        k = max(1, int(round(frac*len(members))))
+        indices += rng.choice(members, k, replace=False).tolist()
+    return sorted(indices)
+
+
+def val_subset_loader(dset, hparams):
+    """ DataLoader of the stratified validation subset of dset (which has strata()) """
+    indices = stratified_subset(dset.strata(hparams.val_subset_dist_bins), hparams.val_subset_size)
+    print("validation subset: {} of {} samples".format(len(indices), len(dset)))
+    return DataLoader(Subset(dset, indices), batch_size=hparams.val_batch_size,
+                        num_workers=hparams.num_workers,
+                        pin_memory=hparams.pin_memory,
+                        shuffle=False,
+                        drop_last=False)
+
+
+def subset_validation(pl_module, dloader):
+    """ mean losses and mean total loss of pl_module over dloader, in eval mode without summaries """
+    was_training = pl_module.training
+    pl_module.eval()
+    loss_dicts = []
+    total = []
+    with torch.no_grad():
+        for batch in dloader:
+            batch = {k:v.to(pl_module.device) if torch.is_tensor(v) else v for k,v in batch.items()}
+            _, losses, loss = pl_module.fwd_pass_and_loss(batch,is_val=True,is_test=False)
+            loss_dicts.append(losses)
+            total.append(loss.detach())
+    pl_module.train(was_training)
+    return mean_losses(loss_dicts), torch.stack(total).mean()
+
+
+def is_subset_step(pl_module):
+    """ the subset pass runs before the training step whose end is a multiple of val_subset_steps,
+    so ModelCheckpoint(every_n_train_steps=val_subset_steps) sees its val_loss """
+    steps = pl_module.hparams.get("val_subset_steps", 0)
+    return steps > 0 and (pl_module.global_step + 1) % steps == 0
+
+
+def log_val_loss(pl_module, val_loss, subset=False):
+    """ val_subset_loss or val_full_loss, and val_loss for the pass chosen with --val_monitor """
+    pl_module.log("val_subset_loss" if subset else "val_full_loss", val_loss, sync_dist=True)
+    if (pl_module.hparams.get("val_monitor", "full") == "subset") == subset:
+        pl_module.log("val_loss", val_loss, sync_dist=True)
@@ -26,7 +26,7 @@ CY = IMG_SIZE[1]/2.
 FNORM = 1000
 
 # FOCAL_LENGTH = 5000.
-# IMG_RES = 224
+IMG_RES = 224   # reference crop resolution, crop space geometry is expressed at this size
 
 # Mean and standard deviation for normalizing input image
 IMG_NORM_MEAN = [0.485, 0.456, 0.406]
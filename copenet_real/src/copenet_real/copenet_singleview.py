@@ -20,10 +20,17 @@ from .dsets import aerialpeople, copenet_real
 import cv2
 import torchvision
 from .smplx.smplx import SMPLX, lbs
+from .utils.body_model import get_smplx
+from .utils.metrics import LossAggregator, mean_losses
+from .utils.distributed import process_device
+from .utils.preemption import ResumableSampler
+from .utils.result_store import result_writer, test_split
+from .utils.summary_worker import SummaryWorker, summary_view, render_summary
 import pickle as pk
 from .utils.renderer import Renderer
 from . import constants as CONSTANTS
 from .utils.utils import transform_smpl, add_noise_input_cams,add_noise_input_smpltrans
+from .utils.amp import autocast_forward, amp_dtype
 from .utils.geometry import batch_rodrigues, perspective_projection, estimate_translation, rot6d_to_rotmat
 
 import pytorch_lightning as pl
@@ -36,19 +43,12 @@ from .config import device
 vp_model = load_model("/ps/scratch/common/vposer/V02_05", model_code=VPoser,remove_words_in_model_weights="vp_model.")[0]
 
 smplx = None
-smplx_test = None
 
+def create_smplx(copenet_home):
+    global smplx
+    smplx = get_smplx(copenet_home, process_device(device))
 
-def create_smplx(copenet_home,train_batch_size,val_batch_size):
-    global smplx 
-    smplx = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
 
-    global smplx_test 
-    smplx_test = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
 
 class copenet_singleview(pl.LightningModule):
 
@@ -56,13 +56,13 @@ class copenet_singleview(pl.LightningModule):
         super(copenet_singleview, self).__init__()
         # not the best model...
         self.hparams = hparams
+        self.train_losses = LossAggregator()
+        self.summary_worker = None
         self.model = model_copenet_singleview.getcopenet(os.path.join(self.hparams.copenet_home,"src/copenet/data/smpl_mean_params.npz"))
 
-        create_smplx(self.hparams.copenet_home,self.hparams.batch_size,self.hparams.val_batch_size)
+        create_smplx(self.hparams.copenet_home)
         
-        smplx.to(device)
-        smplx_test.to(device)
-        vp_model.to(device)
+        vp_model.to(process_device(device))
         
         smplx_hand_idx = pk.load(open(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/MANO_SMPLX_vertex_ids.pkl"),'rb'))
         smplx_face_idx = np.load(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/SMPL-X__FLAME_vertex_ids.npy"))
@@ -77,7 +77,7 @@ class copenet_singleview(pl.LightningModule):
         self.renderer = Renderer(focal_length=self.focal_length, img_res=CONSTANTS.IMG_SIZE, faces=smplx.faces)
 
     def forward(self, **kwargs):
-        return self.model(**kwargs)
+        return autocast_forward(self.model, amp_dtype(self.hparams), **kwargs)
         
 
     def get_loss(self,input_batch, pred_smpltrans, pred_rotmat, pred_betas, pred_output_cam, pred_joints_2d_cam):
@@ -122,14 +122,14 @@ class copenet_singleview(pl.LightningModule):
 
         loss *= 60
 
-        losses = {'loss': loss.detach().item(),
-                  'loss_regr_trans': loss_regr_trans.detach().item(),
-                  'loss_keypoints': loss_keypoints.detach().item(),
-                  'loss_keypoints_3d': loss_keypoints_3d.detach().item(),
-                  'loss_regr_shape': loss_regr_shape.detach().item(),
-                  'loss_rootrot': loss_rootrot.detach().item(),
-                  'loss_regr_pose': loss_regr_pose.detach().item(),
-                  'loss_regul_betas': loss_regul_betas.detach().item()}
+        losses = {'loss': loss.detach(),
+                  'loss_regr_trans': loss_regr_trans.detach(),
+                  'loss_keypoints': loss_keypoints.detach(),
+                  'loss_keypoints_3d': loss_keypoints_3d.detach(),
+                  'loss_regr_shape': loss_regr_shape.detach(),
+                  'loss_rootrot': loss_rootrot.detach(),
+                  'loss_regr_pose': loss_regr_pose.detach(),
+                  'loss_regul_betas': loss_regul_betas.detach()}
 
         return loss, losses
 
@@ -163,10 +163,10 @@ class copenet_singleview(pl.LightningModule):
                 trans_scale = 0.05
                 in_smpltrans *= trans_scale
         
-        pred_pose, pred_betas = self.model.forward(x = im,
-                                                    bb = bb,
-                                                    init_position = in_smpltrans,
-                                                    iters = self.hparams.reg_iters)
+        pred_pose, pred_betas = self.forward(x = im,
+                                              bb = bb,
+                                              init_position = in_smpltrans,
+                                              iters = self.hparams.reg_iters)
                                                                         
 
         pred_smpltrans = pred_pose[:,:3]
@@ -183,7 +183,7 @@ class copenet_singleview(pl.LightningModule):
 
         # import ipdb; ipdb.set_trace()
         if is_val or is_test:
-            pred_output_cam = smplx_test.forward(betas=pred_betas, 
+            pred_output_cam = smplx.forward(betas=pred_betas, 
                                     body_pose=pred_rotmat[:,1:],
                                     global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas),
@@ -194,7 +194,7 @@ class copenet_singleview(pl.LightningModule):
                                                 pred_output_cam.vertices.squeeze(1),
                                                 pred_output_cam.joints.squeeze(1))
             if is_test:
-                pred_output_cam_in = smplx_test.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas), 
+                pred_output_cam_in = smplx.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas), 
                                         body_pose=pred_rotmat[:,1:],
                                         global_orient=pred_rotmat[:,:1],
                                         transl = torch.zeros(batch_size,3).float().type_as(pred_betas),
@@ -254,14 +254,13 @@ class copenet_singleview(pl.LightningModule):
         
         
         output, losses, loss = self.fwd_pass_and_loss(batch,is_val=False, is_test=False)
+        self.train_losses.update(losses)
 
         with torch.no_grad():
         # logging
             if batch_idx % self.hparams.summary_steps == 0:
-                train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-                self.logger.experiment.add_image('train_pred_shape_cam', train_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('train_input_images',train_summ_in_image, self.global_step)
-                for loss_name, val in losses.items():
+                self.log_summaries('train', batch, output)
+                for loss_name, val in self.train_losses.compute().items():
                     self.logger.experiment.add_scalar(loss_name + '/train', val, self.global_step)
 
         return {"loss" : loss}
@@ -273,20 +272,12 @@ class copenet_singleview(pl.LightningModule):
             output, losses, loss = self.fwd_pass_and_loss(batch,is_val=True, is_test=False)
 
             if batch_idx % self.hparams.val_summary_steps == 0:
-                val_summ_pred_image, val_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-
-                # logging
-                self.logger.experiment.add_image('val_pred_shape_cam', val_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('val_input_images',val_summ_in_image, self.global_step)
+                self.log_summaries('val', batch, output)
         
         return {'val_losses': losses,"val_loss":loss}
 
     def validation_epoch_end(self, outputs):
-        for loss_name, val in outputs[0]["val_losses"].items():
-            val_list = []
-            for x in outputs:
-                val_list.append(x["val_losses"][loss_name])
-            mean_val = np.mean(val_list)
+        for loss_name, mean_val in mean_losses([x["val_losses"] for x in outputs]).items():
             self.logger.experiment.add_scalar(loss_name + '/val', mean_val, self.global_step)
         return {"val_loss":outputs[0]["val_loss"]}
 
@@ -303,56 +294,53 @@ class copenet_singleview(pl.LightningModule):
 
     def train_dataloader(self):
         # REQUIRED
-        train_dset, _ = copenet_real.get_copenet_real_traintest(self.hparams.datapath)
+        train_dset, _ = copenet_real.get_copenet_real_traintest(self.hparams.datapath,img_res=self.hparams.img_res)
         return DataLoader(train_dset, batch_size=self.hparams.batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
-                            shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            sampler=ResumableSampler(train_dset, shuffle=self.hparams.shuffle_train),
+                            drop_last=False)
 
     def val_dataloader(self):
         # OPTIONAL
-        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath)
+        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,img_res=self.hparams.img_res)
         return DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
                             shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            drop_last=False)
 
-    def summaries(self, input_batch,output, losses, is_test):
-        batch_size = input_batch['im0'].shape[0]
-        skip_factor = 4    # number of samples to be logged
-        img_downsize_factor = 5
-        
+    def summary_views(self, input_batch, output):
+        """ CPU copies of the logged samples, rendered by render_summary """
+        return [
+            summary_view(input_batch, output, self.renderer, 'im0', 'pred_vertices_cam', background="frame", downsize=5)]
 
-        with torch.no_grad():
-            im = input_batch['im0'][::int(batch_size/skip_factor)] * torch.tensor([0.229, 0.224, 0.225], device=self.device).reshape(1,3,1,1)
-            im = im + torch.tensor([0.485, 0.456, 0.406], device=self.device).reshape(1,3,1,1)
-            images = []
-            
-            for i in range(0,batch_size,int(batch_size/skip_factor)):
-                # blank_img = torch.zeros(3,1080,1920).float()
-                # blank_img[:,input_batch["crop_info0"][i,0,0]:input_batch["crop_info0"][i,1,0],
-                #     input_batch["crop_info0"][i,0,1]:input_batch["crop_info0"][i,1,1]] = torch.from_numpy(cv2.imread(input_batch['im0_path'][i])[:,:,::-1]/255.).float().permute(2,0,1)
-                blank_img = torch.from_numpy(cv2.imread(input_batch['im0_path'][i])[:,:,::-1]/255.).float().permute(2,0,1)
-                images.append(blank_img)
-            images = torch.stack(images)
-            pred_vertices_cam = output['pred_vertices_cam'][::int(batch_size/skip_factor)]
-            # pred_vertices_cam = input_batch['smpl_vertices_rel'][::int(batch_size/skip_factor)].squeeze(1)
-            
-            images_pred_cam = self.renderer.visualize_tb(pred_vertices_cam,
-                                                        torch.zeros(batch_size,3,device=self._device).float(),
-                                                        torch.eye(3,device=self._device).float().unsqueeze(0).repeat(batch_size,1,1),
-                                                        images)
-            
-            summ_pred_image = images_pred_cam[:,::img_downsize_factor,::img_downsize_factor]
-            
-            summ_in_image = torchvision.utils.make_grid(im)
-            
-            if is_test:
-                import ipdb; ipdb.set_trace()
-            
-            return summ_pred_image, summ_in_image
+    def summaries(self, input_batch,output, losses, is_test):
+        summ_pred_image, summ_in_image = render_summary(self.summary_views(input_batch, output))
+        if is_test:
+            import ipdb; ipdb.set_trace()
+
+        return summ_pred_image, summ_in_image
+
+    def log_summaries(self, prefix, input_batch, output):
+        """ queue the image summaries on the summary worker, or render them here with --sync_summaries """
+        if self.global_rank != 0:
+            return
+        views = self.summary_views(input_batch, output)
+        if self.hparams.get("sync_summaries", False):
+            summ_pred_image, summ_in_image = render_summary(views)
+            self.logger.experiment.add_image(prefix + '_pred_shape_cam', summ_pred_image, self.global_step)
+            self.logger.experiment.add_image(prefix + '_input_images', summ_in_image, self.global_step)
+            return
+        if self.summary_worker is None:
+            self.summary_worker = SummaryWorker(self.logger.log_dir, self.hparams.get("summary_queue", 2))
+        self.summary_worker.submit(prefix, self.global_step, views)
+
+    def on_fit_end(self):
+        if self.summary_worker is not None:
+            self.summary_worker.close()
+            print("image summaries: {} rendered, {} dropped".format(self.summary_worker.n_submitted, self.summary_worker.n_dropped))
+            self.summary_worker = None
 
 
     def test_dataloader(self):
@@ -364,21 +352,26 @@ class copenet_singleview(pl.LightningModule):
                                 pin_memory=self.hparams.pin_memory,
                                 drop_last=False)
         else:
-            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath)
+            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,img_res=self.hparams.img_res)
             train_dloader = DataLoader(train_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=True,
-                                        drop_last=True)
+                                        drop_last=False)
             test_dloader = DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=True,
-                                        drop_last=True)
+                                        drop_last=False)
 
             return [test_dloader, train_dloader]
 
 
+    def on_test_epoch_start(self):
+        self.result_writer = result_writer(self)
+        # per dataloader sums of the translation and angle errors and their frame counts
+        self.test_errors = {}
+
     def test_step(self, batch, batch_idx, dset_idx=0):
         # OPTIONAL
         output, losses, loss = self.fwd_pass_and_loss(batch,is_val=True,is_test=True)
@@ -386,29 +379,26 @@ class copenet_singleview(pl.LightningModule):
         train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=True)
         # cv2.imwrite(train_summ_pred_image.permute(1,2,0).data.numpy())
         
-        return {"test_loss" : loss,
-                "output" : output}
+        err_smpltrans = torch.norm((output["pred_smpltrans"] - output["gt_smpltrans"]).reshape(-1,3),dim=1)
+        err_smplangles = torch.norm((output["pred_angles"] - output["gt_angles"]).reshape(-1,22,3),dim=2).mean(1)
+        errors = self.test_errors.setdefault(dset_idx, {"smpltrans":0., "smplangles":0., "n":0})
+        errors["smpltrans"] += err_smpltrans.sum().item()
+        errors["smplangles"] += err_smplangles.sum().item()
+        errors["n"] += err_smpltrans.shape[0]
 
-    def test_epoch_end(self, outputs):
-        # OPTIONAL
-        test_err_smpltrans = np.array([(x["output"]["pred_smpltrans"] - 
-            x["output"]["gt_smpltrans"]).cpu().numpy() for x in outputs[0]]).reshape(-1,3)
-        test_err_smplangles = np.array([(x["output"]["pred_angles"] - 
-            x["output"]["gt_angles"]).cpu().numpy() for x in outputs[0]]).reshape(-1,22,3)
-
-        mean_test_err_smpltrans = np.mean(np.sqrt(np.sum(test_err_smpltrans**2,1)))
-        mean_test_err_smplangles = np.mean(np.sqrt(np.sum(test_err_smplangles**2,2)))
-
-        train_err_smpltrans = np.array([(x["output"]["pred_smpltrans"] - 
-            x["output"]["gt_smpltrans"]).cpu().numpy() for x in outputs[1]]).reshape(-1,3)
-        train_err_smplangles = np.array([(x["output"]["pred_angles"] - 
-            x["output"]["gt_angles"]).cpu().numpy() for x in outputs[1]]).reshape(-1,22,3)
+        # the outputs go to the result store, not to test_epoch_end
+        self.result_writer.write(test_split(dset_idx), output)
+        return {"test_loss" : loss}
 
-        mean_train_err_smpltrans = np.mean(np.sqrt(np.sum(train_err_smpltrans**2,1)))
-        mean_train_err_smplangles = np.mean(np.sqrt(np.sum(train_err_smplangles**2,2)))
-
-        import ipdb; ipdb.set_trace()
-        return {"outputs":outputs}
+    def test_epoch_end(self, outputs):
+        self.result_writer.close()
+        for dset_idx, errors in sorted(self.test_errors.items()):
+            split = test_split(dset_idx)
+            mean_err_smpltrans = errors["smpltrans"]/errors["n"]
+            mean_err_smplangles = errors["smplangles"]/errors["n"]
+            print("{}: mean_err_smpltrans {}, mean_err_smplangles {}".format(split, mean_err_smpltrans, mean_err_smplangles))
+            self.log("mean_{}_err_smpltrans".format(split), mean_err_smpltrans)
+            self.log("mean_{}_err_smplangles".format(split), mean_err_smplangles)
 
 
     @staticmethod
@@ -438,10 +428,19 @@ class copenet_singleview(pl.LightningModule):
         train.add_argument('--log_dir', default='/is/cluster/nsaini/copenet_logs', help='Directory to store logs')
         train.add_argument('--testdata', type=str, default="aerialpeople", help='test dataset')
         train.add_argument("--lr", type=float, default=5e-5, help="Learning rate")
+        amp = train.add_mutually_exclusive_group()
+        amp.add_argument('--fp16', action='store_true', help='backbone and regressor in float16 autocast (cuda) with loss scaling, SMPL-X and the losses in fp32')
+        amp.add_argument('--bf16', action='store_true', help='backbone and regressor in bfloat16 autocast (torch >= 1.10), SMPL-X and the losses in fp32')
         train.add_argument('--batch_size', type=int, default=30, help='Batch size')
         train.add_argument('--val_batch_size', type=int, default=30, help='Validation data batch size')
+        train.add_argument('--result_store', type=str, default=None, help='directory of the result store the test outputs are written to, <log dir>/test_results by default')
+        train.add_argument('--result_fields', type=str, default='', help='comma separated test outputs stored, all by default')
+        train.add_argument('--result_dtype', type=str, default='none', help='dtype of the stored floating point fields (e.g. float16), none keeps it')
+        train.add_argument('--result_chunk_frames', type=int, default=512, help='frames per chunk file of the result store')
         train.add_argument('--summary_steps', type=int, default=100, help='Summary saving frequency')
         train.add_argument('--val_summary_steps', type=float, default=10, help='validation summary frequency')
+        train.add_argument('--sync_summaries', action='store_true', help='render the image summaries in the training loop instead of the summary worker')
+        train.add_argument('--summary_queue', type=int, default=2, help='image summaries waiting for the summary worker, more are dropped')
         train.add_argument('--checkpoint_steps', type=int, default=10000, help='Checkpoint saving frequency')
         train.add_argument('--img_res', type=int, default=224, help='Rescale bounding boxes to size [img_res, img_res] before feeding them in the network') 
         train.add_argument('--shape_loss_weight', default=1, type=float, help='Weight of per-vertex loss') 
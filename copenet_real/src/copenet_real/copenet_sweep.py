@@ -0,0 +1,219 @@
+"""
+Loss weight sweep of the two view network on one machine, with successive halving.
+The backbone features of the train and validation sets are cached once (utils/feature_cache) and
+memory-mapped read-only by every trial, the trials train the regressor head on the CPU in a pool
+of sweep_parallel processes pinned to disjoint cores. Rung r trains the surviving trials up to
+sweep_min_steps*sweep_eta**r steps, evaluates the confidence weighted 2D keypoint error on a fixed
+validation subset (comparable across loss weights, unlike the loss) and keeps the best 1/sweep_eta.
+"""
+from argparse import ArgumentParser, Namespace
+from copenet_real.copenet_twoview import copenet_twoview
+from copenet_real.utils.feature_cache import build_feature_cache, load_feature_cache, cache_key, FeatureCacheDataset
+from copenet_real.utils.preemption import rng_state, set_rng_state
+from copenet_real.utils.keypoints import keypoint_error
+from copenet_real.dsets import copenet_real
+import torch
+import numpy as np
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, Subset, RandomSampler
+
+from config import device
+
+import os, sys, time, math
+
+# loss weights of copenet_twoview.get_loss, searched log-uniformly in [default/10, default*10]
+DEFAULT_SPACE = ["keypoint2d_loss_weight", "limbs2d_loss_weight", "pose_loss_weight",
+                    "beta_loss_weight", "vposer_loss_weight"]
+
+
+def parse_space(space, parser):
+    """ "name=low:high,..." or "name,..." (around the parser default) to {name: (low, high)} """
+    bounds = {}
+    for item in space.split(","):
+        if "=" in item:
+            name, rng = item.split("=")
+            bounds[name] = tuple(float(x) for x in rng.split(":"))
+        else:
+            default = float(parser.get_default(item))
+            bounds[item] = (default/10, default*10)
+    return bounds
+
+
+def sample_trials(bounds, n_trials, seed):
+    rng = np.random.RandomState(seed)
+    return [{k:float(np.exp(rng.uniform(np.log(lo), np.log(hi)))) for k,(lo,hi) in bounds.items()}
+                for _ in range(n_trials)]
+
+
+def build_caches(args):
+    """ train and validation feature caches, built by the sweep process before the trials start """
+    train_dset, val_dset = copenet_real.get_copenet_real_traintest(args.datapath,img_res=args.img_res)
+    val_dir = os.path.join(args.feature_cache,"val")
+    train_cache = load_feature_cache(args.feature_cache, cache_key(args, train_dset))
+    val_cache = load_feature_cache(val_dir, cache_key(args, val_dset))
+    if train_cache is None or val_cache is None:
+        net = load_model(args).to(device)
+        if train_cache is None:
+            build_feature_cache(net.model, train_dset, args.feature_cache, cache_key(args, train_dset),
+                                    batch_size=args.val_batch_size, num_workers=args.num_workers)
+        if val_cache is None:
+            build_feature_cache(net.model, val_dset, val_dir, cache_key(args, val_dset),
+                                    batch_size=args.val_batch_size, num_workers=args.num_workers)
+        del net
+
+
+def load_model(args):
+    if args.pretrained_checkpoint is not None:
+        return copenet_twoview.load_from_checkpoint(checkpoint_path=args.pretrained_checkpoint,hparams=args)
+    return copenet_twoview(hparams=args)
+
+
+def pin_worker(cores):
+    """ pool initializer, each worker takes one set of cores """
+    my_cores = cores.get()
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, my_cores)
+    torch.set_num_threads(len(my_cores))
+
+
+def val_keypoint_error(net, val_dl):
+    """ confidence weighted mean 2D joint error in pixels over both views """
+    err = 0.
+    conf = 0.
+    with torch.no_grad():
+        for batch in val_dl:
+            output, _, _ = net.fwd_pass_and_loss(batch,is_val=False,is_test=True)
+            batch_err, batch_conf = keypoint_error([output["pred_j2d_cam0"], output["pred_j2d_cam1"]],
+                                                    [batch["smpl_joints_2d0"][:,0], batch["smpl_joints_2d1"][:,0]])
+            err += batch_err
+            conf += batch_conf
+    return err/max(conf, 1e-8)
+
+
+def run_trial(trial, params, n_steps, args):
+    """ trains trial up to n_steps (continuing from its last rung) and evaluates it """
+    t0 = time.time()
+    trial_dir = os.path.join(args.log_dir, args.name, "sweep", "trial_{:03d}".format(trial))
+    os.makedirs(trial_dir, exist_ok=True)
+    hparams = Namespace(**dict(vars(args), **params))
+    net = load_model(hparams)
+    net.train()
+    optimizer = net.configure_optimizers()
+
+    step = 0
+    state_file = os.path.join(trial_dir, "state.pt")
+    if os.path.exists(state_file):
+        state = torch.load(state_file)
+        net.model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        set_rng_state(state["rng"])
+        step = state["step"]
+    else:
+        torch.manual_seed(args.sweep_seed + trial)
+
+    train_ds = FeatureCacheDataset(args.feature_cache)
+    generator = torch.Generator().manual_seed(args.sweep_seed + 1000*trial + step)
+    train_dl = DataLoader(train_ds, batch_size=args.batch_size, num_workers=0, drop_last=True,
+                            sampler=RandomSampler(train_ds, generator=generator))
+    train_loss = []
+    while step < n_steps:
+        for batch in train_dl:
+            _, _, loss = net.fwd_pass_and_loss(batch,is_val=False,is_test=False,with_vertices=False)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            train_loss.append(loss.item())
+            step += 1
+            if step == n_steps:
+                break
+
+    torch.save({"model": net.model.state_dict(), "optimizer": optimizer.state_dict(), "step": step,
+                "rng": rng_state()}, state_file)
+
+    val_ds = FeatureCacheDataset(os.path.join(args.feature_cache,"val"))
+    val_idx = np.linspace(0,len(val_ds)-1,min(args.sweep_val_samples,len(val_ds))).astype(int)
+    val_dl = DataLoader(Subset(val_ds,val_idx), batch_size=args.val_batch_size, num_workers=0, shuffle=False)
+    net.eval()
+    kp_err = val_keypoint_error(net, val_dl)
+    return {"trial": trial, "steps": step, "kp_err": kp_err,
+            "train_loss": float(np.mean(train_loss[-100:])) if train_loss else float("nan"),
+            "time": time.time() - t0}
+
+
+def write_summary(path, trials, results, names):
+    """ one row per trial at its last rung, sorted by the rung reached and the keypoint error """
+    header = ["trial"] + names + ["rung", "steps", "kp_err_px", "train_loss", "time_s"]
+    rows = []
+    for trial, params in enumerate(trials):
+        rung, res = max(results[trial].items())
+        rows.append([trial] + [params[k] for k in names] + [rung, res["steps"], res["kp_err"],
+                        res["train_loss"], sum(r["time"] for r in results[trial].values())])
+    rows = sorted(rows, key=lambda r: (-r[-5], r[-3]))
+    with open(path, "w") as f:
+        f.write(",".join(header) + "\n")
+        for row in rows:
+            f.write(",".join(str(x) for x in row) + "\n")
+    print(" ".join("{:>22}".format(h) for h in header))
+    for row in rows:
+        print(" ".join("{:>22.6g}".format(x) if isinstance(x, float) else "{:>22}".format(x) for x in row))
+
+
+def main(args, parser):
+    bounds = parse_space(args.sweep_space, parser)
+    names = list(bounds.keys())
+    trials = sample_trials(bounds, args.sweep_trials, args.sweep_seed)
+    sweep_dir = os.path.join(args.log_dir, args.name, "sweep")
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    build_caches(args)
+
+    # disjoint core sets, one per worker
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    per_worker = max(1, len(cores)//args.sweep_parallel)
+    ctx = mp.get_context("spawn")
+    core_queue = ctx.Queue()
+    for i in range(args.sweep_parallel):
+        core_queue.put(cores[i*per_worker:(i+1)*per_worker] or cores[-per_worker:])
+    pool = ctx.Pool(args.sweep_parallel, initializer=pin_worker, initargs=(core_queue,))
+
+    results = {trial:{} for trial in range(len(trials))}
+    alive = list(range(len(trials)))
+    total_steps = 0
+    for rung in range(args.sweep_rungs):
+        n_steps = args.sweep_min_steps * args.sweep_eta**rung
+        print("rung {}: {} trials to {} steps".format(rung, len(alive), n_steps))
+        jobs = [pool.apply_async(run_trial, (trial, trials[trial], n_steps, args)) for trial in alive]
+        for job in jobs:
+            res = job.get()
+            total_steps += res["steps"] - max([r["steps"] for r in results[res["trial"]].values()] or [0])
+            results[res["trial"]][rung] = res
+            print("trial {}: {} steps, kp err {:.2f} px".format(res["trial"], res["steps"], res["kp_err"]))
+        write_summary(os.path.join(sweep_dir, "summary.csv"), trials, results, names)
+        alive = sorted(alive, key=lambda t: results[t][rung]["kp_err"])[:max(1, math.ceil(len(alive)/args.sweep_eta))]
+    pool.close()
+    pool.join()
+
+    full = len(trials) * args.sweep_min_steps * args.sweep_eta**(args.sweep_rungs-1)
+    print("trained {} steps, {:.1f}% of training every trial to the last rung".format(total_steps, 100*total_steps/full))
+    print("best trial {}: {}".format(alive[0], trials[alive[0]]))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(add_help=False)
+    parser = copenet_twoview.add_model_specific_args(parser)
+    # usage: python copenet_sweep.py --name sweep --version 0 --model copenet_twoview --datapath <data>
+    #           --feature_cache <dir> [--pretrained_checkpoint <ckpt>] --sweep_trials 27 --sweep_parallel 4
+    sweep = parser.add_argument_group('Sweep')
+    sweep.add_argument('--sweep_space', type=str, default=",".join(DEFAULT_SPACE), help='name=low:high,... log-uniform ranges, a bare name is searched in [default/10, default*10]')
+    sweep.add_argument('--sweep_trials', type=int, default=27, help='number of sampled configurations')
+    sweep.add_argument('--sweep_parallel', type=int, default=4, help='trials trained at the same time, the cores are split between them')
+    sweep.add_argument('--sweep_min_steps', type=int, default=200, help='training steps of the first rung')
+    sweep.add_argument('--sweep_eta', type=int, default=3, help='the best 1/eta trials of a rung are trained eta times longer')
+    sweep.add_argument('--sweep_rungs', type=int, default=3, help='number of rungs')
+    sweep.add_argument('--sweep_val_samples', type=int, default=600, help='validation samples the trials are ranked on')
+    sweep.add_argument('--sweep_seed', type=int, default=123, help='seed of the sampled configurations and the trials')
+    args = parser.parse_args()
+    if args.feature_cache is None:
+        sys.exit("--feature_cache is required, the trials share the cached backbone features")
+    main(args, parser)
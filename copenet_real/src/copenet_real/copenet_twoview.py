@@ -15,6 +15,7 @@ import numpy as np
 import torchgeometry as tgm
 from config import device
 import copy
+import functools
 from .models import model_copenet as model_copenet
 from .dsets import aerialpeople, copenet_real
 
@@ -27,10 +28,18 @@ from .dsets import aerialpeople, copenet_real
 import cv2
 import torchvision
 from .smplx.smplx import SMPLX, lbs
+from .utils.body_model import get_smplx, get_smplx_joints, checkpointed_forward
+from .utils.metrics import LossAggregator, mean_losses
+from .utils.distributed import process_device
+from .utils.preemption import ResumableSampler
+from .utils.result_store import result_writer, test_split
+from .utils.summary_worker import SummaryWorker, summary_view, render_summary
+from .utils.feature_cache import build_feature_cache, load_feature_cache, cache_key
 import pickle as pk
 from .utils.renderer import Renderer
 from . import constants as CONSTANTS
 from .utils.utils import transform_smpl, add_noise_input_cams,add_noise_input_smpltrans
+from .utils.amp import autocast_forward, amp_dtype
 from .utils.geometry import batch_rodrigues, perspective_projection, estimate_translation, rot6d_to_rotmat
 
 import pytorch_lightning as pl
@@ -43,19 +52,13 @@ from human_body_prior.models.vposer_model import VPoser
 vp_model = load_model(vposer_weights, model_code=VPoser,remove_words_in_model_weights="vp_model.")[0]
 
 smplx = None
-smplx_test = None
-
-def create_smplx(copenet_home,train_batch_size,val_batch_size):
-    global smplx 
-    smplx = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
-
-    global smplx_test 
-    smplx_test = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=val_batch_size,
-                         create_transl=False)
+smplx_joints = None
 
+def create_smplx(copenet_home):
+    global smplx
+    global smplx_joints
+    smplx = get_smplx(copenet_home, process_device(device))
+    smplx_joints = get_smplx_joints(copenet_home, process_device(device))
 
 
 
@@ -65,13 +68,14 @@ class copenet_twoview(pl.LightningModule):
         super(copenet_twoview, self).__init__()
         # not the best model...
         self.save_hyperparameters(hparams)
+        self.train_losses = LossAggregator()
+        self.summary_worker = None
         self.model = model_copenet.getcopenet(os.path.join(self.hparams.copenet_home,"src/copenet/data/smpl_mean_params.npz"))
+        self.model.checkpoint_backbone = self.hparams.get("checkpoint_backbone", False)
 
-        create_smplx(self.hparams.copenet_home,self.hparams.batch_size,self.hparams.val_batch_size)
+        create_smplx(self.hparams.copenet_home)
         
-        smplx.to(device)
-        smplx_test.to(device)
-        vp_model.to(device)
+        vp_model.to(process_device(device))
 
         smplx_hand_idx = pk.load(open(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/MANO_SMPLX_vertex_ids.pkl"),'rb'))
         smplx_face_idx = np.load(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/SMPL-X__FLAME_vertex_ids.npy"))
@@ -94,7 +98,7 @@ class copenet_twoview(pl.LightningModule):
                             faces=smplx.faces)
 
     def forward(self, **kwargs):
-        return self.model(**kwargs)
+        return autocast_forward(self.model, amp_dtype(self.hparams), **kwargs)
         
 
     def get_loss(self,input_batch, 
@@ -151,28 +155,29 @@ class copenet_twoview(pl.LightningModule):
 
         loss *= 60
 
-        losses = {'loss': loss.detach().item(),
-                  'loss_regul_vposer': loss_regul_vposer.detach().item(),
-                  'loss_regr_pose': loss_regr_pose.detach().item(),
-                  'loss_keypoints': loss_keypoints.detach().item(),
-                  'loss_regul_betas': loss_regul_betas.detach().item()}
+        losses = {'loss': loss.detach(),
+                  'loss_regul_vposer': loss_regul_vposer.detach(),
+                  'loss_regr_pose': loss_regr_pose.detach(),
+                  'loss_keypoints': loss_keypoints.detach(),
+                  'loss_regul_betas': loss_regul_betas.detach()}
 
         return loss, losses
 
 
-    def fwd_pass_and_loss(self,input_batch,is_val=False,is_test=False):
+    def fwd_pass_and_loss(self,input_batch,is_val=False,is_test=False,with_vertices=True):
         
         with torch.no_grad():
             # Get data from the batch
-            im0 = input_batch['im0'].float() # input image
-            im1 = input_batch['im1'].float() # input image
+            # batches of the feature cache carry the backbone features instead of the images
+            im0 = input_batch['im0'].float() if 'im0' in input_batch else None # input image
+            im1 = input_batch['im1'].float() if 'im1' in input_batch else None # input image
             bb0 = input_batch['bb0']
             bb1 = input_batch['bb1']
             intr0 = input_batch['intr0']
             intr1 = input_batch['intr1']
             
         
-            batch_size = im0.shape[0]
+            batch_size = bb0.shape[0]
             
             
             in_smpltrans0 = torch.from_numpy(np.array([0,0,10])).float().expand(batch_size, -1).type_as(bb0).clone()
@@ -198,7 +203,10 @@ class copenet_twoview(pl.LightningModule):
                                                             bb1 = bb1,
                                                             init_position0 = in_smpltrans0,
                                                             init_position1 = in_smpltrans1,
-                                                            iters = self.hparams.reg_iters)
+                                                            iters = self.hparams.reg_iters,
+                                                            exit_threshold = None if self.training else self.hparams.get("reg_exit_threshold"),
+                                                            xf0 = input_batch.get('xf0'),
+                                                            xf1 = input_batch.get('xf1'))
                                                                         
 
         pred_smpltrans0 = pred_pose0[:,:3]
@@ -224,7 +232,7 @@ class copenet_twoview(pl.LightningModule):
         # #################################
         
         if is_val or is_test:
-            pred_output_cam0 = smplx_test.forward(betas=pred_betas0, 
+            pred_output_cam0 = smplx.forward(betas=pred_betas0, 
                                     body_pose=pred_rotmat0[:,1:],
                                     global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -235,7 +243,7 @@ class copenet_twoview(pl.LightningModule):
                                                 pred_output_cam0.vertices.squeeze(1),
                                                 pred_output_cam0.joints.squeeze(1))
 
-            pred_output_cam1 = smplx_test.forward(betas=pred_betas1, 
+            pred_output_cam1 = smplx.forward(betas=pred_betas1, 
                                     body_pose=pred_rotmat1[:,1:],
                                     global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -246,7 +254,7 @@ class copenet_twoview(pl.LightningModule):
                                                 pred_output_cam1.vertices.squeeze(1),
                                                 pred_output_cam1.joints.squeeze(1))
             if is_test:
-                pred_output_cam_in0 = smplx_test.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas0), 
+                pred_output_cam_in0 = smplx.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas0), 
                                         body_pose=pred_rotmat0[:,1:],
                                         global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                         transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -257,7 +265,7 @@ class copenet_twoview(pl.LightningModule):
                                                     pred_output_cam_in0.vertices.squeeze(1),
                                                     pred_output_cam_in0.joints.squeeze(1))
 
-                pred_output_cam_in1 = smplx_test.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas1), 
+                pred_output_cam_in1 = smplx.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas1), 
                                         body_pose=pred_rotmat1[:,1:],
                                         global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                         transl = torch.zeros(batch_size,3).float().type_as(pred_betas1),
@@ -268,7 +276,13 @@ class copenet_twoview(pl.LightningModule):
                                                     pred_output_cam_in1.vertices.squeeze(1),
                                                     pred_output_cam_in1.joints.squeeze(1))
         else:
-            pred_output_cam0 = smplx.forward(betas=pred_betas0, 
+            # the keypoint losses only need the joints, the vertices are for the summaries
+            body_model = smplx if with_vertices else smplx_joints
+            body_forward = body_model.forward
+            if self.hparams.get("checkpoint_smplx"):
+                # the skinning is recomputed in the backward instead of keeping its activations
+                body_forward = functools.partial(checkpointed_forward, body_model)
+            pred_output_cam0 = body_forward(betas=pred_betas0, 
                                 body_pose=pred_rotmat0[:,1:],
                                 global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                 transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -278,10 +292,10 @@ class copenet_twoview(pl.LightningModule):
                                 pred_smpltrans0.unsqueeze(2)],dim=2)
 
             pred_vertices_cam0,pred_joints_cam0,_,_ = transform_smpl(transf_mat0,
-                                                pred_output_cam0.vertices.squeeze(1),
+                                                pred_output_cam0.vertices,
                                                 pred_output_cam0.joints.squeeze(1))
             
-            pred_output_cam1 = smplx.forward(betas=pred_betas1, 
+            pred_output_cam1 = body_forward(betas=pred_betas1, 
                                 body_pose=pred_rotmat1[:,1:],
                                 global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                 transl = torch.zeros(batch_size,3).float().type_as(pred_betas1),
@@ -291,7 +305,7 @@ class copenet_twoview(pl.LightningModule):
                                 pred_smpltrans1.unsqueeze(2)],dim=2)
 
             pred_vertices_cam1,pred_joints_cam1,_,_ = transform_smpl(transf_mat1,
-                                                pred_output_cam1.vertices.squeeze(1),
+                                                pred_output_cam1.vertices,
                                                 pred_output_cam1.joints.squeeze(1))
         
         pred_joints_2d_cam0 = perspective_projection(pred_joints_cam0,
@@ -346,12 +360,13 @@ class copenet_twoview(pl.LightningModule):
                                 pred_joints_2d_cam0,
                                 pred_joints_2d_cam1)
             # Pack output arguments for tensorboard logging
-            output = {'pred_vertices_cam0': pred_vertices_cam0.detach(),
-                        'pred_vertices_cam1': pred_vertices_cam1.detach(),
-                        'pred_smpltrans0': pred_smpltrans0.detach(),
+            output = {'pred_smpltrans0': pred_smpltrans0.detach(),
                         'pred_smpltrans1': pred_smpltrans1.detach(),
                         'in_smpltrans0': in_smpltrans0.detach(),
                         'in_smpltrans1': in_smpltrans1.detach()}
+            if with_vertices:
+                output['pred_vertices_cam0'] = pred_vertices_cam0.detach()
+                output['pred_vertices_cam1'] = pred_vertices_cam1.detach()
         
 
         return output, losses, loss
@@ -372,15 +387,15 @@ class copenet_twoview(pl.LightningModule):
             for param in self.model.deccam.parameters():
                 param.requires_grad = True
         
-        output, losses, loss = self.fwd_pass_and_loss(batch,is_val=False, is_test=False)
+        summary_step = batch_idx % self.hparams.summary_steps == 0
+        output, losses, loss = self.fwd_pass_and_loss(batch,is_val=False, is_test=False, with_vertices=summary_step and self.global_rank == 0)
+        self.train_losses.update(losses)
 
         with torch.no_grad():
         # logging
-            if batch_idx % self.hparams.summary_steps == 0:
-                train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-                self.logger.experiment.add_image('train_pred_shape_cam', train_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('train_input_images',train_summ_in_image, self.global_step)
-                for loss_name, val in losses.items():
+            if summary_step:
+                self.log_summaries('train', batch, output)
+                for loss_name, val in self.train_losses.compute().items():
                     self.logger.experiment.add_scalar(loss_name + '/train', val, self.global_step)
 
         return {"loss" : loss}
@@ -391,20 +406,12 @@ class copenet_twoview(pl.LightningModule):
             output, losses, loss = self.fwd_pass_and_loss(batch,is_val=True, is_test=False)
 
             if batch_idx % self.hparams.val_summary_steps == 0:
-                val_summ_pred_image, val_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-
-                # logging
-                self.logger.experiment.add_image('val_pred_shape_cam', val_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('val_input_images',val_summ_in_image, self.global_step)
+                self.log_summaries('val', batch, output)
         
         return {'val_losses': losses,"val_loss":loss}
 
     def validation_epoch_end(self, outputs):
-        for loss_name, val in outputs[0]["val_losses"].items():
-            val_list = []
-            for x in outputs:
-                val_list.append(x["val_losses"][loss_name])
-            mean_val = np.mean(val_list)
+        for loss_name, mean_val in mean_losses([x["val_losses"] for x in outputs]).items():
             self.logger.experiment.add_scalar(loss_name + '/val', mean_val, self.global_step)
         return {"val_loss":outputs[0]["val_loss"]}
 
@@ -419,109 +426,109 @@ class copenet_twoview(pl.LightningModule):
 
         return optimizer#, [scheduler]
 
+    def use_feature_cache(self):
+        """ the regressor head is trained from the feature cache for the first train_reg_only_epochs """
+        return self.hparams.get("feature_cache") is not None and self.current_epoch < int(self.hparams.get("train_reg_only_epochs",-1))
+
+    def feature_cache(self, train_dset):
+        key = cache_key(self.hparams, train_dset)
+        # with ddp rank 0 builds the cache (on a filesystem shared by the nodes), the others wait for it
+        if self.trainer.is_global_zero and load_feature_cache(self.hparams.feature_cache, key) is None:
+            build_feature_cache(self.model, train_dset, self.hparams.feature_cache, key,
+                                    batch_size=self.hparams.val_batch_size,
+                                    num_workers=self.hparams.num_workers)
+        self.trainer.strategy.barrier("feature_cache")
+        return load_feature_cache(self.hparams.feature_cache, key)
+
     def train_dataloader(self):
         # REQUIRED
-        train_dset,_ = copenet_real.get_copenet_real_traintest(self.hparams.datapath)
+        train_dset,_ = copenet_real.get_copenet_real_traintest(self.hparams.datapath,img_res=self.hparams.img_res)
+        if self.use_feature_cache():
+            # no image decoding, the memory-mapped features are read in the main process
+            cache_dset = self.feature_cache(train_dset)
+            return DataLoader(cache_dset, batch_size=self.hparams.batch_size,
+                                num_workers=0,
+                                sampler=ResumableSampler(cache_dset, shuffle=self.hparams.shuffle_train),
+                                drop_last=False)
         return DataLoader(train_dset, batch_size=self.hparams.batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
-                            shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            sampler=ResumableSampler(train_dset, shuffle=self.hparams.shuffle_train),
+                            drop_last=False)
 
     def val_dataloader(self):
         # OPTIONAL
-        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath)
+        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,img_res=self.hparams.img_res)
         return DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
                             shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            drop_last=False)
+
+    def summary_views(self, input_batch, output):
+        """ CPU copies of the logged samples, rendered by render_summary """
+        return [
+            summary_view(input_batch, output, self.renderer0, 'im0', 'pred_vertices_cam0', background="frame", downsize=2),
+            summary_view(input_batch, output, self.renderer1, 'im1', 'pred_vertices_cam1', background="frame", downsize=2)]
 
     def summaries(self, input_batch,output, losses, is_test):
-        batch_size = input_batch['im0'].shape[0]
-        skip_factor = 4    # number of samples to be logged
-        img_downsize_factor = 2
-        
-        
-        with torch.no_grad():
-            im0 = input_batch['im0'][::int(batch_size/skip_factor)] * torch.tensor([0.229, 0.224, 0.225], device=self.device).reshape(1,3,1,1)
-            im0 = im0 + torch.tensor([0.485, 0.456, 0.406], device=self.device).reshape(1,3,1,1)
-            images0 = []
-            for i in range(0,batch_size,int(batch_size/skip_factor)):
-                # blank_img = torch.zeros(3,1080,1920).float()
-                # blank_img[:,input_batch["crop_info0"][i,0,0]:input_batch["crop_info0"][i,1,0],
-                #     input_batch["crop_info0"][i,0,1]:input_batch["crop_info0"][i,1,1]] = torch.from_numpy(cv2.imread(input_batch['im0_path'][i])[:,:,::-1]/255.).float().permute(2,0,1)
-                blank_img = torch.from_numpy(cv2.imread(input_batch['im0_path'][i])[:,:,::-1]/255.).float().permute(2,0,1)
-                images0.append(blank_img)
-            images0 = torch.stack(images0)
-            pred_vertices_cam0 = output['pred_vertices_cam0'][::int(batch_size/skip_factor)]
-            # pred_vertices_cam = input_batch['smpl_vertices_rel'][::int(batch_size/skip_factor)].squeeze(1)
-            
-            images_pred_cam0 = self.renderer0.visualize_tb(pred_vertices_cam0,
-                                                        torch.zeros(batch_size,3,device=self._device).float(),
-                                                        torch.eye(3,device=self._device).float().unsqueeze(0).repeat(batch_size,1,1),
-                                                        images0)
-            
-            summ_pred_image0 = images_pred_cam0[:,::img_downsize_factor,::img_downsize_factor]
-            
-            summ_in_image0 = torchvision.utils.make_grid(im0)
-
-            im1 = input_batch['im1'][::int(batch_size/skip_factor)] * torch.tensor([0.229, 0.224, 0.225], device=self.device).reshape(1,3,1,1)
-            im1 = im1 + torch.tensor([0.485, 0.456, 0.406], device=self.device).reshape(1,3,1,1)
-
-            images1= []
-            for i in range(0,batch_size,int(batch_size/skip_factor)):
-                # blank_img = torch.zeros(3,1080,1920).float()
-                # blank_img[:,input_batch["crop_info1"][i,0,0]:input_batch["crop_info1"][i,1,0],
-                #     input_batch["crop_info1"][i,0,1]:input_batch["crop_info1"][i,1,1]] = torch.from_numpy(cv2.imread(input_batch['im1_path'][i])[:,:,::-1]/255.).float().permute(2,0,1)
-                blank_img = torch.from_numpy(cv2.imread(input_batch['im1_path'][i])[:,:,::-1]/255.).float().permute(2,0,1)
-                images1.append(blank_img)
-            images1 = torch.stack(images1)
-            pred_vertices_cam1 = output['pred_vertices_cam1'][::int(batch_size/skip_factor)]
-            
-            
-            images_pred_cam1 = self.renderer1.visualize_tb(pred_vertices_cam1,
-                                                        torch.zeros(batch_size,3,device=self._device).float(),
-                                                        torch.eye(3,device=self._device).float().unsqueeze(0).repeat(batch_size,1,1),
-                                                        images1)
-            
-            summ_pred_image1 = images_pred_cam1[:,::img_downsize_factor,::img_downsize_factor]
-            
-            summ_in_image1 = torchvision.utils.make_grid(im1)
+        summ_pred_image, summ_in_image = render_summary(self.summary_views(input_batch, output))
+        if is_test and self.hparams.testdata.lower() == "aircapdata":
+            import ipdb; ipdb.set_trace()
 
-            summ_in_image = torch.cat((summ_in_image0, summ_in_image1),1)
-            summ_pred_image = torch.cat((summ_pred_image0, summ_pred_image1),1)
-            # import ipdb; ipdb.set_trace()
-            if is_test and self.hparams.testdata.lower() == "aircapdata":
-                import ipdb; ipdb.set_trace()
-            
-            return summ_pred_image, summ_in_image
+        return summ_pred_image, summ_in_image
+
+    def log_summaries(self, prefix, input_batch, output):
+        """ queue the image summaries on the summary worker, or render them here with --sync_summaries """
+        if self.global_rank != 0:
+            return
+        if 'im0' not in input_batch:
+            # feature cache batch
+            return
+        views = self.summary_views(input_batch, output)
+        if self.hparams.get("sync_summaries", False):
+            summ_pred_image, summ_in_image = render_summary(views)
+            self.logger.experiment.add_image(prefix + '_pred_shape_cam', summ_pred_image, self.global_step)
+            self.logger.experiment.add_image(prefix + '_input_images', summ_in_image, self.global_step)
+            return
+        if self.summary_worker is None:
+            self.summary_worker = SummaryWorker(self.logger.log_dir, self.hparams.get("summary_queue", 2))
+        self.summary_worker.submit(prefix, self.global_step, views)
+
+    def on_fit_end(self):
+        if self.summary_worker is not None:
+            self.summary_worker.close()
+            print("image summaries: {} rendered, {} dropped".format(self.summary_worker.n_submitted, self.summary_worker.n_dropped))
+            self.summary_worker = None
 
 
     def test_dataloader(self):
         # OPTIONAL
         if self.hparams.testdata.lower() == "aircapdata":
-            aircap_dset = aircapData.aircapData_crop(range(4615),self.hparams.datapath)
+            aircap_dset = aircapData.aircapData_crop(range(4615),self.hparams.datapath,img_res=self.hparams.img_res)
             return DataLoader(aircap_dset, batch_size=self.hparams.val_batch_size,
                                 num_workers=self.hparams.num_workers,
                                 pin_memory=self.hparams.pin_memory,
-                                drop_last=True)
+                                drop_last=False)
         else:
-            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath)
+            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,img_res=self.hparams.img_res)
             train_dloader = DataLoader(train_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
             test_dloader = DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
 
             return [test_dloader, train_dloader]
 
 
+    def on_test_epoch_start(self):
+        self.result_writer = result_writer(self)
+
     def test_step(self, batch, batch_idx, dset_idx=0):
         # OPTIONAL
         output, losses, loss = self.fwd_pass_and_loss(batch,is_val=True,is_test=True)
@@ -531,11 +538,12 @@ class copenet_twoview(pl.LightningModule):
             import ipdb; ipdb.set_trace()
         # cv2.imwrite(train_summ_pred_image.permute(1,2,0).data.numpy())
         
-        return {"test_loss" : loss,
-                "output" : output}
+        # the outputs go to the result store, not to test_epoch_end
+        self.result_writer.write(test_split(dset_idx), output)
+        return {"test_loss" : loss}
 
     def test_epoch_end(self,outputs):
-        import ipdb; ipdb.set_trace()
+        self.result_writer.close()
 
 
     def viz_3d(self,batch,output,viz_idx=[0]):
@@ -590,10 +598,21 @@ class copenet_twoview(pl.LightningModule):
         train.add_argument('--log_dir', default='/is/cluster/nsaini/copenet_logs', help='Directory to store logs')
         train.add_argument('--testdata', type=str, default="aerialpeople", help='test dataset')
         train.add_argument("--lr", type=float, default=5e-5, help="Learning rate")
+        amp = train.add_mutually_exclusive_group()
+        amp.add_argument('--fp16', action='store_true', help='backbone and regressor in float16 autocast (cuda) with loss scaling, SMPL-X and the losses in fp32')
+        amp.add_argument('--bf16', action='store_true', help='backbone and regressor in bfloat16 autocast (torch >= 1.10), SMPL-X and the losses in fp32')
+        train.add_argument('--checkpoint_backbone', action='store_true', help='activation checkpointing of the backbone layer1..layer4')
+        train.add_argument('--checkpoint_smplx', action='store_true', help='activation checkpointing of the SMPL-X forward in the training loss')
         train.add_argument('--batch_size', type=int, default=30, help='Batch size')
         train.add_argument('--val_batch_size', type=int, default=30, help='Validation data batch size')
+        train.add_argument('--result_store', type=str, default=None, help='directory of the result store the test outputs are written to, <log dir>/test_results by default')
+        train.add_argument('--result_fields', type=str, default='', help='comma separated test outputs stored, all by default')
+        train.add_argument('--result_dtype', type=str, default='none', help='dtype of the stored floating point fields (e.g. float16), none keeps it')
+        train.add_argument('--result_chunk_frames', type=int, default=512, help='frames per chunk file of the result store')
         train.add_argument('--summary_steps', type=int, default=100, help='Summary saving frequency')
         train.add_argument('--val_summary_steps', type=float, default=10, help='validation summary frequency')
+        train.add_argument('--sync_summaries', action='store_true', help='render the image summaries in the training loop instead of the summary worker')
+        train.add_argument('--summary_queue', type=int, default=2, help='image summaries waiting for the summary worker, more are dropped')
         train.add_argument('--checkpoint_steps', type=int, default=10000, help='Checkpoint saving frequency')
         train.add_argument('--img_res', type=int, default=224, help='Rescale bounding boxes to size [img_res, img_res] before feeding them in the network') 
         train.add_argument('--shape_loss_weight', default=1, type=float, help='Weight of per-vertex loss') 
@@ -612,12 +631,15 @@ class copenet_twoview(pl.LightningModule):
         train.add_argument('--vposer_loss_weight', default=1, type=float, help='Weight of vposer regul loss')
         train.add_argument('--cams_loss_weight', default=1, type=float, help='Weight of cams params loss')
         train.add_argument('--reg_iters', default=3, type=int, help='number of regressor iterations')
+        train.add_argument('--reg_exit_threshold', default=None, type=float, help='at inference stop regressor iterations per sample once the max param change is below this')
         train.add_argument('--gt_train_weight', default=1., help='Weight for GT keypoints during training')
 
         reg_train = train.add_mutually_exclusive_group()
         reg_train.add_argument('--train_reg_only', dest='train_reg_only', action='store_true', help='train only regressor')
         reg_train.add_argument('--no_train_reg_only', dest='shuffle_train', action='store_false', help='train feature extractor too')
         reg_train.set_defaults(shuffle_train=False)
+        train.add_argument('--train_reg_only_epochs', default=-1, type=int, help='number of epochs the regressor only part is initially trained from the feature cache')
+        train.add_argument('--feature_cache', type=str, default=None, help='directory of the backbone feature cache used for the train_reg_only_epochs, built if missing')
 
         shuffle_train = train.add_mutually_exclusive_group()
         shuffle_train.add_argument('--shuffle_train', dest='shuffle_train', action='store_true', help='Shuffle training data')
@@ -29,17 +29,19 @@ def get_aerialpeople_seqsplit_old(datapath='',train_test_ratio=0.5):
     
     return train_dset, test_dset
 
-def get_aerialpeople_seqsplit(datapath='/home/nsaini/Datasets/AerialPeople/agora_copenet_uniform_new_cropped',shuffle_cams=False,first_cam=0):
+def get_aerialpeople_seqsplit(datapath='/home/nsaini/Datasets/AerialPeople/agora_copenet_uniform_new_cropped',shuffle_cams=False,first_cam=0,img_res=CONSTANTS.IMG_RES):
     
-    train_dset = aerialpeople_crop(datapath=os.path.join(datapath,"dataset",'train_pkls.pkl'),shuffle_cams=shuffle_cams,first_cam=first_cam)
-    test_dset = aerialpeople_crop(datapath=os.path.join(datapath,"dataset",'test_pkls.pkl'),shuffle_cams=shuffle_cams,first_cam=first_cam)
+    train_dset = aerialpeople_crop(datapath=os.path.join(datapath,"dataset",'train_pkls.pkl'),shuffle_cams=shuffle_cams,first_cam=first_cam,img_res=img_res)
+    test_dset = aerialpeople_crop(datapath=os.path.join(datapath,"dataset",'test_pkls.pkl'),shuffle_cams=shuffle_cams,first_cam=first_cam,img_res=img_res)
     
     return train_dset, test_dset
 
 class aerialpeople_crop(Dataset):
-    def __init__(self,datapath,rottrans=False,shuffle_cams=False,first_cam=0):
+    def __init__(self,datapath,rottrans=False,shuffle_cams=False,first_cam=0,img_res=CONSTANTS.IMG_RES):
         super().__init__()
         
+        self.img_res = img_res
+        
         if os.path.exists(datapath):
             with open(datapath,'rb') as f:
                 print('loading aerialpeople data...')
@@ -144,7 +146,8 @@ class aerialpeople_crop(Dataset):
         pad = {}
         for i in range(self.num_cams):
             try:
-                im[str(i)],s[str(i)],pad[str(i)] = resize_with_pad(im[str(i)],size=224)
+                im[str(i)],s[str(i)],pad[str(i)] = resize_with_pad(im[str(i)],size=self.img_res)
+                s[str(i)] = s[str(i)]*CONSTANTS.IMG_RES/self.img_res
             except:
                 print('!!!!!!!!!!!!!!'+db['im'+str(i)]+'!!!!!!!!!!!!!!!!!!')
                 print(im[str(i)].shape)
@@ -13,6 +13,7 @@ import torchgeometry as tgm
 from ..utils.utils import npPerspProj, resize_with_pad, get_weak_persp_cam_full_img_input, get_weak_persp_cam_full_img_gt, transform_smpl
 import torch
 from .. import constants as CONSTANTS
+from ..utils.multi_person import make_multi_person_sample
 import copy
 
 ###############
@@ -32,16 +33,18 @@ from camera_and_NN import processCamsNNs
 
 al_map2smpl = np.array([-1,11,8,-1,12,9,-1,13,10,-1,-1,-1,1,-1,-1,-1,5,2,6,3,7,4,-1,-1])
 
-def get_copenet_real_traintest(datapath="/ps/project/datasets/AirCap_ICCV19/ICCV_28Feb_rerun2/",train_range=range(0,4000),test_range=range(4001,4615),shuffle_cams=False,first_cam=0):
-    train_dset = aircapData_crop(train_range,datapath)
-    test_dset = aircapData_crop(test_range,datapath)
+def get_copenet_real_traintest(datapath="/ps/project/datasets/AirCap_ICCV19/ICCV_28Feb_rerun2/",train_range=range(0,4000),test_range=range(4001,4615),shuffle_cams=False,first_cam=0,img_res=CONSTANTS.IMG_RES):
+    train_dset = aircapData_crop(train_range,datapath,img_res=img_res)
+    test_dset = aircapData_crop(test_range,datapath,img_res=img_res)
     return train_dset, test_dset
 
 
 class aircapData_crop(Dataset):
-    def __init__(self, drange:range, datapath="/ps/project/datasets/AirCap_ICCV19/ICCV_28Feb_rerun2/", rottrans=False):
+    def __init__(self, drange:range, datapath="/ps/project/datasets/AirCap_ICCV19/ICCV_28Feb_rerun2/", rottrans=False, img_res=CONSTANTS.IMG_RES):
         super().__init__()
         
+        self.img_res = img_res
+        
         if os.path.exists(datapath):
             self.num_cams,self.n_NNs,self.camsdata,self.NNs,self.tstamps2cam = processCamsNNs(datapath,
                                                     ["alphapose","openpose"],[0,1])
@@ -118,8 +121,10 @@ class aircapData_crop(Dataset):
         img1_crop = full_img1[bb1[0][1]:bb1[1][1],bb1[0][0]:bb1[1][0]]
         
         # preprocess input images
-        im0_crop_resized,s0,pad0 = resize_with_pad(img0_crop)
-        im1_crop_resized,s1,pad1 = resize_with_pad(img1_crop)
+        im0_crop_resized,s0,pad0 = resize_with_pad(img0_crop,size=self.img_res)
+        im1_crop_resized,s1,pad1 = resize_with_pad(img1_crop,size=self.img_res)
+        s0 = s0*CONSTANTS.IMG_RES/self.img_res
+        s1 = s1*CONSTANTS.IMG_RES/self.img_res
         im0_crop_in = self.normalize(torch.from_numpy(im0_crop_resized).float().permute(2,0,1))
         im1_crop_in = self.normalize(torch.from_numpy(im1_crop_resized).float().permute(2,0,1))
 
@@ -212,6 +217,27 @@ class aircapData_crop(Dataset):
         'smpl_vertices': np.nan, 'smpl_joints': np.nan,
         'smpl_gender':"male","cam":0}
 
+    def get_multi_person(self,idx):
+        """
+        multi person sample as copenet_real.get_multi_person. The pose detectors here run on the
+        tracker roi, so there is at most one person per view.
+        """
+        tstamp = self.tstamps[idx]
+        tstamps = [self.camsdata[0].get_closest_time_stamp(tstamp), self.camsdata[1].get_closest_time_stamp(tstamp)]
+        imgs = []
+        people = []
+        intrs = []
+        for i in range(self.num_cams):
+            imgs.append(self.camsdata[i].get_frame(tstamps[i])[:,:,::-1]/255.)
+            intrs.append(self.camsdata[i].get_intrinsic())
+            j2d = self.NNs[0][i].get_2d_joints_and_probs(tstamps[i],self.camsdata[i].roi[tstamps[i]])
+            j2d = np.concatenate([j2d[0],np.reshape(j2d[1],[-1,1])],1)
+            kps = j2d[al_map2smpl,:]
+            kps[al_map2smpl==-1,:] = 0
+            people.append([kps] if np.sum(kps[:,2]!=0) > 0 else [])
+
+        return make_multi_person_sample(imgs, people, intrs, None, self.img_res, self.normalize)
+
     def get_j2d_only(self,idx):
 
         tstamp = self.tstamps[idx]
@@ -10,6 +10,7 @@ import cv2
 import numpy as np
 from torchvision import transforms
 from ..utils.utils import npPerspProj, resize_with_pad
+from ..utils.multi_person import make_multi_person_sample
 import copy
 from .. import constants as CONSTANTS
 import torchgeometry as tgm
@@ -19,14 +20,17 @@ op_map2smpl = np.array([8,12,9,-1,13,10,-1,14,11,-1,19,22,1,-1,-1,-1,5,2,6,3,7,4
 al_map2smpl = np.array([-1,11,8,-1,12,9,-1,13,10,-1,-1,-1,1,-1,-1,-1,5,2,6,3,7,4,-1,-1])
 dlc_map2smpl = np.array([-1,3,2,-1,4,1,-1,5,0,-1,-1,-1,-1,-1,-1,-1,9,8,10,7,11,6,-1,-1])
 
-def get_copenet_real_traintest(datapath="/ps/project/datasets/AirCap_ICCV19/copenet_data",train_range=range(0,7000),test_range=range(8000,15000),shuffle_cams=False,first_cam=0,kp_agrmnt_threshold=100):
-    train_dset = copenet_real(datapath,train_range,shuffle_cams,first_cam,kp_agrmnt_threshold)
-    test_dset = copenet_real(datapath,test_range,shuffle_cams,first_cam,kp_agrmnt_threshold)
+def get_copenet_real_traintest(datapath="/ps/project/datasets/AirCap_ICCV19/copenet_data",train_range=range(0,7000),test_range=range(8000,15000),shuffle_cams=False,first_cam=0,kp_agrmnt_threshold=100,img_res=CONSTANTS.IMG_RES):
+    train_dset = copenet_real(datapath,train_range,shuffle_cams,first_cam,kp_agrmnt_threshold,img_res)
+    test_dset = copenet_real(datapath,test_range,shuffle_cams,first_cam,kp_agrmnt_threshold,img_res)
     return train_dset, test_dset
 
 class copenet_real(Dataset):
-    def __init__(self,datapath,drange:range,shuffle_cams=False,first_cam=0,kp_agrmnt_threshold=100):
+    def __init__(self,datapath,drange:range,shuffle_cams=False,first_cam=0,kp_agrmnt_threshold=100,img_res=CONSTANTS.IMG_RES):
         super().__init__()
+        
+        self.img_res = img_res
+        self.drange = drange
 
         if osp.exists(datapath):
             print("loading copenet real data...")
@@ -59,6 +63,8 @@ class copenet_real(Dataset):
             
             self.raw_apose0 = apose_m1
             self.raw_apose1 = apose_m2
+            self.raw_opose0 = opose_m1
+            self.raw_opose1 = opose_m2
             
 
             opose = np.zeros([2,len(drange),24,3])
@@ -209,7 +215,8 @@ class copenet_real(Dataset):
         pad = {}
         for i in range(self.num_cams):
             try:
-                im[str(i)],s[str(i)],pad[str(i)] = resize_with_pad(im[str(i)],size=224)
+                im[str(i)],s[str(i)],pad[str(i)] = resize_with_pad(im[str(i)],size=self.img_res)
+                s[str(i)] = s[str(i)]*CONSTANTS.IMG_RES/self.img_res
             except:
                 import ipdb; ipdb.set_trace()
                 print('!!!!!!!!!!!!!!'+self.db['im'+str(i)]+'!!!!!!!!!!!!!!!!!!')
@@ -257,6 +264,27 @@ class copenet_real(Dataset):
         'smpl_vertices': np.nan, 'smpl_joints': np.nan,
         'smpl_gender':"male","cam":int(cam1)}
         
+    def get_multi_person(self,idx):
+        """ every openpose detection of both views, cropped and associated across the views """
+        imgs = []
+        people = []
+        for i in range(self.num_cams):
+            imgs.append(cv2.imread(self.db["im"+str(i)][idx])[:,:,::-1]/255.)
+            people.append([])
+            try:
+                poses = getattr(self,"raw_opose"+str(i))["{:06d}".format(self.drange[idx])]["pose"]
+            except:
+                continue
+            for pose in poses:
+                kps = pose[op_map2smpl]
+                kps[op_map2smpl==-1,:] = 0
+                if np.sum(kps[:,2]!=0) > 0:
+                    people[i].append(kps)
+
+        return make_multi_person_sample(imgs, people, [self.intr0,self.intr1],
+                                        [self.extr0[self.drange[idx]].numpy(),self.extr1[self.drange[idx]].numpy()],
+                                        self.img_res, self.normalize)
+        
     def get_j2d_only(self,idx):
         gt_joints_2d = {}
         for i in range(self.num_cams):
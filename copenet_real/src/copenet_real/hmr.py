@@ -20,10 +20,17 @@ from .dsets import aerialpeople, copenet_real
 import cv2
 import torchvision
 from .smplx.smplx import SMPLX, lbs
+from .utils.body_model import get_smplx
+from .utils.metrics import LossAggregator, mean_losses
+from .utils.distributed import process_device
+from .utils.preemption import ResumableSampler
+from .utils.result_store import result_writer, test_split
+from .utils.summary_worker import SummaryWorker, summary_view, render_summary
 import pickle as pk
 from .utils.renderer import Renderer
 from . import constants as CONSTANTS
 from .utils.utils import transform_smpl, add_noise_input_cams,add_noise_input_smpltrans
+from .utils.amp import autocast_forward, amp_dtype
 from .utils.geometry import batch_rodrigues, perspective_projection, estimate_translation, rot6d_to_rotmat
 
 from config import vposer_weights
@@ -35,18 +42,12 @@ from human_body_prior.models.vposer_model import VPoser
 vp_model = load_model(vposer_weights, model_code=VPoser,remove_words_in_model_weights="vp_model.")[0]
 
 smplx = None
-smplx_test = None
 
-def create_smplx(copenet_home,train_batch_size,val_batch_size):
-    global smplx 
-    smplx = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
+def create_smplx(copenet_home):
+    global smplx
+    smplx = get_smplx(copenet_home, process_device(device))
+
 
-    global smplx_test 
-    smplx_test = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
 
 class hmr(pl.LightningModule):
 
@@ -54,13 +55,13 @@ class hmr(pl.LightningModule):
         super(hmr, self).__init__()
         # not the best model...
         self.hparams = hparams
+        self.train_losses = LossAggregator()
+        self.summary_worker = None
         self.model = model_hmr.getcopenet(os.path.join(self.hparams.copenet_home,"src/copenet/data/smpl_mean_params.npz"))
 
-        create_smplx(self.hparams.copenet_home,self.hparams.batch_size,self.hparams.val_batch_size)
+        create_smplx(self.hparams.copenet_home)
         
-        smplx.to(device)
-        smplx_test.to(device)
-        vp_model.to(device)
+        vp_model.to(process_device(device))
         smplx_hand_idx = pk.load(open(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/MANO_SMPLX_vertex_ids.pkl"),'rb'))
         smplx_face_idx = np.load(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/SMPL-X__FLAME_vertex_ids.npy"))
         self.register_buffer("body_only_mask",torch.ones(smplx.v_template.shape[0],1))
@@ -71,13 +72,13 @@ class hmr(pl.LightningModule):
         self.mseloss = nn.MSELoss(reduction='none')
 
         self.focal_length = [1475,1475]
-        self.renderer = Renderer(focal_length=self.focal_length, 
-                            img_res=[224,224],
-                            center=[112,112],
+        self.renderer = Renderer(focal_length=[f*self.hparams.img_res/CONSTANTS.IMG_RES for f in self.focal_length], 
+                            img_res=[self.hparams.img_res,self.hparams.img_res],
+                            center=[self.hparams.img_res/2,self.hparams.img_res/2],
                             faces=smplx.faces)
 
     def forward(self, **kwargs):
-        return self.model(**kwargs)
+        return autocast_forward(self.model, amp_dtype(self.hparams), **kwargs)
         
     def get_loss(self,input_batch, pred_camera, pred_rotmat, pred_betas, pred_output_cam, pred_joints_2d_cam):
         
@@ -110,10 +111,10 @@ class hmr(pl.LightningModule):
 
         loss *= 60
 
-        losses = {'loss': loss.detach().item(),
-                  'loss_regul_vposer': loss_regul_vposer.detach().item(),
-                  'loss_keypoints': loss_keypoints.detach().item(),
-                  'loss_regul_betas': loss_regul_betas.detach().item()}
+        losses = {'loss': loss.detach(),
+                  'loss_regul_vposer': loss_regul_vposer.detach(),
+                  'loss_keypoints': loss_keypoints.detach(),
+                  'loss_regul_betas': loss_regul_betas.detach()}
 
         return loss, losses
 
@@ -125,8 +126,8 @@ class hmr(pl.LightningModule):
 
             batch_size = im.shape[0]
 
-        pred_pose, pred_betas, pred_camera = self.model.forward(x = im,
-                                                        iters = self.hparams.reg_iters)                                                                
+        pred_pose, pred_betas, pred_camera = self.forward(x = im,
+                                                  iters = self.hparams.reg_iters)                                                                
         # #####################
         # pred_pose = torch.cat([input_batch["smplorient_rel"],
         #                             input_batch["smplpose_rotmat"]],dim=1).view(batch_size,22,3,3)
@@ -134,7 +135,7 @@ class hmr(pl.LightningModule):
         pred_rotmat = pred_pose
 
         if is_val or is_test:
-            pred_output_cam = smplx_test.forward(betas=pred_betas, 
+            pred_output_cam = smplx.forward(betas=pred_betas, 
                                     body_pose=pred_pose[:,1:],
                                     global_orient=torch.eye(3).float().unsqueeze(0).unsqueeze(0).repeat(batch_size,1,1,1).type_as(pred_betas),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas),
@@ -155,7 +156,7 @@ class hmr(pl.LightningModule):
         
         pred_cam_t = torch.stack([pred_camera[:,1],
                                   pred_camera[:,2],
-                                  2*self.focal_length[0]/(self.hparams.img_res * pred_camera[:,0] +1e-9)],dim=-1)
+                                  2*self.focal_length[0]/(CONSTANTS.IMG_RES * pred_camera[:,0] +1e-9)],dim=-1)
 
         pred_joints_2d_cam = perspective_projection(pred_joints,
                                                    rotation=torch.eye(3).float().unsqueeze(0).repeat(batch_size,1,1).type_as(pred_betas),
@@ -227,14 +228,13 @@ class hmr(pl.LightningModule):
                 param.requires_grad = True
         
         output, losses, loss = self.fwd_pass_and_loss(batch, is_val=False,is_test=False)
+        self.train_losses.update(losses)
 
         with torch.no_grad():
         # logging
             if batch_idx % self.hparams.summary_steps == 0:
-                train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-                self.logger.experiment.add_image('train_pred_shape_cam', train_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('train_input_images',train_summ_in_image, self.global_step)
-                for loss_name, val in losses.items():
+                self.log_summaries('train', batch, output)
+                for loss_name, val in self.train_losses.compute().items():
                     self.logger.experiment.add_scalar(loss_name + '/train', val, self.global_step)
 
         return {"loss" : loss}
@@ -245,20 +245,12 @@ class hmr(pl.LightningModule):
             output, losses, loss = self.fwd_pass_and_loss(batch,is_val=True, is_test=False)
 
             if batch_idx % self.hparams.val_summary_steps == 0:
-                val_summ_pred_image, val_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-
-                # logging
-                self.logger.experiment.add_image('val_pred_shape_cam', val_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('val_input_images',val_summ_in_image, self.global_step)
+                self.log_summaries('val', batch, output)
         
         return {'val_losses': losses,"val_loss":loss}
 
     def validation_epoch_end(self, outputs):
-        for loss_name, val in outputs[0]["val_losses"].items():
-            val_list = []
-            for x in outputs:
-                val_list.append(x["val_losses"][loss_name])
-            mean_val = np.mean(val_list)
+        for loss_name, mean_val in mean_losses([x["val_losses"] for x in outputs]).items():
             self.logger.experiment.add_scalar(loss_name + '/val', mean_val, self.global_step)
         return {"val_loss":outputs[0]["val_loss"]}
 
@@ -275,51 +267,53 @@ class hmr(pl.LightningModule):
 
     def train_dataloader(self):
         # REQUIRED
-        train_dset, _ = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True)
+        train_dset, _ = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True,img_res=self.hparams.img_res)
         return DataLoader(train_dset, batch_size=self.hparams.batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
-                            shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            sampler=ResumableSampler(train_dset, shuffle=self.hparams.shuffle_train),
+                            drop_last=False)
 
     def val_dataloader(self):
         # OPTIONAL
-        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True)
+        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True,img_res=self.hparams.img_res)
         return DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
                             shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            drop_last=False)
 
-    def summaries(self, input_batch,output, losses, is_test):
-        batch_size = input_batch['im0'].shape[0]
-        skip_factor = 4    # number of samples to be logged
-        img_downsize_factor = 5
-
-        with torch.no_grad():
-            im = input_batch['im0'][::int(batch_size/skip_factor)] * torch.tensor([0.229, 0.224, 0.225], device=self.device).reshape(1,3,1,1)
-            im = im + torch.tensor([0.485, 0.456, 0.406], device=self.device).reshape(1,3,1,1)
-            # images = []
-            # for i in range(0,batch_size,int(batch_size/skip_factor)):
-            #     images.append(torch.from_numpy(cv2.imread(input_batch['im1_path'][i])[:,:,::-1]/255.).permute(2,0,1).float())
-            pred_vertices_cam = output['pred_vertices_cam'][::int(batch_size/skip_factor)]
-            pred_cam_t = output['pred_cam_t'][::int(batch_size/skip_factor)]
-            # pred_vertices_cam = input_batch['smpl_vertices_rel'][::int(batch_size/skip_factor)].squeeze(1)
-            
-            images_pred_cam = self.renderer.visualize_tb(pred_vertices_cam,
-                                                        pred_cam_t,
-                                                        torch.eye(3,device=self._device).float().unsqueeze(0).repeat(batch_size,1,1),
-                                                        im)
-            
-            summ_pred_image = images_pred_cam
-            
-            summ_in_image = torchvision.utils.make_grid(im)
+    def summary_views(self, input_batch, output):
+        """ CPU copies of the logged samples, rendered by render_summary """
+        return [
+            summary_view(input_batch, output, self.renderer, 'im0', 'pred_vertices_cam', 'pred_cam_t')]
 
-            # import ipdb; ipdb.set_trace()
-            if is_test:
-                import ipdb; ipdb.set_trace()
-            
-            return summ_pred_image, summ_in_image
+    def summaries(self, input_batch,output, losses, is_test):
+        summ_pred_image, summ_in_image = render_summary(self.summary_views(input_batch, output))
+        if is_test:
+            import ipdb; ipdb.set_trace()
+
+        return summ_pred_image, summ_in_image
+
+    def log_summaries(self, prefix, input_batch, output):
+        """ queue the image summaries on the summary worker, or render them here with --sync_summaries """
+        if self.global_rank != 0:
+            return
+        views = self.summary_views(input_batch, output)
+        if self.hparams.get("sync_summaries", False):
+            summ_pred_image, summ_in_image = render_summary(views)
+            self.logger.experiment.add_image(prefix + '_pred_shape_cam', summ_pred_image, self.global_step)
+            self.logger.experiment.add_image(prefix + '_input_images', summ_in_image, self.global_step)
+            return
+        if self.summary_worker is None:
+            self.summary_worker = SummaryWorker(self.logger.log_dir, self.hparams.get("summary_queue", 2))
+        self.summary_worker.submit(prefix, self.global_step, views)
+
+    def on_fit_end(self):
+        if self.summary_worker is not None:
+            self.summary_worker.close()
+            print("image summaries: {} rendered, {} dropped".format(self.summary_worker.n_submitted, self.summary_worker.n_dropped))
+            self.summary_worker = None
 
 
     def test_dataloader(self):
@@ -331,22 +325,25 @@ class hmr(pl.LightningModule):
                                 pin_memory=self.hparams.pin_memory,
                                 drop_last=False)
         else:
-            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True)
+            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True,img_res=self.hparams.img_res)
             train_dloader = DataLoader(train_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
             test_dloader = DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
 
             return [test_dloader, train_dloader]
 
 
 
+    def on_test_epoch_start(self):
+        self.result_writer = result_writer(self)
+
     def test_step(self, batch, batch_idx, dset_idx=0):
         # OPTIONAL
         output, losses, loss = self.fwd_pass_and_loss(batch,is_test=True, is_val=True)
@@ -355,14 +352,14 @@ class hmr(pl.LightningModule):
         # if self.hparams.testdata.lower() == "aircapdata":
         # train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=True)
         # cv2.imwrite(train_summ_pred_image.permute(1,2,0).data.numpy())
-        return {"test_loss" : loss,
-                "output" : output}
+        # the outputs go to the result store, not to test_epoch_end
+        self.result_writer.write(test_split(dset_idx), output)
+        return {"test_loss" : loss}
 
 
     def test_epoch_end(self, outputs):
         # OPTIONAL
-        import ipdb; ipdb.set_trace()
-        # return {"outputs":outputs}
+        self.result_writer.close()
 
 
     @staticmethod
@@ -392,10 +389,19 @@ class hmr(pl.LightningModule):
         train.add_argument('--testdata', type=str, default="aerialpeople", help='test dataset')
         train.add_argument('--log_dir', default='/is/cluster/nsaini/copenet_logs', help='Directory to store logs')
         train.add_argument("--lr", type=float, default=5e-5, help="Learning rate")
+        amp = train.add_mutually_exclusive_group()
+        amp.add_argument('--fp16', action='store_true', help='backbone and regressor in float16 autocast (cuda) with loss scaling, SMPL-X and the losses in fp32')
+        amp.add_argument('--bf16', action='store_true', help='backbone and regressor in bfloat16 autocast (torch >= 1.10), SMPL-X and the losses in fp32')
         train.add_argument('--batch_size', type=int, default=30, help='Batch size')
         train.add_argument('--val_batch_size', type=int, default=30, help='Validation data batch size')
+        train.add_argument('--result_store', type=str, default=None, help='directory of the result store the test outputs are written to, <log dir>/test_results by default')
+        train.add_argument('--result_fields', type=str, default='', help='comma separated test outputs stored, all by default')
+        train.add_argument('--result_dtype', type=str, default='none', help='dtype of the stored floating point fields (e.g. float16), none keeps it')
+        train.add_argument('--result_chunk_frames', type=int, default=512, help='frames per chunk file of the result store')
         train.add_argument('--summary_steps', type=int, default=100, help='Summary saving frequency')
         train.add_argument('--val_summary_steps', type=float, default=10, help='validation summary frequency')
+        train.add_argument('--sync_summaries', action='store_true', help='render the image summaries in the training loop instead of the summary worker')
+        train.add_argument('--summary_queue', type=int, default=2, help='image summaries waiting for the summary worker, more are dropped')
         train.add_argument('--checkpoint_steps', type=int, default=10000, help='Checkpoint saving frequency')
         train.add_argument('--img_res', type=int, default=224, help='Rescale bounding boxes to size [img_res, img_res] before feeding them in the network') 
         train.add_argument('--shape_loss_weight', default=1, type=float, help='Weight of per-vertex loss') 
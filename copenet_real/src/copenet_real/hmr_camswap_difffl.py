@@ -20,10 +20,15 @@ from .dsets import aerialpeople, copenet_real
 import cv2
 import torchvision
 from .smplx.smplx import SMPLX, lbs
+from .utils.body_model import get_smplx
+from .utils.metrics import LossAggregator, mean_losses
+from .utils.distributed import process_device
+from .utils.preemption import ResumableSampler
 import pickle as pk
 from .utils.renderer import Renderer
 from . import constants as CONSTANTS
 from .utils.utils import transform_smpl, add_noise_input_cams,add_noise_input_smpltrans
+from .utils.amp import autocast_forward, amp_dtype
 from .utils.geometry import batch_rodrigues, perspective_projection, estimate_translation, rot6d_to_rotmat
 
 from .config import device
@@ -37,18 +42,12 @@ from human_body_prior.models.vposer_model import VPoser
 vp_model = load_model(vposer_weights, model_code=VPoser,remove_words_in_model_weights="vp_model.")[0]
 
 smplx = None
-smplx_test = None
 
-def create_smplx(copenet_home,train_batch_size,val_batch_size):
-    global smplx 
-    smplx = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
+def create_smplx(copenet_home):
+    global smplx
+    smplx = get_smplx(copenet_home, process_device(device))
+
 
-    global smplx_test 
-    smplx_test = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
 
 class hmr(pl.LightningModule):
 
@@ -56,13 +55,12 @@ class hmr(pl.LightningModule):
         super(hmr, self).__init__()
         # not the best model...
         self.hparams = hparams
+        self.train_losses = LossAggregator()
         self.model = model_hmr.getcopenet(os.path.join(self.hparams.copenet_home,"src/copenet/data/smpl_mean_params.npz"))
 
-        create_smplx(self.hparams.copenet_home,self.hparams.batch_size,self.hparams.val_batch_size)
+        create_smplx(self.hparams.copenet_home)
         
-        smplx.to(device)
-        smplx_test.to(device)
-        vp_model.to(device)
+        vp_model.to(process_device(device))
         smplx_hand_idx = pk.load(open(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/MANO_SMPLX_vertex_ids.pkl"),'rb'))
         smplx_face_idx = np.load(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/SMPL-X__FLAME_vertex_ids.npy"))
         self.register_buffer("body_only_mask",torch.ones(smplx.v_template.shape[0],1))
@@ -77,17 +75,17 @@ class hmr(pl.LightningModule):
         # self.focal_length1 = [1361,1378]
         self.focal_length0 = [5000,5000]
         self.focal_length1 = [5000,5000]
-        self.renderer0 = Renderer(focal_length=self.focal_length0, 
-                            img_res=[224,224],
-                            center=[112,112],
+        self.renderer0 = Renderer(focal_length=[f*self.hparams.img_res/CONSTANTS.IMG_RES for f in self.focal_length0], 
+                            img_res=[self.hparams.img_res,self.hparams.img_res],
+                            center=[self.hparams.img_res/2,self.hparams.img_res/2],
                             faces=smplx.faces)
-        self.renderer1 = Renderer(focal_length=self.focal_length1, 
-                            img_res=[224,224],
-                            center=[112,112],
+        self.renderer1 = Renderer(focal_length=[f*self.hparams.img_res/CONSTANTS.IMG_RES for f in self.focal_length1], 
+                            img_res=[self.hparams.img_res,self.hparams.img_res],
+                            center=[self.hparams.img_res/2,self.hparams.img_res/2],
                             faces=smplx.faces)
 
     def forward(self, **kwargs):
-        return self.model(**kwargs)
+        return autocast_forward(self.model, amp_dtype(self.hparams), **kwargs)
         
     def get_loss(self,input_batch, pred_cam_t, pred_rotmat, pred_betas, pred_output_cam, pred_joints_2d_cam):
         
@@ -120,10 +118,10 @@ class hmr(pl.LightningModule):
 
         loss *= 60
 
-        losses = {'loss': loss.detach().item(),
-                  'loss_regul_vposer': loss_regul_vposer.detach().item(),
-                  'loss_keypoints': loss_keypoints.detach().item(),
-                  'loss_regul_betas': loss_regul_betas.detach().item()}
+        losses = {'loss': loss.detach(),
+                  'loss_regul_vposer': loss_regul_vposer.detach(),
+                  'loss_keypoints': loss_keypoints.detach(),
+                  'loss_regul_betas': loss_regul_betas.detach()}
 
         return loss, losses
 
@@ -139,8 +137,8 @@ class hmr(pl.LightningModule):
         cam1_idcs = input_batch["cam"]==1
         cam_idcs = torch.cat([cam0_idcs.unsqueeze(0),cam1_idcs.unsqueeze(0)]).permute(1,0).reshape(2*batch_size)
 
-        pred_pose, pred_betas, pred_camera = self.model.forward(x = im,
-                                                        iters = self.hparams.reg_iters)                                                                
+        pred_pose, pred_betas, pred_camera = self.forward(x = im,
+                                                  iters = self.hparams.reg_iters)                                                                
         # #####################
         # pred_pose = torch.cat([input_batch["smplorient_rel"],
         #                             input_batch["smplpose_rotmat"]],dim=1).view(batch_size,22,3,3)
@@ -148,7 +146,7 @@ class hmr(pl.LightningModule):
         pred_rotmat = pred_pose
 
         if is_val or is_test:
-            pred_output_cam = smplx_test.forward(betas=pred_betas, 
+            pred_output_cam = smplx.forward(betas=pred_betas, 
                                     body_pose=pred_pose[:,1:],
                                     global_orient=torch.eye(3).float().unsqueeze(0).unsqueeze(0).repeat(batch_size,1,1,1).type_as(pred_betas),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas),
@@ -169,10 +167,10 @@ class hmr(pl.LightningModule):
         
         pred_cam_t0 = torch.stack([pred_camera[:,1],
                                   pred_camera[:,2],
-                                  2*self.focal_length0[0]/(self.hparams.img_res * pred_camera[:,0] +1e-9)],dim=-1)
+                                  2*self.focal_length0[0]/(CONSTANTS.IMG_RES * pred_camera[:,0] +1e-9)],dim=-1)
         pred_cam_t1 = torch.stack([pred_camera[:,1],
                                   pred_camera[:,2],
-                                  2*self.focal_length1[0]/(self.hparams.img_res * pred_camera[:,0] +1e-9)],dim=-1)
+                                  2*self.focal_length1[0]/(CONSTANTS.IMG_RES * pred_camera[:,0] +1e-9)],dim=-1)
         pred_cam_t = torch.cat([pred_cam_t0.unsqueeze(0),pred_cam_t1.unsqueeze(0)],dim=0).permute(1,0,2).reshape(2*batch_size,3)[cam_idcs]
 
         pred_joints_2d_cam0 = perspective_projection(pred_joints,
@@ -248,14 +246,16 @@ class hmr(pl.LightningModule):
                 param.requires_grad = True
         
         output, losses, loss = self.fwd_pass_and_loss(batch, is_val=False,is_test=False)
+        self.train_losses.update(losses)
 
         with torch.no_grad():
         # logging
             if batch_idx % self.hparams.summary_steps == 0:
-                train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=False)
-                self.logger.experiment.add_image('train_pred_shape_cam', train_summ_pred_image, self.global_step)
-                self.logger.experiment.add_image('train_input_images',train_summ_in_image, self.global_step)
-                for loss_name, val in losses.items():
+                if self.global_rank == 0:
+                    train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=False)
+                    self.logger.experiment.add_image('train_pred_shape_cam', train_summ_pred_image, self.global_step)
+                    self.logger.experiment.add_image('train_input_images',train_summ_in_image, self.global_step)
+                for loss_name, val in self.train_losses.compute().items():
                     self.logger.experiment.add_scalar(loss_name + '/train', val, self.global_step)
 
         return {"loss" : loss}
@@ -265,7 +265,7 @@ class hmr(pl.LightningModule):
         with torch.no_grad():
             output, losses, loss = self.fwd_pass_and_loss(batch,is_val=True, is_test=False)
 
-            if batch_idx % self.hparams.val_summary_steps == 0:
+            if batch_idx % self.hparams.val_summary_steps == 0 and self.global_rank == 0:
                 val_summ_pred_image, val_summ_in_image = self.summaries(batch, output, losses, is_test=False)
 
                 # logging
@@ -275,11 +275,7 @@ class hmr(pl.LightningModule):
         return {'val_losses': losses,"val_loss":loss}
 
     def validation_epoch_end(self, outputs):
-        for loss_name, val in outputs[0]["val_losses"].items():
-            val_list = []
-            for x in outputs:
-                val_list.append(x["val_losses"][loss_name])
-            mean_val = np.mean(val_list)
+        for loss_name, mean_val in mean_losses([x["val_losses"] for x in outputs]).items():
             self.logger.experiment.add_scalar(loss_name + '/val', mean_val, self.global_step)
         return {"val_loss":outputs[0]["val_loss"]}
 
@@ -296,25 +292,25 @@ class hmr(pl.LightningModule):
 
     def train_dataloader(self):
         # REQUIRED
-        train_dset, _ = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True)
+        train_dset, _ = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True,img_res=self.hparams.img_res)
         return DataLoader(train_dset, batch_size=self.hparams.batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
-                            shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            sampler=ResumableSampler(train_dset, shuffle=self.hparams.shuffle_train),
+                            drop_last=False)
 
     def val_dataloader(self):
         # OPTIONAL
-        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True)
+        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True,img_res=self.hparams.img_res)
         return DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
                             shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            drop_last=False)
 
     def summaries(self, input_batch,output, losses, is_test):
         batch_size = input_batch['im0'].shape[0]
-        skip_factor = 4    # number of samples to be logged
+        skip_factor = min(4,batch_size)    # number of samples to be logged
         img_downsize_factor = 5
         cam0_idcs = input_batch["cam"][::int(batch_size/skip_factor)]==0
         cam1_idcs = input_batch["cam"][::int(batch_size/skip_factor)]==1
@@ -378,17 +374,17 @@ class hmr(pl.LightningModule):
                                 pin_memory=self.hparams.pin_memory,
                                 drop_last=False)
         else:
-            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True)
+            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,shuffle_cams=True,img_res=self.hparams.img_res)
             train_dloader = DataLoader(train_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
             test_dloader = DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
 
             return [test_dloader, train_dloader]
 
@@ -408,17 +404,17 @@ class hmr(pl.LightningModule):
 
     def test_epoch_end(self, outputs):
         # OPTIONAL
-        test_err_smpltrans = np.array([(x["output"]["pred_smpltrans"] - 
+        test_err_smpltrans = np.concatenate([(x["output"]["pred_smpltrans"] - 
             x["output"]["gt_smpltrans"]).cpu().numpy() for x in outputs[0]]).reshape(-1,3)
-        test_err_smplangles = np.array([(x["output"]["pred_angles"] - 
+        test_err_smplangles = np.concatenate([(x["output"]["pred_angles"] - 
             x["output"]["gt_angles"]).cpu().numpy() for x in outputs[0]]).reshape(-1,22,3)
 
         mean_test_err_smpltrans = np.mean(np.sqrt(np.sum(test_err_smpltrans**2,1)))
         mean_test_err_smplangles = np.mean(np.sqrt(np.sum(test_err_smplangles**2,2)))
 
-        train_err_smpltrans = np.array([(x["output"]["pred_smpltrans"] - 
+        train_err_smpltrans = np.concatenate([(x["output"]["pred_smpltrans"] - 
             x["output"]["gt_smpltrans"]).cpu().numpy() for x in outputs[1]]).reshape(-1,3)
-        train_err_smplangles = np.array([(x["output"]["pred_angles"] - 
+        train_err_smplangles = np.concatenate([(x["output"]["pred_angles"] - 
             x["output"]["gt_angles"]).cpu().numpy() for x in outputs[1]]).reshape(-1,22,3)
 
         mean_train_err_smpltrans = np.mean(np.sqrt(np.sum(train_err_smpltrans**2,1)))
@@ -455,6 +451,9 @@ class hmr(pl.LightningModule):
         train.add_argument('--testdata', type=str, default="aerialpeople", help='test dataset')
         train.add_argument('--log_dir', default='/is/cluster/nsaini/copenet_logs', help='Directory to store logs')
         train.add_argument("--lr", type=float, default=5e-5, help="Learning rate")
+        amp = train.add_mutually_exclusive_group()
+        amp.add_argument('--fp16', action='store_true', help='backbone and regressor in float16 autocast (cuda) with loss scaling, SMPL-X and the losses in fp32')
+        amp.add_argument('--bf16', action='store_true', help='backbone and regressor in bfloat16 autocast (torch >= 1.10), SMPL-X and the losses in fp32')
         train.add_argument('--batch_size', type=int, default=30, help='Batch size')
         train.add_argument('--val_batch_size', type=int, default=30, help='Validation data batch size')
         train.add_argument('--summary_steps', type=int, default=100, help='Summary saving frequency')
@@ -34,12 +34,12 @@ tst_dl = DataLoader(test_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 trn_dl = DataLoader(train_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 
 batch = iter(trn_dl).next()
 for k in batch:
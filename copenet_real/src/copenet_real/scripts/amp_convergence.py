@@ -0,0 +1,109 @@
+# %% Imports
+# fp32 vs mixed precision (--fp16 or --bf16) training of the two view network on AerialPeople: same
+# seed, data order and step budget, train loss, validation loss and MPJPE on a fixed validation
+# subset, and the step time. Runs on the device of copenet.config. fp16 (the default, torch 1.8.1)
+# needs CUDA and scales the loss with a GradScaler as the trainer does, bf16 needs torch >= 1.10
+# and also runs on CPU.
+# usage: python amp_convergence.py <datapath> [n_steps] [eval_every] [batch_size] [n_val] [fp16|bf16]
+import torch
+import numpy as np
+from argparse import ArgumentParser
+from torch.utils.data import DataLoader, Subset
+from pytorch_lightning import seed_everything
+import time
+import os
+import sys
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+from copenet.config import device
+from copenet.copenet_twoview import copenet_twoview
+from copenet.utils.amp import check_amp_args
+
+datapath = sys.argv[1]
+n_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+eval_every = int(sys.argv[3]) if len(sys.argv) > 3 else 250
+batch_size = int(sys.argv[4]) if len(sys.argv) > 4 else 30
+n_val = int(sys.argv[5]) if len(sys.argv) > 5 else 600
+amp = sys.argv[6] if len(sys.argv) > 6 else "fp16"
+
+copenet_home = os.path.join(os.path.dirname(os.path.abspath(__file__)),"../../../../copenet")
+
+def get_hparams(amp):
+    parser = copenet_twoview.add_model_specific_args(ArgumentParser(add_help=False))
+    args = ["--name","amp_convergence","--version","0","--model","copenet_twoview",
+            "--copenet_home",copenet_home,"--datapath",datapath,"--batch_size",str(batch_size)]
+    args = args + (["--" + amp] if amp != "fp32" else [])
+    hparams = parser.parse_args(args)
+    check_amp_args(parser, hparams)
+    return hparams
+
+def to_device(batch):
+    return {k:v.to(device) if torch.is_tensor(v) else v for k,v in batch.items()}
+
+def evaluate(net, val_dl):
+    net.eval()
+    val_loss = []
+    mpjpe = []
+    with torch.no_grad():
+        for batch in val_dl:
+            batch = to_device(batch)
+            _, _, loss = net.fwd_pass_and_loss(batch,is_val=True,is_test=False)
+            val_loss.append(loss.item())
+            output, _, _ = net.fwd_pass_and_loss(batch,is_val=False,is_test=True)
+            for cam in ["0","1"]:
+                pred_j3d = output["pred_j3d_cam"+cam][:,:22]
+                gt_j3d = batch["smpl_joints_rel"+cam].squeeze(1)[:,:22].cpu()
+                mpjpe.append(torch.norm((pred_j3d - pred_j3d[:,:1]) - (gt_j3d - gt_j3d[:,:1]),dim=-1).mean(1))
+    net.train()
+    return np.mean(val_loss), 1000*torch.cat(mpjpe).mean().item()
+
+def run(amp):
+    seed_everything(123)
+    net = copenet_twoview(get_hparams(amp)).to(device)
+    # dynamic loss scaling of the fp16 gradients, a no-op in fp32 and bf16
+    scaler = torch.cuda.amp.GradScaler(enabled=amp == "fp16")
+    net.train()
+    optimizer = net.configure_optimizers()
+    train_dl = net.train_dataloader()
+    val_ds = net.val_dataloader().dataset
+    val_dl = DataLoader(Subset(val_ds,np.linspace(0,len(val_ds)-1,n_val).astype(int)), batch_size=batch_size,
+                            num_workers=net.hparams.num_workers, shuffle=False, drop_last=False)
+
+    curve = {}
+    train_loss = []
+    step_time = []
+    step = 0
+    while step < n_steps:
+        for batch in train_dl:
+            batch = to_device(batch)
+            if device == "cuda":
+                torch.cuda.synchronize()
+            t0 = time.time()
+            _, _, loss = net.fwd_pass_and_loss(batch,is_val=False,is_test=False)
+            optimizer.zero_grad()
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            if device == "cuda":
+                torch.cuda.synchronize()
+            step_time.append(time.time() - t0)
+            train_loss.append(loss.item())
+            step += 1
+            if step % eval_every == 0 or step == n_steps:
+                curve[step] = (np.mean(train_loss[-eval_every:]),) + evaluate(net, val_dl)
+                print("{} step {}: train {:.4f} val {:.4f} mpjpe {:.1f} mm".format(amp, step, *curve[step]))
+            if step == n_steps:
+                break
+    return curve, 1000*np.median(step_time[10:])
+
+# %% train both
+fp32_curve, fp32_ms = run("fp32")
+amp_curve, amp_ms = run(amp)
+
+# %% comparison table
+print("{:>6} {:>12} {:>12} {:>10} {:>10} {:>12} {:>12}".format("step","fp32 train",amp+" train","fp32 val",amp+" val",
+                                                                "fp32 mpjpe",amp+" mpjpe"))
+for step in fp32_curve:
+    print("{:>6} {:>12.4f} {:>12.4f} {:>10.4f} {:>10.4f} {:>12.1f} {:>12.1f}".format(step,
+            fp32_curve[step][0], amp_curve[step][0], fp32_curve[step][1], amp_curve[step][1],
+            fp32_curve[step][2], amp_curve[step][2]))
+print("step time: fp32 {:.1f} ms, {} {:.1f} ms ({:.2f}x)".format(fp32_ms, amp, amp_ms, fp32_ms/amp_ms))
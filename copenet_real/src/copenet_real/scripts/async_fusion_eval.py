@@ -0,0 +1,87 @@
+# %% Imports
+# accuracy vs link latency / drop rate of the staleness tolerant asynchronous view fusion,
+# simulated on the copenet_real test sequence. Accuracy is the confidence weighted 2d keypoint
+# error (pixels) of the 22 body joints in both views.
+# usage: python async_fusion_eval.py <ckpt_path> <datapath> [max_age] [n_frames] [fps]
+import torch
+import numpy as np
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+import os, sys; sys.path.append(os.path.dirname(os.path.abspath(__file__+"/..")))
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+
+from config import device
+
+from copenet_real.copenet_twoview import copenet_twoview
+from copenet_real.dsets import copenet_real
+from copenet_real.utils.body_model import get_smplx
+from copenet_real import constants as CONSTANTS
+from copenet_real.utils.keypoints import project_pred_joints, keypoint_error
+from copenet.utils.split_exec import LinkSimulator, simulate_async_fusion
+
+ckpt_path = sys.argv[1]
+datapath = sys.argv[2]
+max_age = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+n_frames = int(sys.argv[4]) if len(sys.argv) > 4 else 1000
+fps = float(sys.argv[5]) if len(sys.argv) > 5 else 30.
+iters = 3
+latencies = [0., 0.005, 0.01, 0.033, 0.066, 0.1, 0.2]
+drop_probs = [0., 0.1, 0.3]
+
+net = copenet_twoview.load_from_checkpoint(checkpoint_path=ckpt_path)
+net.to(device)
+net.eval()
+
+smplx = get_smplx(net.hparams.copenet_home, device)
+
+# the test split is one continuous sequence, keep the frame order
+_, test_ds = copenet_real.get_copenet_real_traintest(datapath,img_res=net.hparams.img_res)
+tst_dl = DataLoader(test_ds, batch_size=1,
+                            num_workers=os.cpu_count()-1,
+                            pin_memory=True,
+                            shuffle=False)
+
+# %% precompute features of the sequence
+feats = []
+gts = []
+with torch.no_grad():
+    for i,batch in enumerate(tqdm(tst_dl,desc="features")):
+        if i >= n_frames:
+            break
+        xf0 = net.model.forward_feat_ext(batch["im0"].float().to(device))
+        xf1 = net.model.forward_feat_ext(batch["im1"].float().to(device))
+        # same input translation as fwd_pass_and_loss with distance scaling
+        in_smpltrans = 0.05*torch.tensor([[0,0,10]]).float().to(device)
+        feats.append((xf0, batch["bb0"].float().to(device), xf1, batch["bb1"].float().to(device), in_smpltrans, in_smpltrans))
+        gts.append((batch["smpl_joints_2d0"][:,0].to(device), batch["smpl_joints_2d1"][:,0].to(device),
+                    batch["intr0"].to(device), batch["intr1"].to(device)))
+
+# %% sweep link latency and drop rate
+rows = []
+with torch.no_grad():
+    for drop_prob in drop_probs:
+        for latency in latencies:
+            links = (LinkSimulator(lambda: latency, drop_prob, seed=0), LinkSimulator(lambda: latency, drop_prob, seed=1))
+            results = simulate_async_fusion(net.model, feats, iters=iters, max_age=max_age, links=links,
+                                                frame_interval=1/fps, iter_time=1e-3)
+            errors = []
+            staleness = []
+            for (pred_pose0, pred_betas0, pred_pose1, pred_betas1, st0, st1), (j2d0, j2d1, intr0, intr1) in zip(results, gts):
+                staleness += st0 + st1
+                if j2d0[:,:,2].sum() == 0 or j2d1[:,:,2].sum() == 0:
+                    continue
+                pred_pose0 = torch.cat([pred_pose0[:,:3]/0.05, pred_pose0[:,3:]],1)
+                pred_pose1 = torch.cat([pred_pose1[:,:3]/0.05, pred_pose1[:,3:]],1)
+                err, conf = keypoint_error([project_pred_joints(smplx, pred_pose0, pred_betas0, CONSTANTS.FOCAL_LENGTH0, intr0),
+                                            project_pred_joints(smplx, pred_pose1, pred_betas1, CONSTANTS.FOCAL_LENGTH1, intr1)],
+                                            [j2d0, j2d1])
+                errors.append(err/max(conf, 1e-9))
+            staleness = np.array(staleness)
+            rows.append((drop_prob, latency, np.mean(errors), 100*np.mean(staleness == 0),
+                            100*np.mean(staleness > 0), 100*np.mean(staleness == -1)))
+
+# %% summary table
+print("max age: {} frames, camera rate: {} fps, iters: {}".format(max_age, fps, iters))
+print("{:>6} {:>14} {:>16} {:>10} {:>10} {:>12}".format("drop","latency (ms)","kp error (px)","fresh (%)","stale (%)","no peer (%)"))
+for drop_prob, latency, err, fresh, stale, no_peer in rows:
+    print("{:>6.2f} {:>14.1f} {:>16.2f} {:>10.1f} {:>10.1f} {:>12.1f}".format(drop_prob, 1000*latency, err, fresh, stale, no_peer))
@@ -0,0 +1,78 @@
+# %% Imports
+# step time of the body model part of a training step (skinning of both views, vertex and joint
+# losses, backward) with the full SMPL-X and the body-only reduced model, and the deviation of
+# the reduced model from the full one.
+# usage: python body_model_benchmark.py <copenet_home> [batch_sizes] [n_iters]
+import torch
+import numpy as np
+import time
+import os, sys; sys.path.append(os.path.dirname(os.path.abspath(__file__+"/..")))
+
+from config import device
+
+from copenet.utils.body_model import get_smplx, get_smplx_body
+from copenet.utils.geometry import rot6d_to_rotmat
+
+copenet_home = sys.argv[1]
+batch_sizes = [int(x) for x in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1,8,30,64]
+n_iters = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+smplx = get_smplx(copenet_home, device)
+smplx_body = get_smplx_body(copenet_home, device)
+mseloss = torch.nn.MSELoss(reduction='none')
+
+def sync():
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+def random_params(batch_size):
+    pose6d = torch.randn(batch_size,22*6,device=device)*0.1 + torch.tensor([1.,0,0,1,0,0],device=device).repeat(22)
+    betas = torch.randn(batch_size,10,device=device)
+    return pose6d.requires_grad_(), betas.requires_grad_()
+
+def step(body_model, pose6d, betas, gt_vertices, gt_joints):
+    batch_size = betas.shape[0]
+    rotmat = rot6d_to_rotmat(pose6d).view(batch_size,22,3,3)
+    out = body_model.forward(betas=betas,
+                            body_pose=rotmat[:,1:],
+                            global_orient=torch.eye(3,device=device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
+                            transl=torch.zeros(batch_size,3,device=device),
+                            pose2rot=False)
+    loss = mseloss(out.vertices, gt_vertices).mean() + mseloss(out.joints[:,:22], gt_joints).mean()
+    loss.backward()
+
+def time_step(body_model, batch_size, n_verts):
+    gt_vertices = torch.randn(batch_size,n_verts,3,device=device)
+    gt_joints = torch.randn(batch_size,22,3,device=device)
+    times = []
+    for i in range(n_iters + 3):
+        pose6d, betas = random_params(batch_size)
+        sync()
+        t0 = time.time()
+        # two views per training step
+        step(body_model, pose6d, betas, gt_vertices, gt_joints)
+        step(body_model, pose6d, betas, gt_vertices, gt_joints)
+        sync()
+        if i >= 3:
+            times.append(time.time() - t0)
+    return np.median(times)
+
+# %% deviation of the reduced model
+with torch.no_grad():
+    pose6d, betas = random_params(8)
+    rotmat = rot6d_to_rotmat(pose6d).view(8,22,3,3)
+    kwargs = dict(betas=betas, body_pose=rotmat[:,1:], global_orient=rotmat[:,:1],
+                    transl=torch.zeros(8,3,device=device), pose2rot=False)
+    full = smplx.forward(**kwargs)
+    body = smplx_body.forward(**kwargs)
+    v_err = (full.vertices[:,smplx_body.vertex_idx] - body.vertices).norm(dim=-1).max().item()
+    j_err = (full.joints[:,:22] - body.joints).norm(dim=-1).max().item()
+print("vertices: {} full, {} body. max deviation: vertices {:.2e} m, joints {:.2e} m".format(
+        smplx.v_template.shape[0], smplx_body.vertex_idx.shape[0], v_err, j_err))
+
+# %% step time
+print("{:>6} {:>16} {:>16} {:>10}".format("batch","full (ms)","body only (ms)","speedup"))
+for batch_size in batch_sizes:
+    t_full = time_step(smplx, batch_size, smplx.v_template.shape[0])
+    t_body = time_step(smplx_body, batch_size, smplx_body.vertex_idx.shape[0])
+    print("{:>6} {:>16.2f} {:>16.2f} {:>10.2f}".format(batch_size, 1000*t_full, 1000*t_body, t_full/t_body))
@@ -0,0 +1,84 @@
+# %% Imports
+# memory / step time trade-off of activation checkpointing in the two view training step
+# (--checkpoint_backbone, --checkpoint_smplx) at several batch sizes: peak allocated GPU memory and
+# median time of forward + loss + backward + optimizer step on AerialPeople batches.
+# usage: python checkpoint_benchmark.py <datapath> [batch_sizes] [n_iters]
+import torch
+import numpy as np
+from argparse import ArgumentParser
+from torch.utils.data import DataLoader
+import time
+import os
+import sys
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+from copenet.config import device
+from copenet.copenet_twoview import copenet_twoview
+
+datapath = sys.argv[1]
+batch_sizes = [int(x) for x in sys.argv[2].split(",")] if len(sys.argv) > 2 else [30,60,90,120]
+n_iters = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+copenet_home = os.path.join(os.path.dirname(os.path.abspath(__file__)),"../../../../copenet")
+configs = {"none": (False, False),
+            "backbone": (True, False),
+            "smplx": (False, True),
+            "both": (True, True)}
+
+parser = copenet_twoview.add_model_specific_args(ArgumentParser(add_help=False))
+hparams = parser.parse_args(["--name","checkpoint_benchmark","--version","0","--model","copenet_twoview",
+                                "--copenet_home",copenet_home,"--datapath",datapath])
+net = copenet_twoview(hparams).to(device)
+net.train()
+optimizer = net.configure_optimizers()
+
+# one batch of the largest size, the smaller batches are slices of it
+train_ds = net.train_dataloader().dataset
+batch = next(iter(DataLoader(train_ds, batch_size=max(batch_sizes), shuffle=True, num_workers=hparams.num_workers)))
+batch = {k:v.to(device) if torch.is_tensor(v) else v for k,v in batch.items()}
+
+def sync():
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+def train_step(sub_batch):
+    _, _, loss = net.fwd_pass_and_loss(sub_batch,is_val=False,is_test=False)
+    optimizer.zero_grad()
+    loss.backward()
+    optimizer.step()
+
+def measure(batch_size):
+    sub_batch = {k:v[:batch_size] if torch.is_tensor(v) or isinstance(v,list) else v for k,v in batch.items()}
+    times = []
+    if device == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+    for i in range(n_iters + 2):
+        sync()
+        t0 = time.time()
+        train_step(sub_batch)
+        sync()
+        if i >= 2:
+            times.append(time.time() - t0)
+    peak = torch.cuda.max_memory_allocated()/2**20 if device == "cuda" else float("nan")
+    return peak, 1000*np.median(times)
+
+# %% measure
+print("{:>6} {:>10} {:>16} {:>14} {:>10} {:>10}".format("batch","ckpt","peak mem (MB)","step (ms)","mem","time"))
+for batch_size in batch_sizes:
+    base = None
+    for name, (ckpt_backbone, ckpt_smplx) in configs.items():
+        net.model.checkpoint_backbone = ckpt_backbone
+        net.hparams.checkpoint_smplx = ckpt_smplx
+        try:
+            peak, step_ms = measure(batch_size)
+        except RuntimeError as e:
+            if "out of memory" not in str(e):
+                raise
+            optimizer.zero_grad()
+            torch.cuda.empty_cache()
+            print("{:>6} {:>10} {:>16} {:>14}".format(batch_size, name, "OOM", "-"))
+            continue
+        if base is None:
+            base = (peak, step_ms)
+        print("{:>6} {:>10} {:>16.0f} {:>14.1f} {:>10.2f} {:>10.2f}".format(batch_size, name, peak, step_ms,
+                peak/base[0], step_ms/base[1]))
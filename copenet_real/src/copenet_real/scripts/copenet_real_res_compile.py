@@ -35,6 +35,7 @@ trainer = Trainer(gpus=gpu)
 
 
 net = copenet_twoview.load_from_checkpoint(checkpoint_path=os.path.join(fname,"epoch-257.ckpt"))
+net.hparams.result_store = os.path.join(fname,"epoch-257_results")
 
 # create dataset and dataloader
 train_ds, test_ds = copenet_real.get_copenet_real_traintest(datapath)
@@ -43,12 +44,12 @@ tst_dl = DataLoader(test_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 trn_dl = DataLoader(train_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 
 
 
@@ -6,11 +6,16 @@ import numpy as np
 from std_msgs.msg import Float32MultiArray
 import torch.nn.functional as F
 from smplx import SMPLX
+from copenet.utils.body_model import JointsOnlySMPLX, ShapeCalibratedSMPLX
 import meshcat
 import meshcat.geometry as g
 
 
 topic = sys.argv[1]
+# "mesh" (default) or "skeleton", the skeleton only needs the joints, no vertex is skinned
+viz_mode = sys.argv[2] if len(sys.argv) > 2 else "mesh"
+# the betas of the first calib_frames messages are averaged and frozen, later messages only pose the mesh
+calib_frames = int(sys.argv[3]) if len(sys.argv) > 3 else 30
 
 ##############################################
 
@@ -61,6 +66,8 @@ smplx = SMPLX("/is/ps3/nsaini/projects/copenet_real/src/copenet_real/data/smplx/
                          batch_size=1,
                          create_transl=False).to(device)
 smplx.eval()
+smplx_joints = JointsOnlySMPLX(smplx).to(device)
+smplx_calibrated = ShapeCalibratedSMPLX(smplx, calib_frames=calib_frames).to(device)
 
 # Create a new visualizer
 vis = meshcat.Visualizer()
@@ -84,16 +91,29 @@ def callback(data):
     trans = torch.from_numpy(np.array(data.data[10:13])).to(device).float().unsqueeze(0)
     pose = rot6d_to_rotmat(torch.from_numpy(np.array(data.data[13:])).to(device).float()).unsqueeze(0)
 
-    smplx_out = smplx.forward(betas=betas, 
-                                body_pose=pose[:,1:],
-                                global_orient=torch.eye(3,device=device).float().unsqueeze(0).unsqueeze(1),
-                                transl = torch.zeros(1,3).float().type_as(betas),
-                                pose2rot=False)
     transf_mat0 = torch.cat([pose[:,:1].squeeze(1),
                                 trans.unsqueeze(2)],dim=2)
+    if viz_mode == "skeleton":
+        joints = smplx_joints.forward(betas=betas,
+                                body_pose=pose[:,1:],
+                                global_orient=torch.eye(3,device=device).float().unsqueeze(0).unsqueeze(1),
+                                pose2rot=False).joints
+        joints = (torch.bmm(transf_mat0[:,:3,:3],joints.permute(0,2,1)).permute(0,2,1) + transf_mat0[:,:3,3].unsqueeze(1))[0]
+        parents = smplx_joints.parents.tolist()
+        bones = torch.stack([torch.stack([joints[i],joints[parents[i]]]) for i in range(1,len(parents))]).reshape(-1,3)
+        vis[meshname].set_object(g.LineSegments(g.PointsGeometry(bones.detach().cpu().numpy().T),
+                            g.LineBasicMaterial(color=clr, linewidth=5)))
+        return
+
+    with torch.no_grad():
+        smplx_out = smplx_calibrated.forward(meshname,
+                                    betas=betas, 
+                                    body_pose=pose[:,1:],
+                                    global_orient=torch.eye(3,device=device).float().unsqueeze(0).unsqueeze(1),
+                                    pose2rot=False)
     verts,joints,_,_ = transform_smpl(transf_mat0,
-                                                smplx_out.vertices.squeeze(1),
-                                                smplx_out.joints.squeeze(1))
+                                                smplx_out.vertices,
+                                                smplx_out.joints)
 
     vis[meshname].set_object(g.TriangularMeshGeometry(verts[0].detach().cpu().numpy(),smplx.faces),
                         g.MeshLambertMaterial(
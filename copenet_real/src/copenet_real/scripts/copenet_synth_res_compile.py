@@ -44,6 +44,11 @@ elif model_type == "muhmr":
 
 # set the copenet home
 net.hparams.copenet_home = os.path.join(os.path.dirname(os.path.abspath(__file__)),"../../../../copenet")
+# fields of the processing cells, written to the result store next to the checkpoint
+net.hparams.eval_spill_fields = ",".join([k + v for v in ["0","1"] for k in ["pred_vertices_cam","pred_j3d_cam",
+                                    "pred_betas","pred_smpltrans","gt_smpltrans","pred_angles"]])
+net.hparams.eval_spill_dir = os.path.splitext(ckpt_path)[0] + "_results"
+net.hparams.eval_spill_dtype = "none"
 
 # create dataset and dataloader
 train_ds, test_ds = aerialpeople.get_aerialpeople_seqsplit(datapath)
@@ -52,12 +57,12 @@ tst_dl = DataLoader(test_ds, batch_size=30,
                             num_workers=os.cpu_count()-1,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 trn_dl = DataLoader(train_ds, batch_size=30,
                             num_workers=os.cpu_count()-1,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 
 
 # %% draw sample and forward
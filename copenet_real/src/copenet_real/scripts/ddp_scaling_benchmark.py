@@ -0,0 +1,81 @@
+# %% Imports
+# data-parallel scaling of the two view training step on one machine: 1, 2 and 4 gloo processes on
+# the CPU, each with cpu_count/N threads, a DistributedSampler shard of AerialPeople and a fixed per
+# process batch (weak scaling). Reports the training throughput in samples/s, the speedup over one
+# process and the parallel efficiency.
+# usage: python ddp_scaling_benchmark.py <datapath> [n_procs] [batch_size] [n_iters]
+import torch
+import numpy as np
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from argparse import ArgumentParser
+import time
+import os
+import sys
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+
+datapath = sys.argv[1] if __name__ == "__main__" else None
+n_procs = [int(x) for x in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1,2,4]
+batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+n_iters = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+
+copenet_home = os.path.join(os.path.dirname(os.path.abspath(__file__)),"../../../../copenet")
+
+def worker(rank, world_size, datapath, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = "29512"
+    os.environ["LOCAL_RANK"] = str(rank)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, os.cpu_count()//world_size))
+    from copenet.copenet_twoview import copenet_twoview
+
+    parser = copenet_twoview.add_model_specific_args(ArgumentParser(add_help=False))
+    hparams = parser.parse_args(["--name","ddp_scaling_benchmark","--version","0","--model","copenet_twoview",
+                                    "--copenet_home",copenet_home,"--datapath",datapath,
+                                    "--batch_size",str(batch_size),"--num_workers","0"])
+    torch.manual_seed(0)
+    net = copenet_twoview(hparams)
+    net.train()
+    net.model = DistributedDataParallel(net.model)
+    optimizer = torch.optim.Adam(net.model.parameters(), lr=hparams.lr)
+
+    train_ds = net.train_dataloader().dataset
+    sampler = DistributedSampler(train_ds, num_replicas=world_size, rank=rank, shuffle=True, seed=0)
+    dloader = DataLoader(train_ds, batch_size=batch_size, sampler=sampler, num_workers=0, drop_last=True)
+
+    times = []
+    batches = iter(dloader)
+    for i in range(n_iters + 2):
+        batch = next(batches)
+        dist.barrier()
+        t0 = time.time()
+        _, _, loss = net.fwd_pass_and_loss(batch,is_val=False,is_test=False)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        dist.barrier()
+        if i >= 2:
+            times.append(time.time() - t0)
+    if rank == 0:
+        results.put((world_size, np.median(times)))
+    dist.destroy_process_group()
+
+# %% measure
+if __name__ == "__main__":
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    step_time = {}
+    for world_size in n_procs:
+        mp.spawn(worker, args=(world_size, datapath, results), nprocs=world_size, join=True)
+        _, step_time[world_size] = results.get()
+
+    print("{:>6} {:>8} {:>12} {:>14} {:>10} {:>12}".format("procs","threads","step (ms)","samples/s","speedup","efficiency"))
+    base = batch_size/step_time[n_procs[0]]/n_procs[0]
+    for world_size, t in step_time.items():
+        throughput = world_size*batch_size/t
+        print("{:>6} {:>8} {:>12.1f} {:>14.1f} {:>10.2f} {:>12.2f}".format(world_size, max(1, os.cpu_count()//world_size),
+                1000*t, throughput, throughput/base, throughput/base/world_size))
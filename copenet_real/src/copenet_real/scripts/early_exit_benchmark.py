@@ -0,0 +1,98 @@
+# %% Imports
+# average regressor iterations and latency saved by the adaptive early exit of copenet.forward
+# usage: python early_exit_benchmark.py <synth|real> <ckpt_path> <datapath> [thresholds] [iters]
+import torch
+import numpy as np
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+import time
+import os, sys; sys.path.append(os.path.dirname(os.path.abspath(__file__+"/..")))
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+
+dset_type = sys.argv[1]
+ckpt_path = sys.argv[2]
+datapath = sys.argv[3]
+thresholds = [float(x) for x in sys.argv[4].split(",")] if len(sys.argv) > 4 else [1e-2,5e-3,1e-3]
+iters = int(sys.argv[5]) if len(sys.argv) > 5 else 3
+warmup_batches = 2
+
+if dset_type == "synth":
+    from copenet.config import device
+    from copenet.copenet_twoview import copenet_twoview
+    from copenet.dsets import aerialpeople
+    net = copenet_twoview.load_from_checkpoint(checkpoint_path=ckpt_path)
+    net.hparams.copenet_home = os.path.join(os.path.dirname(os.path.abspath(__file__)),"../../../../copenet")
+    _, test_ds = aerialpeople.get_aerialpeople_seqsplit(datapath,img_res=net.hparams.img_res)
+else:
+    from config import device
+    from copenet_real.copenet_twoview import copenet_twoview
+    from copenet_real.dsets import copenet_real
+    net = copenet_twoview.load_from_checkpoint(checkpoint_path=ckpt_path)
+    _, test_ds = copenet_real.get_copenet_real_traintest(datapath,img_res=net.hparams.img_res)
+
+net.to(device)
+net.eval()
+
+tst_dl = DataLoader(test_ds, batch_size=net.hparams.val_batch_size,
+                            num_workers=os.cpu_count()-1,
+                            pin_memory=True,
+                            shuffle=False)
+
+def timed_reg(model, xf0, xf1, bb0, bb1, in_smpltrans0, in_smpltrans1, exit_threshold):
+    """ copenet.forward on the features of forward_feat_ext (only the regressor), returns outputs and seconds """
+    if device == "cuda":
+        torch.cuda.synchronize()
+    t0 = time.time()
+    out = model.forward(None, None, bb0, bb1, in_smpltrans0, in_smpltrans1,
+                        iters=iters, exit_threshold=exit_threshold, xf0=xf0, xf1=xf1)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return out, time.time() - t0
+
+# %% run fixed iterations and every threshold on the same features
+modes = [None] + thresholds
+reg_time = {m:[] for m in modes}
+n_iters = {m:[] for m in modes}
+max_dev = {m:[] for m in modes}
+feat_time = []
+with torch.no_grad():
+    for i,batch in enumerate(tqdm(tst_dl)):
+        im0 = batch["im0"].float().to(device)
+        im1 = batch["im1"].float().to(device)
+        bb0 = batch["bb0"].float().to(device)
+        bb1 = batch["bb1"].float().to(device)
+        batch_size = im0.shape[0]
+        # same input translation as fwd_pass_and_loss with distance scaling
+        in_smpltrans = 0.05*torch.tensor([0,0,10]).float().to(device).expand(batch_size,-1)
+
+        if device == "cuda":
+            torch.cuda.synchronize()
+        t0 = time.time()
+        xf0 = net.model.forward_feat_ext(im0)
+        xf1 = net.model.forward_feat_ext(im1)
+        if device == "cuda":
+            torch.cuda.synchronize()
+        if i >= warmup_batches:
+            feat_time.append(time.time() - t0)
+
+        ref = None
+        for m in modes:
+            out, t = timed_reg(net.model, xf0, xf1, bb0, bb1, in_smpltrans, in_smpltrans, m)
+            if ref is None:
+                ref = out
+            if i >= warmup_batches:
+                reg_time[m].append(t)
+            n_iters[m].append(net.model.n_iters.cpu())
+            max_dev[m].append(torch.cat([(o - r).abs().max(1)[0].unsqueeze(1) for o,r in zip(out,ref)],1).max(1)[0].cpu())
+
+# %% summary table
+total_fixed = np.sum(feat_time) + np.sum(reg_time[None])
+print("dataset: {}, samples: {}, max iters: {}".format(dset_type,len(test_ds),iters))
+print("{:>10} {:>10} {:>14} {:>18} {:>16} {:>14}".format("threshold","avg iters","reg time (ms)","reg time saved (%)","total saved (%)","max deviation"))
+for m in modes:
+    print("{:>10} {:>10.3f} {:>14.2f} {:>18.1f} {:>16.1f} {:>14.5f}".format("fixed" if m is None else m,
+                                torch.cat(n_iters[m]).mean().item(),
+                                1000*np.sum(reg_time[m]),
+                                100*(1 - np.sum(reg_time[m])/np.sum(reg_time[None])),
+                                100*(np.sum(reg_time[None]) - np.sum(reg_time[m]))/total_fixed,
+                                torch.cat(max_dev[m]).max().item()))
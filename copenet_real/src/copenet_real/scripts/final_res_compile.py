@@ -37,29 +37,29 @@ tst_dl = DataLoader(test_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 tst_dl1 = DataLoader(test_ds_1, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 trn_dl = DataLoader(train_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 trn_dl1 = DataLoader(train_ds_1, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 
 # draw sample and forward
 if model_type == "copenet_twoview":
     trainer.test(net,test_dataloaders=[tst_dl,trn_dl])
     pkl.dump(outputs,open(,"wb"))
 
-    res = pkl.load(open("/is/ps3/nsaini/projects/copenet_real/copenet_logs/copenet_twoview/version_5_cont_limbwght/checkpoints/epoch=563.pkl","rb"))
+    res = ResultStore("/is/ps3/nsaini/projects/copenet_real/copenet_logs/copenet_twoview/version_5_cont_limbwght/checkpoints/epoch=563_results")
 
 elif model_type == "hmr":
     res0 = trainer.test(net0,test_dataloaders=[tst_dl,trn_dl])
@@ -70,12 +70,13 @@ elif model_type == "hmr":
 
 # %% processing
 
-fname = "/ps/project/datasets/AirCap_ICCV19/cvpr21_mat/copenet_twoview_version_5_cont_limbwght_checkpoints_epoch=563.pkl"
+fname = "/ps/project/datasets/AirCap_ICCV19/cvpr21_mat/copenet_twoview_version_5_cont_limbwght_checkpoints_epoch=563_results"
 dset = "/ps/project/datasets/AirCap_ICCV19/copenet_data/"
 
 import sys
 # sys.path.append("/is/ps3/nsaini/projects/copenet_real/src")
 from copenet_real.utils.utils import transform_smpl
+from copenet_real.utils.result_store import ResultStore
 import torchgeometry as tgm
 from copenet_real.utils.renderer import Renderer
 from copenet_real.smplx.smplx import SMPLX, lbs
@@ -103,7 +104,7 @@ synth_renderer = Renderer(synth_focallen,img_res,[img_res[0]/2,img_res[1]/2],smp
 real_renderer0 = Renderer(real_focallen0,img_res,[CX0,CY0],smplx.faces)
 real_renderer1 = Renderer(real_focallen1,img_res,[CX1,CY1],smplx.faces)
 
-res = pkl.load(open(fname,"rb"))
+res = ResultStore(fname)
 
 model_type = "_".join(fname.split("/")[-1].split("_")[:2])
 
@@ -128,28 +129,28 @@ else:
     images1 = np.array(test_ds.db["im1"])
 
 begin = 0
-end = 10
+end = 300
 
 if model_type == "copenet_twoview":
-    batch_size = res[0][0]["output"]["pred_vertices_cam0"].shape[0]
-    pred_vertices_cam0_test = torch.cat([i["output"]["pred_vertices_cam0"].to("cuda") for i in res[0][begin:end]])
-    pred_vertices_cam1_test = torch.cat([i["output"]["pred_vertices_cam1"].to("cuda") for i in res[0][begin:end]])
-    pred_j2d_cam0_test = torch.cat([i["output"]["pred_j2d_cam0"].to("cuda") for i in res[0][begin:end]])
-    pred_j2d_cam1_test = torch.cat([i["output"]["pred_j2d_cam1"].to("cuda") for i in res[0][begin:end]])
-    pred_j3d_cam0_test = torch.cat([i["output"]["pred_j3d_cam0"].to("cuda") for i in res[0][begin:end]])
-    pred_j3d_cam1_test = torch.cat([i["output"]["pred_j3d_cam1"].to("cuda") for i in res[0][begin:end]])
-    pred_smpltrans0_test = torch.cat([i["output"]["pred_smpltrans0"].to("cuda") for i in res[0][begin:end]])
-    pred_smpltrans1_test = torch.cat([i["output"]["pred_smpltrans1"].to("cuda") for i in res[0][begin:end]])
-    pred_angles0_test = torch.cat([i["output"]["pred_angles0"].to("cuda") for i in res[0][begin:end]])
-    pred_angles1_test = torch.cat([i["output"]["pred_angles1"].to("cuda") for i in res[0][begin:end]])
+    # begin and end are frames of the result store
+    pred_vertices_cam0_test = res.tensor("test", "pred_vertices_cam0", frames=range(begin,end), device="cuda")
+    pred_vertices_cam1_test = res.tensor("test", "pred_vertices_cam1", frames=range(begin,end), device="cuda")
+    pred_j2d_cam0_test = res.tensor("test", "pred_j2d_cam0", frames=range(begin,end), device="cuda")
+    pred_j2d_cam1_test = res.tensor("test", "pred_j2d_cam1", frames=range(begin,end), device="cuda")
+    pred_j3d_cam0_test = res.tensor("test", "pred_j3d_cam0", frames=range(begin,end), device="cuda")
+    pred_j3d_cam1_test = res.tensor("test", "pred_j3d_cam1", frames=range(begin,end), device="cuda")
+    pred_smpltrans0_test = res.tensor("test", "pred_smpltrans0", frames=range(begin,end), device="cuda")
+    pred_smpltrans1_test = res.tensor("test", "pred_smpltrans1", frames=range(begin,end), device="cuda")
+    pred_angles0_test = res.tensor("test", "pred_angles0", frames=range(begin,end), device="cuda")
+    pred_angles1_test = res.tensor("test", "pred_angles1", frames=range(begin,end), device="cuda")
     pred_rotmat0_test = tgm.angle_axis_to_rotation_matrix(pred_angles0_test.view(-1,3)).view(pred_angles0_test.shape[0],22,4,4)
     pred_rotmat1_test = tgm.angle_axis_to_rotation_matrix(pred_angles1_test.view(-1,3)).view(pred_angles1_test.shape[0],22,4,4)
     
 
     pred_vertices_cam0_test_wrt_origin,pred_j3d_cam0_test_wrt_origin,pred_orient0_wrt_origin, pred_trans0_wrt_origin \
-            = transform_smpl(torch.inverse(test_extr0[begin*batch_size:batch_size*(end-begin)]),pred_vertices_cam0_test,pred_j3d_cam0_test,pred_rotmat0_test[begin*batch_size:batch_size*(end-begin),1,:3,:3],pred_smpltrans0_test)
+            = transform_smpl(torch.inverse(test_extr0[begin:end]),pred_vertices_cam0_test,pred_j3d_cam0_test,pred_rotmat0_test[:,1,:3,:3],pred_smpltrans0_test)
     pred_vertices_cam1_test_wrt_origin,pred_j3d_cam1_test_wrt_origin,pred_orient1_wrt_origin, pred_trans1_wrt_origin \
-            = transform_smpl(torch.inverse(test_extr1[begin*batch_size:batch_size*(end-begin)]),pred_vertices_cam1_test,pred_j3d_cam1_test,pred_rotmat1_test[begin*batch_size:batch_size*(end-begin),1,:3,:3],pred_smpltrans1_test)
+            = transform_smpl(torch.inverse(test_extr1[begin:end]),pred_vertices_cam1_test,pred_j3d_cam1_test,pred_rotmat1_test[:,1,:3,:3],pred_smpltrans1_test)
     
     import cv2
     samples = [0,1,2,3,4] 
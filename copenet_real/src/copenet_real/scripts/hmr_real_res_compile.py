@@ -34,6 +34,9 @@ trainer = Trainer(gpus=gpu)
 
 net0 = hmr.load_from_checkpoint(checkpoint_path=os.path.join(fname,"epoch=388.ckpt"))
 net1 = hmr.load_from_checkpoint(checkpoint_path=os.path.join(fname,"epoch=388.ckpt"))
+# result stores of the two cameras, read by bundle_adj.py
+net0.hparams.result_store = os.path.join(fname,"epoch=388_results0")
+net1.hparams.result_store = os.path.join(fname,"epoch=388_results1")
 
 # create dataset and dataloader
 train_ds, test_ds = copenet_real.get_copenet_real_traintest(datapath)
@@ -43,22 +46,22 @@ tst_dl = DataLoader(test_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 tst_dl1 = DataLoader(test_ds_1, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 trn_dl = DataLoader(train_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 trn_dl1 = DataLoader(train_ds_1, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 
 
 # %% draw sample and forward
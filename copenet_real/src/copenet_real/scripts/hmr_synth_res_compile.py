@@ -54,22 +54,22 @@ tst_dl = DataLoader(test_ds, batch_size=30,
                             num_workers=os.cpu_count()-1,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 # tst_dl1 = DataLoader(test_ds_1, batch_size=30,
 #                             num_workers=os.cpu_count()-1,
 #                             pin_memory=True,
 #                             shuffle=False,
-#                             drop_last=True)
+#                             drop_last=False)
 trn_dl = DataLoader(train_ds, batch_size=30,
                             num_workers=os.cpu_count()-1,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 # trn_dl1 = DataLoader(train_ds_1, batch_size=30,
 #                             num_workers=os.cpu_count()-1,
 #                             pin_memory=True,
 #                             shuffle=False,
-#                             drop_last=True)
+#                             drop_last=False)
 
 
 # # %% draw sample and forward
@@ -81,9 +81,9 @@ trn_dl = DataLoader(train_ds, batch_size=30,
 # %%
 import sys
 if modeltype == "hmr":
-    fname = os.path.join(fname ,"final.pkl")
+    fname = os.path.join(fname ,"final_results")
 elif modeltype == "copenet_singleview":
-    fname = os.path.join(fname , "epoch=176.pkl")
+    fname = os.path.join(fname , "epoch=176_results")
 # fname = "/is/ps3/nsaini/projects/copenet/copenet_logs/hmr/version_1_camswaps_correctcam/final.pkl"
 # fname = "/is/ps3/nsaini/projects/copenet/copenet_logs/copenet_singleview/version_3_noinputtrans/checkpoints/epoch=176.pkl"
 fname0 = fname + "0"
@@ -92,6 +92,7 @@ fname0 = fname + "0"
 import sys
 # sys.path.append("/is/ps3/nsaini/projects/copenet_real/src")
 from copenet_real.utils.utils import transform_smpl
+from copenet_real.utils.result_store import ResultStore
 import torchgeometry as tgm
 from copenet_real.utils.renderer import Renderer
 from copenet_real.smplx.smplx import SMPLX, lbs
@@ -109,7 +110,7 @@ synth_focallen = [1475,1475]
 
 synth_renderer = Renderer(synth_focallen,img_res,[img_res[0]/2,img_res[1]/2],smplx.faces)
 
-res0 = pkl.load(open(fname0,"rb"))
+res0 = ResultStore(fname0)
 # res1 = pkl.load(open(fname1,"rb"))
 
 
@@ -125,22 +126,22 @@ gt_j3d = torch.from_numpy(np.concatenate([pkl.load(open(f,"rb"))["smpl_joints_wr
 
 
 begin = 0
-end = len(res0[0])
+end = res0.num_frames("test")
 
 
 
-batch_size = res0[0][0]["output"]["pred_vertices_cam"].shape[0]
-pred_vertices_cam0_test = torch.cat([i["output"]["pred_vertices_cam"].to(device) for i in res0[0][begin:end]])
+# begin and end are frames of the result store
+pred_vertices_cam0_test = res0.tensor("test", "pred_vertices_cam", frames=range(begin,end), device=device)
 # pred_vertices_cam1_test = torch.cat([i["output"]["pred_vertices_cam"].to(device) for i in res1[0][begin:end]])
-pred_j3d_cam0_test = torch.cat([i["output"]["pred_j3d_cam"].to(device) for i in res0[0][begin:end]])
+pred_j3d_cam0_test = res0.tensor("test", "pred_j3d_cam", frames=range(begin,end), device=device)
 # pred_j3d_cam1_test = torch.cat([i["output"]["pred_j3d_cam"].to(device) for i in res1[0][begin:end]])
-pred_smpltrans0_test = torch.cat([i["output"]["pred_smpltrans"].to(device) for i in res0[0][begin:end]])
+pred_smpltrans0_test = res0.tensor("test", "pred_smpltrans", frames=range(begin,end), device=device)
 # pred_smpltrans1_test = torch.cat([i["output"]["pred_smpltrans"].to(device) for i in res1[0][begin:end]])
-gt_smpltrans0_test = torch.cat([i["output"]["gt_smpltrans"].to(device) for i in res0[0][begin:end]])
+gt_smpltrans0_test = res0.tensor("test", "gt_smpltrans", frames=range(begin,end), device=device)
 # gt_smpltrans1_test = torch.cat([i["output"]["gt_smpltrans"].to(device) for i in res1[0][begin:end]])
-pred_betas0 = torch.cat([i["output"]["pred_betas"].to(device) for i in res0[0][begin:end]])
+pred_betas0 = res0.tensor("test", "pred_betas", frames=range(begin,end), device=device)
 # pred_betas1 = torch.cat([i["output"]["pred_betas"].to(device) for i in res1[0][begin:end]])
-pred_angles0_test = torch.cat([i["output"]["pred_angles"].to(device) for i in res0[0][begin:end]])
+pred_angles0_test = res0.tensor("test", "pred_angles", frames=range(begin,end), device=device)
 # pred_angles1_test = torch.cat([i["output"]["pred_angles"].to(device) for i in res1[0][begin:end]])
 pred_rotmat0_test = tgm.angle_axis_to_rotation_matrix(pred_angles0_test.view(-1,3)).view(pred_angles0_test.shape[0],22,4,4)
 # pred_rotmat1_test = tgm.angle_axis_to_rotation_matrix(pred_angles1_test.view(-1,3)).view(pred_angles1_test.shape[0],22,4,4)
@@ -148,9 +149,9 @@ pred_rotmat0_test = tgm.angle_axis_to_rotation_matrix(pred_angles0_test.view(-1,
 
 
 pred_vertices_cam0_test_wrt_origin,pred_j3d_cam0_test_wrt_origin,pred_orient0_wrt_origin, pred_trans0_wrt_origin \
-        = transform_smpl(torch.inverse(test_extr0[begin*batch_size:batch_size*(end-begin)]),pred_vertices_cam0_test,pred_j3d_cam0_test,pred_rotmat0_test[begin*batch_size:batch_size*(end-begin),1,:3,:3],pred_smpltrans0_test)
+        = transform_smpl(torch.inverse(test_extr0[begin:end]),pred_vertices_cam0_test,pred_j3d_cam0_test,pred_rotmat0_test[:,1,:3,:3],pred_smpltrans0_test)
 # pred_vertices_cam1_test_wrt_origin,pred_j3d_cam1_test_wrt_origin,pred_orient1_wrt_origin, pred_trans1_wrt_origin \
-#         = transform_smpl(torch.inverse(test_extr1[begin*batch_size:batch_size*(end-begin)]),pred_vertices_cam1_test,pred_j3d_cam1_test,pred_rotmat1_test[begin*batch_size:batch_size*(end-begin),1,:3,:3],pred_smpltrans1_test)
+#         = transform_smpl(torch.inverse(test_extr1[begin:end]),pred_vertices_cam1_test,pred_j3d_cam1_test,pred_rotmat1_test[:,1,:3,:3],pred_smpltrans1_test)
 
 joints3d = [] 
 for i in tqdm(range(pred_rotmat0_test.shape[0])):
@@ -175,7 +176,7 @@ print("mpe0: {}".format(np.mean(np.sqrt(np.sum((gt_smpltrans0_test.detach().cpu(
 # %%
 import cv2
 import random
-samples = random.sample(range(begin*batch_size,batch_size*(end-begin)),1)  # 原来是 5
+samples = random.sample(range(begin,end),1)  # 原来是 5
 ims0 = torch.from_numpy(np.stack([cv2.imread(f)[:,:,::-1]/255. for f in images0[samples]])).permute(0,3,1,2)
 # ims1 = torch.from_numpy(np.stack([cv2.imread(f)[:,:,::-1]/255. for f in images1[samples]])).permute(0,3,1,2)
 
@@ -0,0 +1,83 @@
+# %% Imports
+# accuracy vs latency of the two view network for different input crop resolutions,
+# evaluated on the distant subjects (small bounding boxes) of the synthetic test split.
+# usage: python img_res_benchmark.py <ckpt_path> <datapath> [max_bb_px] [resolutions]
+# ckpt_path may contain "{}" which is replaced by the resolution to use one checkpoint per resolution.
+import torch
+import numpy as np
+from torch.utils.data import DataLoader, Subset
+from tqdm import tqdm
+import time
+import os
+import sys
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+from copenet.config import device
+from copenet.copenet_twoview import copenet_twoview
+from copenet.dsets import aerialpeople
+from copenet import constants as CONSTANTS
+
+ckpt_path = sys.argv[1]
+datapath = sys.argv[2]
+# subjects whose bounding box is smaller than this (in pixels) are considered distant
+max_bb_px = float(sys.argv[3]) if len(sys.argv) > 3 else 150
+resolutions = [int(x) for x in sys.argv[4].split(",")] if len(sys.argv) > 4 else [128,160,192,224,256]
+warmup_batches = 2
+
+copenet_home = os.path.join(os.path.dirname(os.path.abspath(__file__)),"../../../../copenet")
+
+# %% select distant subjects once, the crop box does not depend on the input resolution
+_, test_ds = aerialpeople.get_aerialpeople_seqsplit(datapath)
+distant_idcs = []
+for idx in tqdm(range(len(test_ds)),desc="selecting distant subjects"):
+    sample = test_ds[idx]
+    # bb scale is IMG_RES/bigger crop dim
+    if min(sample["bb0"][2],sample["bb1"][2]) > CONSTANTS.IMG_RES/max_bb_px:
+        distant_idcs.append(idx)
+print("{} distant subjects out of {}".format(len(distant_idcs),len(test_ds)))
+
+# %% run every resolution
+results = {}
+for img_res in resolutions:
+    net = copenet_twoview.load_from_checkpoint(checkpoint_path=ckpt_path.format(img_res))
+    net.hparams.copenet_home = copenet_home
+    net.hparams.img_res = img_res
+    net.to(device)
+    net.eval()
+
+    _, test_ds = aerialpeople.get_aerialpeople_seqsplit(datapath,img_res=img_res)
+    tst_dl = DataLoader(Subset(test_ds,distant_idcs), batch_size=net.hparams.val_batch_size,
+                            num_workers=os.cpu_count()-1,
+                            pin_memory=True,
+                            shuffle=False,
+                            drop_last=False)
+
+    mpjpe = []
+    trans_err = []
+    latency = []
+    with torch.no_grad():
+        for i,batch in enumerate(tqdm(tst_dl,desc="img_res {}".format(img_res))):
+            batch = {k:v.to(device) if torch.is_tensor(v) else v for k,v in batch.items()}
+            if device == "cuda":
+                torch.cuda.synchronize()
+            t0 = time.time()
+            output, _, _ = net.fwd_pass_and_loss(batch,is_val=False,is_test=True)
+            if device == "cuda":
+                torch.cuda.synchronize()
+            if i >= warmup_batches:
+                latency.append((time.time() - t0)/batch["im0"].shape[0])
+
+            for cam in ["0","1"]:
+                pred_j3d = output["pred_j3d_cam"+cam][:,:22]
+                gt_j3d = batch["smpl_joints_rel"+cam].squeeze(1)[:,:22].cpu()
+                mpjpe.append(torch.norm((pred_j3d - pred_j3d[:,:1]) - (gt_j3d - gt_j3d[:,:1]),dim=-1).mean(1))
+                trans_err.append(torch.norm(output["pred_smpltrans"+cam] - output["gt_smpltrans"+cam],dim=-1))
+
+    results[img_res] = {"mpjpe":1000*torch.cat(mpjpe).mean().item(),
+                        "trans_err":torch.cat(trans_err).mean().item(),
+                        "latency":1000*np.mean(latency) if len(latency) > 0 else float("nan")}
+
+# %% summary table
+print("{:>8} {:>12} {:>14} {:>18}".format("img_res","mpjpe (mm)","trans err (m)","latency (ms/img)"))
+for img_res in resolutions:
+    print("{:>8} {:>12.2f} {:>14.3f} {:>18.2f}".format(img_res,results[img_res]["mpjpe"],
+                                            results[img_res]["trans_err"],results[img_res]["latency"]))
@@ -0,0 +1,97 @@
+# %% Imports
+# latency / throughput of the dynamic micro-batching inference server under a fleet of drone
+# pairs streaming frame pairs of the copenet_real test sequence at a fixed rate over local HTTP.
+# Compares batch size 1 (no batching) to dynamic batching.
+# usage: python inference_server_benchmark.py <ckpt_path> <datapath> [n_pairs] [fps] [duration_s] [max_wait_ms]
+import torch
+import numpy as np
+import threading
+import urllib.error
+import time
+import os, sys; sys.path.append(os.path.dirname(os.path.abspath(__file__+"/..")))
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+
+from config import device
+
+from copenet_real.copenet_twoview import copenet_twoview
+from copenet_real.dsets import copenet_real
+from copenet_real import constants as CONSTANTS
+from copenet.utils.inference_server import MicroBatcher, serve, infer_http
+
+ckpt_path = sys.argv[1]
+datapath = sys.argv[2]
+n_pairs = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+fps = float(sys.argv[4]) if len(sys.argv) > 4 else 10.
+duration = float(sys.argv[5]) if len(sys.argv) > 5 else 30.
+max_wait = float(sys.argv[6])/1000 if len(sys.argv) > 6 else 0.02
+deadline = 0.5
+port = 8080
+
+net = copenet_twoview.load_from_checkpoint(checkpoint_path=ckpt_path)
+net.to(device)
+net.eval()
+
+_, test_ds = copenet_real.get_copenet_real_traintest(datapath,img_res=net.hparams.img_res)
+default_intr = [np.array([[CONSTANTS.FOCAL_LENGTH0[0],0,CONSTANTS.CX0],[0,CONSTANTS.FOCAL_LENGTH0[1],CONSTANTS.CY0],[0,0,1]]),
+                np.array([[CONSTANTS.FOCAL_LENGTH1[0],0,CONSTANTS.CX1],[0,CONSTANTS.FOCAL_LENGTH1[1],CONSTANTS.CY1],[0,0,1]])]
+
+def load_requests(n):
+    reqs = []
+    for i in range(n):
+        sample = test_ds[i*len(test_ds)//n]
+        reqs.append({k:np.asarray(sample[k]) for k in ["im0","im1","bb0","bb1"]})
+    return reqs
+requests = load_requests(min(len(test_ds), 64))
+
+def drone_pair(url, pair_id, stop, counts):
+    # each pair sends its frame pairs at a fixed rate, frames are skipped while a request is in flight
+    t_next = time.time()
+    i = pair_id
+    while not stop.is_set():
+        try:
+            infer_http(url, requests[i % len(requests)], deadline=deadline)
+            counts["ok"] += 1
+        except urllib.error.HTTPError as e:
+            counts[e.code] = counts.get(e.code, 0) + 1
+        i += n_pairs
+        t_next += 1/fps
+        time.sleep(max(t_next - time.time(), 0))
+
+def run(max_batch_size, port):
+    batcher = MicroBatcher(net, max_batch_size=max_batch_size, max_wait=max_wait, max_queue=4*n_pairs,
+                            default_deadline=deadline, default_intr=default_intr).start()
+    server = serve(batcher, port=port)
+    url = "http://127.0.0.1:{}".format(port)
+    # warm up
+    infer_http(url, requests[0])
+    batcher.latencies.clear()
+    stop = threading.Event()
+    counts = {"ok":0}
+    threads = [threading.Thread(target=drone_pair, args=(url, p, stop, counts)) for p in range(n_pairs)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - t0
+    server.shutdown()
+    batcher.stop()
+    metrics = batcher.metrics()
+    metrics["throughput"] = counts["ok"]/elapsed
+    metrics["busy"] = counts.get(503, 0)
+    metrics["late"] = counts.get(504, 0)
+    return metrics
+
+# %% compare no batching to dynamic batching
+rows = []
+for i, max_batch_size in enumerate([1, n_pairs]):
+    rows.append((max_batch_size, run(max_batch_size, port + i)))
+
+# %% summary table
+print("drone pairs: {}, rate: {} fps each, max wait: {} ms, deadline: {} ms".format(n_pairs, fps, 1000*max_wait, 1000*deadline))
+print("{:>10} {:>14} {:>10} {:>10} {:>12} {:>8} {:>8}".format("max batch","throughput/s","p50 (ms)","p99 (ms)","mean batch","busy","late"))
+for max_batch_size, m in rows:
+    print("{:>10} {:>14.1f} {:>10.1f} {:>10.1f} {:>12.2f} {:>8} {:>8}".format(max_batch_size, m["throughput"], m["p50_ms"], m["p99_ms"],
+                                    m["mean_batch_size"], m["busy"], m["late"]))
@@ -0,0 +1,69 @@
+# %% Imports
+# joints-only forward kinematics vs smplx.forward(...).joints on the CPU: time of the forward
+# (inference, as in test_epoch_end and the visualization) and of forward + backward (as in the
+# keypoint losses and the bundle adjustment), and the deviation of the joints.
+# usage: python joints_fk_benchmark.py <copenet_home> [batch_sizes] [n_iters] [n_threads]
+import torch
+import numpy as np
+import time
+import os, sys; sys.path.append(os.path.dirname(os.path.abspath(__file__+"/..")))
+
+from copenet.utils.body_model import get_smplx, get_smplx_joints
+from copenet.utils.geometry import rot6d_to_rotmat
+
+copenet_home = sys.argv[1]
+batch_sizes = [int(x) for x in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1,8,64,512,2000]
+n_iters = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+if len(sys.argv) > 4:
+    torch.set_num_threads(int(sys.argv[4]))
+device = "cpu"
+
+smplx = get_smplx(copenet_home, device)
+smplx_joints = get_smplx_joints(copenet_home, device, num_joints=24)
+
+def random_params(batch_size):
+    pose6d = torch.randn(batch_size,22*6)*0.1 + torch.tensor([1.,0,0,1,0,0]).repeat(22)
+    betas = torch.randn(batch_size,10)
+    return pose6d, betas
+
+def joints(body_model, pose6d, betas):
+    batch_size = betas.shape[0]
+    rotmat = rot6d_to_rotmat(pose6d).view(batch_size,22,3,3)
+    return body_model.forward(betas=betas,
+                            body_pose=rotmat[:,1:],
+                            global_orient=rotmat[:,:1],
+                            transl=torch.zeros(batch_size,3),
+                            pose2rot=False).joints[:,:24]
+
+def time_fk(body_model, batch_size, backward):
+    times = []
+    for i in range(n_iters + 3):
+        pose6d, betas = random_params(batch_size)
+        if backward:
+            pose6d.requires_grad_()
+            betas.requires_grad_()
+        t0 = time.time()
+        with torch.set_grad_enabled(backward):
+            j3d = joints(body_model, pose6d, betas)
+            if backward:
+                j3d.square().mean().backward()
+        if i >= 3:
+            times.append(time.time() - t0)
+    return np.median(times)
+
+# %% deviation from the full model
+with torch.no_grad():
+    pose6d, betas = random_params(64)
+    j_err = (joints(smplx, pose6d, betas) - joints(smplx_joints, pose6d, betas)).norm(dim=-1).max().item()
+print("threads: {}, max joint deviation (24 joints): {:.2e} m".format(torch.get_num_threads(), j_err))
+
+# %% timing
+print("{:>6} {:>14} {:>16} {:>9} {:>14} {:>16} {:>9}".format("batch","full fwd (ms)","joints fwd (ms)","speedup",
+                                                    "full f+b (ms)","joints f+b (ms)","speedup"))
+for batch_size in batch_sizes:
+    t_full = time_fk(smplx, batch_size, False)
+    t_joints = time_fk(smplx_joints, batch_size, False)
+    t_full_bw = time_fk(smplx, batch_size, True)
+    t_joints_bw = time_fk(smplx_joints, batch_size, True)
+    print("{:>6} {:>14.2f} {:>16.2f} {:>9.1f} {:>14.2f} {:>16.2f} {:>9.1f}".format(batch_size,
+            1000*t_full, 1000*t_joints, t_full/t_joints, 1000*t_full_bw, 1000*t_joints_bw, t_full_bw/t_joints_bw))
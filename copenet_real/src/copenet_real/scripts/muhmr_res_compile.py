@@ -34,12 +34,12 @@ tst_dl = DataLoader(test_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 trn_dl = DataLoader(train_ds, batch_size=30,
                             num_workers=40,
                             pin_memory=True,
                             shuffle=False,
-                            drop_last=True)
+                            drop_last=False)
 
 
 # %% draw sample and forward
@@ -48,11 +48,12 @@ trn_dl = DataLoader(train_ds, batch_size=30,
 
 
 # %%
-fname = "/is/ps3/nsaini/projects/copenet/airpose_logs/muhmr_same_hparams_asv1/0/final.pkl"
+fname = "/is/ps3/nsaini/projects/copenet/airpose_logs/muhmr_same_hparams_asv1/0/final_results"
 
 import sys
 # sys.path.append("/is/ps3/nsaini/projects/copenet_real/src")
 from copenet_real.utils.utils import transform_smpl
+from copenet_real.utils.result_store import ResultStore
 import torchgeometry as tgm
 from copenet_real.utils.renderer import Renderer
 from copenet_real.smplx.smplx import SMPLX, lbs
@@ -70,7 +71,7 @@ synth_focallen = [1475,1475]
 
 synth_renderer = Renderer(synth_focallen,img_res,[img_res[0]/2,img_res[1]/2],smplx.faces)
 
-res = pkl.load(open(fname,"rb"))
+res = ResultStore(fname)
 
 
 test_extr0 = torch.from_numpy(np.stack([pkl.load(open(f,"rb"))["cam0"]["extr"] for f in test_ds.db])).float().to(device)
@@ -83,19 +84,19 @@ gt_smpltrans = torch.from_numpy(np.concatenate([pkl.load(open(f,"rb"))["smpltran
 
 
 begin = 0
-end = len(res[0])
-
-batch_size = res[0][0]["output"]["pred_vertices_cam0"].shape[0]
-pred_vertices_cam0_test = torch.cat([i["output"]["pred_vertices_cam0"].to(device) for i in res[0][begin:end]])
-pred_vertices_cam1_test = torch.cat([i["output"]["pred_vertices_cam1"].to(device) for i in res[0][begin:end]])
-pred_j3d_cam0_test = torch.cat([i["output"]["pred_j3d_cam0"].to(device) for i in res[0][begin:end]])
-pred_betas0 = torch.cat([i["output"]["pred_betas0"].to(device) for i in res[0][begin:end]])
-pred_betas1 = torch.cat([i["output"]["pred_betas1"].to(device) for i in res[0][begin:end]])
-pred_j3d_cam1_test = torch.cat([i["output"]["pred_j3d_cam1"].to(device) for i in res[0][begin:end]])
-pred_smpltrans0_test = torch.cat([i["output"]["pred_smpltrans0"].to(device) for i in res[0][begin:end]])
-pred_smpltrans1_test = torch.cat([i["output"]["pred_smpltrans1"].to(device) for i in res[0][begin:end]])
-pred_angles0_test = torch.cat([i["output"]["pred_angles0"].to(device) for i in res[0][begin:end]])
-pred_angles1_test = torch.cat([i["output"]["pred_angles1"].to(device) for i in res[0][begin:end]])
+end = res.num_frames("test")
+
+# begin and end are frames of the result store
+pred_vertices_cam0_test = res.tensor("test", "pred_vertices_cam0", frames=range(begin,end), device=device)
+pred_vertices_cam1_test = res.tensor("test", "pred_vertices_cam1", frames=range(begin,end), device=device)
+pred_j3d_cam0_test = res.tensor("test", "pred_j3d_cam0", frames=range(begin,end), device=device)
+pred_betas0 = res.tensor("test", "pred_betas0", frames=range(begin,end), device=device)
+pred_betas1 = res.tensor("test", "pred_betas1", frames=range(begin,end), device=device)
+pred_j3d_cam1_test = res.tensor("test", "pred_j3d_cam1", frames=range(begin,end), device=device)
+pred_smpltrans0_test = res.tensor("test", "pred_smpltrans0", frames=range(begin,end), device=device)
+pred_smpltrans1_test = res.tensor("test", "pred_smpltrans1", frames=range(begin,end), device=device)
+pred_angles0_test = res.tensor("test", "pred_angles0", frames=range(begin,end), device=device)
+pred_angles1_test = res.tensor("test", "pred_angles1", frames=range(begin,end), device=device)
 pred_rotmat0_test = tgm.angle_axis_to_rotation_matrix(pred_angles0_test.view(-1,3)).view(pred_angles0_test.shape[0],22,4,4)
 pred_rotmat1_test = tgm.angle_axis_to_rotation_matrix(pred_angles1_test.view(-1,3)).view(pred_angles1_test.shape[0],22,4,4)
 
@@ -105,15 +106,15 @@ pred_rotmat1_test = tgm.angle_axis_to_rotation_matrix(pred_angles1_test.view(-1,
 
 
 pred_vertices_cam0_test_wrt_origin,pred_j3d_cam0_test_wrt_origin,pred_orient0_wrt_origin, pred_trans0_wrt_origin \
-        = transform_smpl(torch.inverse(test_extr0[begin*batch_size:batch_size*(end-begin)]),pred_vertices_cam0_test,pred_j3d_cam0_test,pred_rotmat0_test[begin*batch_size:batch_size*(end-begin),1,:3,:3],pred_smpltrans0_test)
+        = transform_smpl(torch.inverse(test_extr0[begin:end]),pred_vertices_cam0_test,pred_j3d_cam0_test,pred_rotmat0_test[:,1,:3,:3],pred_smpltrans0_test)
 pred_vertices_cam1_test_wrt_origin,pred_j3d_cam1_test_wrt_origin,pred_orient1_wrt_origin, pred_trans1_wrt_origin \
-        = transform_smpl(torch.inverse(test_extr1[begin*batch_size:batch_size*(end-begin)]),pred_vertices_cam1_test,pred_j3d_cam1_test,pred_rotmat1_test[begin*batch_size:batch_size*(end-begin),1,:3,:3],pred_smpltrans1_test)
+        = transform_smpl(torch.inverse(test_extr1[begin:end]),pred_vertices_cam1_test,pred_j3d_cam1_test,pred_rotmat1_test[:,1,:3,:3],pred_smpltrans1_test)
     
 # %%
 
 import cv2
 # import random
-# samples = random.sample(range(begin*batch_size,batch_size*(end-begin)),5)
+# samples = random.sample(range(begin,end),5)
 samples = [50,100,150,200,250]
 ims0 = torch.from_numpy(np.stack([cv2.imread(f)[:,:,::-1]/255. for f in images0[samples]])).permute(0,3,1,2)
 ims1 = torch.from_numpy(np.stack([cv2.imread(f)[:,:,::-1]/255. for f in images1[samples]])).permute(0,3,1,2)
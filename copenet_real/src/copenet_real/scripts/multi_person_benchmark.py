@@ -0,0 +1,81 @@
+# %% Imports
+# throughput of the batched multi person path vs one model call per person.
+# The real sequences mostly show one subject, so scenes with P people are emulated by tiling
+# the associated crops of a frame pair P times.
+# usage: python multi_person_benchmark.py <ckpt_path> <datapath> [n_frames] [people_counts]
+import torch
+import numpy as np
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+import time
+import os, sys; sys.path.append(os.path.dirname(os.path.abspath(__file__+"/..")))
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+
+from config import device
+
+from copenet_real.copenet_twoview import copenet_twoview
+from copenet_real.dsets import copenet_real
+from copenet_real.utils.multi_person import multi_person_dataset, collate_multi_person, multi_person_forward
+
+ckpt_path = sys.argv[1]
+datapath = sys.argv[2]
+n_frames = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+people_counts = [int(x) for x in sys.argv[4].split(",")] if len(sys.argv) > 4 else [1,2,4,8,16]
+iters = 3
+
+net = copenet_twoview.load_from_checkpoint(checkpoint_path=ckpt_path)
+net.to(device)
+net.eval()
+
+_, test_ds = copenet_real.get_copenet_real_traintest(datapath,img_res=net.hparams.img_res)
+mp_dl = DataLoader(multi_person_dataset(test_ds), batch_size=1,
+                            num_workers=os.cpu_count()-1,
+                            collate_fn=collate_multi_person,
+                            shuffle=False)
+
+def sync():
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+def tile(batch, n):
+    out = {k:torch.cat([v]*n) for k,v in batch.items() if torch.is_tensor(v)}
+    out["person_idx0"] = torch.arange(out["im0"].shape[0])
+    out["person_idx1"] = torch.arange(out["im0"].shape[0])
+    out["n_people"] = out["im0"].shape[0]
+    return out
+
+# %% time both paths
+detected = []
+t_batched = {p:[] for p in people_counts}
+t_single = {p:[] for p in people_counts}
+with torch.no_grad():
+    for i,batch in enumerate(tqdm(mp_dl)):
+        if i >= n_frames:
+            break
+        detected.append(batch["n_people"])
+        if batch["n_people"] == 0:
+            continue
+        # one person of the frame, tiled to the scene size
+        one = {k:v[:1] if torch.is_tensor(v) and v.dim() > 0 else v for k,v in batch.items()}
+        one["n_people"] = 1
+        for p in people_counts:
+            scene = tile(one, p)
+            sync()
+            t0 = time.time()
+            multi_person_forward(net.model, scene, iters=iters)
+            sync()
+            t_batched[p].append(time.time() - t0)
+
+            sync()
+            t0 = time.time()
+            for row in range(p):
+                multi_person_forward(net.model, {k:v[row:row+1] if torch.is_tensor(v) else 1 for k,v in scene.items()}, iters=iters)
+            sync()
+            t_single[p].append(time.time() - t0)
+
+# %% summary table
+print("frames: {}, detected people per frame pair: mean {:.2f}, max {}".format(len(detected), np.mean(detected), np.max(detected)))
+print("{:>8} {:>20} {:>20} {:>10} {:>16}".format("people","batched (ms/frame)","per person (ms/frame)","speedup","batched / p=1"))
+for p in people_counts:
+    print("{:>8} {:>20.2f} {:>20.2f} {:>10.2f} {:>16.2f}".format(p, 1000*np.median(t_batched[p]), 1000*np.median(t_single[p]),
+                                    np.median(t_single[p])/np.median(t_batched[p]), np.median(t_batched[p])/np.median(t_batched[people_counts[0]])))
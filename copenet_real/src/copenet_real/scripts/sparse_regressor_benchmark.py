@@ -0,0 +1,76 @@
+# %% Imports
+# dense vs sparse (COO) vertex regressors (SMPL-X J_regressor and SMPLX_to_J14) and the skinning with and
+# without the pose corrective blend shapes, at the 2000 frame chunks of the AirPose+ fitting.
+# usage: python sparse_regressor_benchmark.py <copenet_home> [smplx2j14_pkl] [batch_sizes] [n_iters]
+import torch
+import numpy as np
+import pickle as pkl
+import time
+import os, sys; sys.path.append(os.path.dirname(os.path.abspath(__file__+"/..")))
+
+from config import device
+
+from copenet.utils.body_model import get_smplx, ShapeCalibratedSMPLX, sparse_regressor, regress_joints
+from copenet.utils.geometry import rot6d_to_rotmat
+
+copenet_home = sys.argv[1]
+smplx2j14 = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] != "none" else None
+batch_sizes = [int(x) for x in sys.argv[3].split(",")] if len(sys.argv) > 3 else [500,2000]
+n_iters = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+
+smplx = get_smplx(copenet_home, device)
+regressors = {"J_regressor": smplx.J_regressor.float()}
+if smplx2j14 is not None:
+    regressors["SMPLX_to_J14"] = torch.from_numpy(pkl.load(open(smplx2j14,"rb"),encoding="latin1")).float().to(device)
+model = ShapeCalibratedSMPLX(smplx, calib_frames=1).to(device)
+model_fast = ShapeCalibratedSMPLX(smplx, calib_frames=1, pose_blend=False).to(device)
+
+def sync():
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+def timeit(fn):
+    times = []
+    for i in range(n_iters + 2):
+        sync()
+        t0 = time.time()
+        fn()
+        sync()
+        if i >= 2:
+            times.append(time.time() - t0)
+    return np.median(times)
+
+def random_pose(batch_size):
+    pose6d = torch.randn(batch_size,22*6,device=device)*0.2 + torch.tensor([1.,0,0,1,0,0],device=device).repeat(22)
+    return rot6d_to_rotmat(pose6d).view(batch_size,22,3,3)
+
+betas = torch.randn(1,10,device=device)
+with torch.no_grad():
+    # freeze the shape of one subject, as in the fitting where all frames share the betas
+    model.forward("subject", betas, random_pose(1)[:,1:], random_pose(1)[:,:1], pose2rot=False)
+    model_fast.forward("subject", betas, random_pose(1)[:,1:], random_pose(1)[:,:1], pose2rot=False)
+
+# %% regressors
+print("{:>14} {:>6} {:>10} {:>12} {:>12} {:>10} {:>10}".format("regressor","batch","nnz (%)","dense (ms)","sparse (ms)","speedup","max err"))
+for name, dense in regressors.items():
+    sparse = sparse_regressor(dense)
+    for batch_size in batch_sizes:
+        with torch.no_grad():
+            vertices = model.forward("subject", betas.expand(batch_size,-1), random_pose(batch_size)[:,1:],
+                                        random_pose(batch_size)[:,:1], pose2rot=False).vertices
+            err = (regress_joints(dense, vertices) - regress_joints(sparse, vertices)).abs().max().item()
+            t_dense = timeit(lambda: regress_joints(dense, vertices))
+            t_sparse = timeit(lambda: regress_joints(sparse, vertices))
+        print("{:>14} {:>6} {:>10.2f} {:>12.2f} {:>12.2f} {:>10.1f} {:>10.1e}".format(name, batch_size,
+                100*(dense != 0).float().mean().item(), 1000*t_dense, 1000*t_sparse, t_dense/t_sparse, err))
+
+# %% pose corrective blend shapes
+print("{:>6} {:>18} {:>18} {:>10} {:>16}".format("batch","pose blend (ms)","no pose blend (ms)","speedup","max vert err (m)"))
+for batch_size in batch_sizes:
+    rotmat = random_pose(batch_size)
+    kwargs = dict(betas=betas.expand(batch_size,-1), body_pose=rotmat[:,1:], global_orient=rotmat[:,:1], pose2rot=False)
+    with torch.no_grad():
+        err = (model.forward("subject", **kwargs).vertices - model_fast.forward("subject", **kwargs).vertices).norm(dim=-1).max().item()
+        t_full = timeit(lambda: model.forward("subject", **kwargs))
+        t_fast = timeit(lambda: model_fast.forward("subject", **kwargs))
+    print("{:>6} {:>18.2f} {:>18.2f} {:>10.2f} {:>16.3f}".format(batch_size, 1000*t_full, 1000*t_fast, t_full/t_fast, err))
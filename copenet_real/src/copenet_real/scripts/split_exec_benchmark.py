@@ -0,0 +1,60 @@
+# %% Imports
+# bytes exchanged, per iteration round trip latency and end-to-end fps of the split execution
+# runtime (one process per view) on the copenet_real test set, for the queue and socket transports.
+# usage: python split_exec_benchmark.py <ckpt_path> <datapath> [n_frames] [iters] [threads_per_view]
+import torch
+import numpy as np
+from tqdm import tqdm
+import time
+import os, sys; sys.path.append(os.path.dirname(os.path.abspath(__file__+"/..")))
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+
+from copenet_real.copenet_twoview import copenet_twoview
+from copenet_real.dsets import copenet_real
+from copenet.utils.split_exec import run_split_execution
+
+ckpt_path = sys.argv[1]
+datapath = sys.argv[2]
+n_frames = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+iters = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+num_threads = int(sys.argv[5]) if len(sys.argv) > 5 else max(1, os.cpu_count()//2)
+
+if __name__ == "__main__":
+    net = copenet_twoview.load_from_checkpoint(checkpoint_path=ckpt_path, map_location="cpu")
+    net.eval()
+    model_state = {k:v.cpu() for k,v in net.model.state_dict().items()}
+    smpl_mean_params = os.path.join(net.hparams.copenet_home,"src/copenet/data/smpl_mean_params.npz")
+
+    _, test_ds = copenet_real.get_copenet_real_traintest(datapath,img_res=net.hparams.img_res)
+    frames = []
+    for idx in tqdm(range(min(n_frames, len(test_ds))), desc="loading frames"):
+        sample = test_ds[idx]
+        # same input translation as fwd_pass_and_loss with distance scaling
+        in_smpltrans = 0.05*torch.tensor([[0,0,10]]).float()
+        frames.append((sample["im0"].unsqueeze(0), sample["bb0"].unsqueeze(0),
+                        sample["im1"].unsqueeze(0), sample["bb1"].unsqueeze(0),
+                        in_smpltrans, in_smpltrans))
+
+    # single process reference with all threads
+    torch.set_num_threads(2*num_threads)
+    ref = {}
+    with torch.no_grad():
+        t0 = time.time()
+        for frame_id, (x0, bb0, x1, bb1, p0, p1) in enumerate(frames):
+            ref[frame_id] = net.model.forward(x0=x0, x1=x1, bb0=bb0, bb1=bb1,
+                                                init_position0=p0, init_position1=p1, iters=iters)
+        ref_fps = len(frames)/(time.time() - t0)
+
+    results = {}
+    for transport in ["queue", "socket"]:
+        outputs, stats = run_split_execution(model_state, smpl_mean_params, frames,
+                                                transport=transport, iters=iters, num_threads=num_threads)
+        stats["max_dev"] = max([max([(o - r).abs().max().item() for o,r in zip(outputs[k], ref[k])]) for k in ref])
+        results[transport] = stats
+
+    # %% summary table
+    print("frames: {}, iters: {}, threads per view: {}, single process fps: {:.1f}".format(len(frames), iters, num_threads, ref_fps))
+    print("{:>10} {:>16} {:>14} {:>14} {:>8} {:>14}".format("transport","bytes/frame","rtt mean (ms)","rtt p99 (ms)","fps","max deviation"))
+    for transport, stats in results.items():
+        print("{:>10} {:>16.1f} {:>14.3f} {:>14.3f} {:>8.1f} {:>14.2e}".format(transport, stats["bytes_per_frame"],
+                                    1000*stats["rtt_mean"], 1000*stats["rtt_p99"], stats["fps"], stats["max_dev"]))
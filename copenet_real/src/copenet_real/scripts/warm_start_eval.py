@@ -0,0 +1,80 @@
+# %% Imports
+# accuracy and latency of streaming inference on the copenet_real test sequence,
+# 1, 2 and 3 regressor iterations with and without warm start from the previous frame.
+# accuracy is the confidence weighted 2d keypoint error (pixels) of the 22 body joints in both views.
+# usage: python warm_start_eval.py <ckpt_path> <datapath>
+import torch
+import numpy as np
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+import time
+import os, sys; sys.path.append(os.path.dirname(os.path.abspath(__file__+"/..")))
+os.environ["PYOPENGL_PLATFORM"] = 'egl'
+
+from config import device
+
+from copenet_real.copenet_twoview import copenet_twoview
+from copenet_real.dsets import copenet_real
+from copenet_real.utils.body_model import get_smplx
+from copenet_real import constants as CONSTANTS
+from copenet_real.utils.keypoints import project_pred_joints, keypoint_error
+from copenet.utils.streaming import StreamingPredictor
+
+ckpt_path = sys.argv[1]
+datapath = sys.argv[2]
+warmup_frames = 10
+
+net = copenet_twoview.load_from_checkpoint(checkpoint_path=ckpt_path)
+net.to(device)
+net.eval()
+
+smplx = get_smplx(net.hparams.copenet_home, device)
+
+# the test split is one continuous sequence, keep the frame order
+_, test_ds = copenet_real.get_copenet_real_traintest(datapath,img_res=net.hparams.img_res)
+tst_dl = DataLoader(test_ds, batch_size=1,
+                            num_workers=os.cpu_count()-1,
+                            pin_memory=True,
+                            shuffle=False)
+
+configs = [(iters,warm) for warm in [False,True] for iters in [1,2,3]]
+predictors = {c:StreamingPredictor(net.model,iters=c[0],cold_iters=c[0] if not c[1] else 3) for c in configs}
+errors = {c:[] for c in configs}
+latency = {c:[] for c in configs}
+warm_frac = {c:[] for c in configs}
+
+# %% run the sequence
+with torch.no_grad():
+    for i,batch in enumerate(tqdm(tst_dl)):
+        im0 = batch["im0"].float().to(device)
+        im1 = batch["im1"].float().to(device)
+        bb0 = batch["bb0"].float().to(device)
+        bb1 = batch["bb1"].float().to(device)
+        j2d0 = batch["smpl_joints_2d0"][:,0].to(device)
+        j2d1 = batch["smpl_joints_2d1"][:,0].to(device)
+        # a frame without openpose detections in a view means the track is lost
+        valid = ((j2d0[:,:,2].sum(1) > 0) & (j2d1[:,:,2].sum(1) > 0))
+
+        for c in configs:
+            if not c[1]:
+                predictors[c].reset()
+            if device == "cuda":
+                torch.cuda.synchronize()
+            t0 = time.time()
+            pred_pose0, pred_betas0, pred_pose1, pred_betas1 = predictors[c].step(im0, im1, bb0, bb1, valid)
+            if device == "cuda":
+                torch.cuda.synchronize()
+            if i >= warmup_frames:
+                latency[c].append(time.time() - t0)
+            if valid.all():
+                warm_frac[c].append(predictors[c].state["warm"].float().mean().item())
+                err, conf = keypoint_error([project_pred_joints(smplx, pred_pose0, pred_betas0, CONSTANTS.FOCAL_LENGTH0, batch["intr0"].to(device)),
+                                            project_pred_joints(smplx, pred_pose1, pred_betas1, CONSTANTS.FOCAL_LENGTH1, batch["intr1"].to(device))],
+                                            [j2d0, j2d1])
+                errors[c].append(err/max(conf, 1e-9))
+
+# %% summary table
+print("{:>6} {:>6} {:>16} {:>14} {:>12} {:>10}".format("iters","warm","kp error (px)","latency (ms)","fps","warm (%)"))
+for c in configs:
+    print("{:>6} {:>6} {:>16.2f} {:>14.2f} {:>12.1f} {:>10.1f}".format(c[0],str(c[1]),np.mean(errors[c]),
+                                1000*np.mean(latency[c]),1/np.mean(latency[c]),100*np.mean(warm_frac[c])))
@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+import torch
+from pytorch_lightning.plugins import NativeMixedPrecisionPlugin
+
+"""
+Mixed precision of the backbone and regressor. The modules run self.model under autocast
+(autocast_forward) and get its outputs back in fp32, rot6d_to_rotmat, SMPL-X LBS, the projections
+and the losses stay in full precision.
+
+--fp16  float16 autocast of torch.cuda.amp (torch 1.8.1, CUDA only). fp16 gradients of the small
+        losses underflow, the trainer runs with ModelAutocastPrecisionPlugin, lightning's native amp
+        plugin with its dynamic loss scaling (GradScaler) but without its autocast of the whole step.
+--bf16  bfloat16 autocast on CPU or GPU, needs torch.autocast (torch >= 1.10). bf16 has the exponent
+        range of fp32, no loss scaling.
+"""
+
+def amp_dtype(hparams):
+    """ autocast dtype of the --fp16 / --bf16 hparams, None for fp32 """
+    if getattr(hparams, "fp16", False):
+        return torch.float16
+    if getattr(hparams, "bf16", False):
+        return torch.bfloat16
+    return None
+
+
+def autocast_forward(model, dtype, **kwargs):
+    """ model(**kwargs) under autocast to dtype (None runs it in fp32), the outputs in fp32 """
+    if dtype is None:
+        return model(**kwargs)
+    if dtype == torch.float16:
+        with torch.cuda.amp.autocast():
+            outputs = model(**kwargs)
+    else:
+        device_type = next(model.parameters()).device.type
+        with torch.autocast(device_type=device_type, dtype=dtype):
+            outputs = model(**kwargs)
+    return tuple(x.float() for x in outputs)
+
+
+def check_amp_args(parser, args, check_device=True):
+    """
+    parser.error for a --fp16 / --bf16 the installed torch or the machine cannot run,
+    check_device=False where the training runs on another machine (cluster submission)
+    """
+    if getattr(args, "bf16", False) and not hasattr(torch, "autocast"):
+        parser.error("--bf16 needs torch >= 1.10 (torch.autocast), found torch {}, use --fp16".format(torch.__version__))
+    if getattr(args, "fp16", False):
+        if check_device and not torch.cuda.is_available():
+            parser.error("--fp16 needs a CUDA device")
+        if str(getattr(args, "precision", 32)) != "32":
+            parser.error("--fp16 already scales the losses, leave --precision at 32")
+
+
+class ModelAutocastPrecisionPlugin(NativeMixedPrecisionPlugin):
+    """ loss scaling of lightning's native fp16 amp, the autocast is left to autocast_forward """
+    def __init__(self):
+        super().__init__(precision=16, device="cuda")
+
+    @contextmanager
+    def forward_context(self):
+        yield
+
+
+def amp_trainer_kwargs(args):
+    """ Trainer arguments of --fp16 / --bf16 """
+    if getattr(args, "fp16", False):
+        return {"plugins": [ModelAutocastPrecisionPlugin()]}
+    return {}
@@ -0,0 +1,137 @@
+import os
+import collections
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from ..smplx.smplx import SMPLX
+from .geometry import batch_rodrigues
+
+"""
+One SMPL-X body model per device, usable with any batch size. SMPLX keeps its default parameters
+(expression, hand, jaw and eye poses, ...) with batch_size rows and fails for any other batch
+size, so the model is created with batch_size=1 and the defaults of the parameters which are
+not passed are expanded to the batch size of the call. JointsOnlySMPLX only poses the joints,
+for the consumers which never look at the vertices.
+"""
+
+NUM_BODY_JOINTS = 22
+
+SMPLX_PARAMS = ["betas", "global_orient", "body_pose", "left_hand_pose", "right_hand_pose",
+                    "jaw_pose", "leye_pose", "reye_pose", "expression", "transl"]
+
+_instances = {}
+
+
+class SMPLXAnyBatch(SMPLX):
+    def __init__(self, model_path, **kwargs):
+        kwargs["batch_size"] = 1
+        super(SMPLXAnyBatch, self).__init__(model_path, **kwargs)
+
+    def forward(self, **kwargs):
+        given = [kwargs[k] for k in SMPLX_PARAMS if torch.is_tensor(kwargs.get(k))]
+        batch_size = max([v.shape[0] for v in given]) if len(given) > 0 else 1
+        for k in SMPLX_PARAMS:
+            default = getattr(self, k, None)
+            if kwargs.get(k) is None and torch.is_tensor(default):
+                kwargs[k] = default[:1].expand(batch_size, *default.shape[1:]).contiguous()
+        # anything in SMPLX still sized by self.batch_size follows the call
+        self.batch_size = batch_size
+        return super(SMPLXAnyBatch, self).forward(**kwargs)
+
+
+def get_smplx(copenet_home, device, create_transl=False):
+    """ shared SMPLXAnyBatch of the model in copenet_home, created once per device """
+    model_path = os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx")
+    key = (model_path, str(device), create_transl)
+    if key not in _instances:
+        _instances[key] = SMPLXAnyBatch(model_path, create_transl=create_transl).to(device)
+    return _instances[key]
+
+
+BodyOutput = collections.namedtuple("BodyOutput", ["vertices", "joints"])
+
+
+def posed_joints(rot_mats, joints, parents):
+    """
+    posed joints [B,J,3] of the rest pose joints [B,J,3] with the relative rotations [B,J,3,3].
+    Only rotations and positions are chained, no 4x4 transforms and no skinning transforms
+    """
+    parents = parents.tolist()
+    rel_joints = joints[:,1:] - joints[:,parents[1:]]
+    rots = [rot_mats[:,0]]
+    posed = [joints[:,0]]
+    for i in range(1,len(parents)):
+        posed.append(posed[parents[i]] + torch.matmul(rots[parents[i]],rel_joints[:,i-1].unsqueeze(-1)).squeeze(-1))
+        rots.append(torch.matmul(rots[parents[i]],rot_mats[:,i]))
+    return torch.stack(posed,dim=1)
+
+
+class JointsOnlySMPLX(nn.Module):
+    """
+    Forward kinematics of the first num_joints SMPL-X joints without any vertex: the shape blend
+    shapes are applied to the joint regressor (J_regressor @ shapedirs) and the rest joints are
+    posed along the kinematic chain. For the same betas and body pose the joints are those of the
+    full model at [:num_joints]. Jaw and eyes (num_joints up to 25) stay at their zero default pose,
+    the hand joints would depend on the hand pose and are not supported.
+    """
+    def __init__(self, smplx, num_joints=NUM_BODY_JOINTS):
+        super(JointsOnlySMPLX, self).__init__()
+        assert num_joints <= NUM_BODY_JOINTS + 3, "only the body, jaw and eye joints"
+        self.num_joints = num_joints
+        num_betas = getattr(smplx, "num_betas", 10)
+        with torch.no_grad():
+            shapedirs = smplx.shapedirs[:,:,:num_betas]
+            J_regressor = smplx.J_regressor[:num_joints]
+        self.register_buffer("parents", smplx.parents[:num_joints].clone())
+        self.register_buffer("J_template", torch.matmul(J_regressor, smplx.v_template))
+        self.register_buffer("J_shapedirs", torch.einsum("jv,vkl->jkl", J_regressor, shapedirs))
+
+    def rot_mats(self, body_pose, global_orient, pose2rot=True):
+        """ [B,num_joints,3,3] relative rotations, identity past the body """
+        batch_size = body_pose.shape[0]
+        if pose2rot:
+            body_pose = batch_rodrigues(body_pose.reshape(-1,3)).view(batch_size,-1,3,3)
+            global_orient = batch_rodrigues(global_orient.reshape(-1,3)).view(batch_size,1,3,3)
+        rot_mats = torch.cat([global_orient.reshape(batch_size,1,3,3), body_pose.reshape(batch_size,-1,3,3)],dim=1)
+        if self.num_joints > NUM_BODY_JOINTS:
+            eye = torch.eye(3).type_as(rot_mats).expand(batch_size,self.num_joints-NUM_BODY_JOINTS,3,3)
+            rot_mats = torch.cat([rot_mats,eye],dim=1)
+        return rot_mats
+
+    def rest_joints(self, betas):
+        return self.J_template + torch.einsum("bl,jkl->bjk", betas, self.J_shapedirs)
+
+    def forward(self, betas=None, body_pose=None, global_orient=None, transl=None, pose2rot=True, **kwargs):
+        """ same arguments as SMPLX.forward for the body, returns vertices None and joints [B,num_joints,3] """
+        rot_mats = self.rot_mats(body_pose, global_orient, pose2rot)
+        if betas is None:
+            betas = torch.zeros(rot_mats.shape[0],self.J_shapedirs.shape[2]).type_as(rot_mats)
+        joints = posed_joints(rot_mats, self.rest_joints(betas), self.parents)
+        if transl is not None:
+            joints = joints + transl.unsqueeze(1)
+        return BodyOutput(None, joints)
+
+
+def get_smplx_joints(copenet_home, device, num_joints=NUM_BODY_JOINTS):
+    """ shared JointsOnlySMPLX of the model in copenet_home, created once per device """
+    key = ("joints", os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"), str(device), num_joints)
+    if key not in _instances:
+        _instances[key] = JointsOnlySMPLX(get_smplx(copenet_home, device), num_joints).to(device)
+    return _instances[key]
+
+
+def checkpointed_forward(body_model, betas, body_pose, global_orient, transl, pose2rot=False):
+    """
+    body_model.forward with activation checkpointing, only the inputs are kept for the backward and
+    the skinning is recomputed there. Without autograd it is the plain forward.
+    """
+    def run(betas, body_pose, global_orient, transl):
+        out = body_model.forward(betas=betas, body_pose=body_pose, global_orient=global_orient,
+                                    transl=transl, pose2rot=pose2rot)
+        return tuple(x for x in (out.vertices, out.joints) if x is not None)
+    if torch.is_grad_enabled() and any(x.requires_grad for x in (betas, body_pose, global_orient)):
+        outputs = checkpoint(run, betas, body_pose, global_orient, transl)
+    else:
+        outputs = run(betas, body_pose, global_orient, transl)
+    return BodyOutput(*outputs) if len(outputs) == 2 else BodyOutput(None, outputs[0])
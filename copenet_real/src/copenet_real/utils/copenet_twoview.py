@@ -20,6 +20,8 @@ from .dsets import aerialpeople, copenet_real
 import cv2
 import torchvision
 from .smplx.smplx import SMPLX, lbs
+from .body_model import get_smplx
+from .metrics import LossAggregator, mean_losses
 import pickle as pk
 from .utils.renderer import Renderer
 from . import constants as CONSTANTS
@@ -35,19 +37,10 @@ from human_body_prior.models.vposer_model import VPoser
 vp_model = load_model("/ps/scratch/common/vposer/V02_05", model_code=VPoser,remove_words_in_model_weights="vp_model.")[0]
 
 smplx = None
-smplx_test = None
-
-def create_smplx(copenet_home,train_batch_size,val_batch_size):
-    global smplx 
-    smplx = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=train_batch_size,
-                         create_transl=False)
-
-    global smplx_test 
-    smplx_test = SMPLX(os.path.join(copenet_home,"src/copenet/data/smplx/models/smplx"),
-                         batch_size=val_batch_size,
-                         create_transl=False)
 
+def create_smplx(copenet_home):
+    global smplx
+    smplx = get_smplx(copenet_home, device)
 
 
 
@@ -57,12 +50,11 @@ class copenet_twoview(pl.LightningModule):
         super(copenet_twoview, self).__init__()
         # not the best model...
         self.hparams = hparams
+        self.train_losses = LossAggregator()
         self.model = model_copenet.getcopenet(os.path.join(self.hparams.copenet_home,"src/copenet/data/smpl_mean_params.npz"))
 
-        create_smplx(self.hparams.copenet_home,self.hparams.batch_size,self.hparams.val_batch_size)
+        create_smplx(self.hparams.copenet_home)
         
-        smplx.to(device)
-        smplx_test.to(device)
         vp_model.to(device)
 
         smplx_hand_idx = pk.load(open(os.path.join(self.hparams.copenet_home,"src/copenet/data/smplx/MANO_SMPLX_vertex_ids.pkl"),'rb'))
@@ -140,11 +132,11 @@ class copenet_twoview(pl.LightningModule):
 
         loss *= 60
 
-        losses = {'loss': loss.detach().item(),
-                  'loss_regul_vposer': loss_regul_vposer.detach().item(),
-                  'loss_regr_pose': loss_regr_pose.detach().item(),
-                  'loss_keypoints': loss_keypoints.detach().item(),
-                  'loss_regul_betas': loss_regul_betas.detach().item()}
+        losses = {'loss': loss.detach(),
+                  'loss_regul_vposer': loss_regul_vposer.detach(),
+                  'loss_regr_pose': loss_regr_pose.detach(),
+                  'loss_keypoints': loss_keypoints.detach(),
+                  'loss_regul_betas': loss_regul_betas.detach()}
 
         return loss, losses
 
@@ -213,7 +205,7 @@ class copenet_twoview(pl.LightningModule):
         # #################################
         
         if is_val or is_test:
-            pred_output_cam0 = smplx_test.forward(betas=pred_betas0, 
+            pred_output_cam0 = smplx.forward(betas=pred_betas0, 
                                     body_pose=pred_rotmat0[:,1:],
                                     global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -224,7 +216,7 @@ class copenet_twoview(pl.LightningModule):
                                                 pred_output_cam0.vertices.squeeze(1),
                                                 pred_output_cam0.joints.squeeze(1))
 
-            pred_output_cam1 = smplx_test.forward(betas=pred_betas1, 
+            pred_output_cam1 = smplx.forward(betas=pred_betas1, 
                                     body_pose=pred_rotmat1[:,1:],
                                     global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                     transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -235,7 +227,7 @@ class copenet_twoview(pl.LightningModule):
                                                 pred_output_cam1.vertices.squeeze(1),
                                                 pred_output_cam1.joints.squeeze(1))
             if is_test:
-                pred_output_cam_in0 = smplx_test.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas0), 
+                pred_output_cam_in0 = smplx.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas0), 
                                         body_pose=pred_rotmat0[:,1:],
                                         global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                         transl = torch.zeros(batch_size,3).float().type_as(pred_betas0),
@@ -246,7 +238,7 @@ class copenet_twoview(pl.LightningModule):
                                                     pred_output_cam_in0.vertices.squeeze(1),
                                                     pred_output_cam_in0.joints.squeeze(1))
 
-                pred_output_cam_in1 = smplx_test.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas1), 
+                pred_output_cam_in1 = smplx.forward(betas=torch.zeros(batch_size,10).float().type_as(pred_betas1), 
                                         body_pose=pred_rotmat1[:,1:],
                                         global_orient=torch.eye(3,device=self.device).float().unsqueeze(0).repeat(batch_size,1,1).unsqueeze(1),
                                         transl = torch.zeros(batch_size,3).float().type_as(pred_betas1),
@@ -372,6 +364,7 @@ class copenet_twoview(pl.LightningModule):
                 param.requires_grad = True
         
         output, losses, loss = self.fwd_pass_and_loss(batch,is_val=False, is_test=False)
+        self.train_losses.update(losses)
 
         with torch.no_grad():
         # logging
@@ -379,7 +372,7 @@ class copenet_twoview(pl.LightningModule):
                 train_summ_pred_image, train_summ_in_image = self.summaries(batch, output, losses, is_test=False)
                 self.logger.experiment.add_image('train_pred_shape_cam', train_summ_pred_image, self.global_step)
                 self.logger.experiment.add_image('train_input_images',train_summ_in_image, self.global_step)
-                for loss_name, val in losses.items():
+                for loss_name, val in self.train_losses.compute().items():
                     self.logger.experiment.add_scalar(loss_name + '/train', val, self.global_step)
 
         return {"loss" : loss}
@@ -399,11 +392,7 @@ class copenet_twoview(pl.LightningModule):
         return {'val_losses': losses,"val_loss":loss}
 
     def validation_epoch_end(self, outputs):
-        for loss_name, val in outputs[0]["val_losses"].items():
-            val_list = []
-            for x in outputs:
-                val_list.append(x["val_losses"][loss_name])
-            mean_val = np.mean(val_list)
+        for loss_name, mean_val in mean_losses([x["val_losses"] for x in outputs]).items():
             self.logger.experiment.add_scalar(loss_name + '/val', mean_val, self.global_step)
         return {"val_loss":outputs[0]["val_loss"]}
 
@@ -420,25 +409,25 @@ class copenet_twoview(pl.LightningModule):
 
     def train_dataloader(self):
         # REQUIRED
-        train_dset, _ = copenet_real.get_copenet_real_traintest(self.hparams.datapath)
+        train_dset, _ = copenet_real.get_copenet_real_traintest(self.hparams.datapath,img_res=self.hparams.img_res)
         return DataLoader(train_dset, batch_size=self.hparams.batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
                             shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            drop_last=False)
 
     def val_dataloader(self):
         # OPTIONAL
-        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath)
+        _, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,img_res=self.hparams.img_res)
         return DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                             num_workers=self.hparams.num_workers,
                             pin_memory=self.hparams.pin_memory,
                             shuffle=self.hparams.shuffle_train,
-                            drop_last=True)
+                            drop_last=False)
 
     def summaries(self, input_batch,output, losses, is_test):
         batch_size = input_batch['im0'].shape[0]
-        skip_factor = 4    # number of samples to be logged
+        skip_factor = min(4,batch_size)    # number of samples to be logged
         img_downsize_factor = 2
         
         
@@ -506,17 +495,17 @@ class copenet_twoview(pl.LightningModule):
                                 pin_memory=self.hparams.pin_memory,
                                 drop_last=False)
         else:
-            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath)
+            train_dset, val_dset = copenet_real.get_copenet_real_traintest(self.hparams.datapath,img_res=self.hparams.img_res)
             train_dloader = DataLoader(train_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
             test_dloader = DataLoader(val_dset, batch_size=self.hparams.val_batch_size,
                                         num_workers=self.hparams.num_workers,
                                         pin_memory=self.hparams.pin_memory,
                                         shuffle=False,
-                                        drop_last=True)
+                                        drop_last=False)
 
             return [test_dloader, train_dloader]
 
@@ -534,34 +523,34 @@ class copenet_twoview(pl.LightningModule):
 
     def test_epoch_end(self, outputs):
         # OPTIONAL
-        test_err_smpltrans0 = np.array([(x["output"]["pred_smpltrans0"] - 
+        test_err_smpltrans0 = np.concatenate([(x["output"]["pred_smpltrans0"] - 
             x["output"]["gt_smpltrans0"]).cpu().numpy() for x in outputs[0]]).reshape(-1,3)
-        test_err_smplangles0 = np.array([(x["output"]["pred_angles0"] - 
+        test_err_smplangles0 = np.concatenate([(x["output"]["pred_angles0"] - 
             x["output"]["gt_angles0"]).cpu().numpy() for x in outputs[0]]).reshape(-1,22,3)
 
         mean_test_err_smpltrans0 = np.mean(np.sqrt(np.sum(test_err_smpltrans0**2,1)))
         mean_test_err_smplangles0 = np.mean(np.sqrt(np.sum(test_err_smplangles0**2,2)))
 
-        test_err_smpltrans1 = np.array([(x["output"]["pred_smpltrans1"] - 
+        test_err_smpltrans1 = np.concatenate([(x["output"]["pred_smpltrans1"] - 
             x["output"]["gt_smpltrans1"]).cpu().numpy() for x in outputs[0]]).reshape(-1,3)
-        test_err_smplangles1 = np.array([(x["output"]["pred_angles1"] - 
+        test_err_smplangles1 = np.concatenate([(x["output"]["pred_angles1"] - 
             x["output"]["gt_angles1"]).cpu().numpy() for x in outputs[0]]).reshape(-1,22,3)
 
         mean_test_err_smpltrans1 = np.mean(np.sqrt(np.sum(test_err_smpltrans1**2,1)))
         mean_test_err_smplangles1 = np.mean(np.sqrt(np.sum(test_err_smplangles1**2,2)))
 
 
-        train_err_smpltrans0 = np.array([(x["output"]["pred_smpltrans0"] - 
+        train_err_smpltrans0 = np.concatenate([(x["output"]["pred_smpltrans0"] - 
             x["output"]["gt_smpltrans0"]).cpu().numpy() for x in outputs[1]]).reshape(-1,3)
-        train_err_smplangles0 = np.array([(x["output"]["pred_angles0"] - 
+        train_err_smplangles0 = np.concatenate([(x["output"]["pred_angles0"] - 
             x["output"]["gt_angles0"]).cpu().numpy() for x in outputs[1]]).reshape(-1,22,3)
 
         mean_train_err_smpltrans0 = np.mean(np.sqrt(np.sum(train_err_smpltrans0**2,1)))
         mean_train_err_smplangles0 = np.mean(np.sqrt(np.sum(train_err_smplangles0**2,2)))
 
-        train_err_smpltrans1 = np.array([(x["output"]["pred_smpltrans1"] - 
+        train_err_smpltrans1 = np.concatenate([(x["output"]["pred_smpltrans1"] - 
             x["output"]["gt_smpltrans1"]).cpu().numpy() for x in outputs[1]]).reshape(-1,3)
-        train_err_smplangles1 = np.array([(x["output"]["pred_angles1"] - 
+        train_err_smplangles1 = np.concatenate([(x["output"]["pred_angles1"] - 
             x["output"]["gt_angles1"]).cpu().numpy() for x in outputs[1]]).reshape(-1,22,3)
 
         mean_train_err_smpltrans1 = np.mean(np.sqrt(np.sum(train_err_smpltrans1**2,1)))
@@ -0,0 +1,30 @@
+import os
+import torch
+
+"""
+Data-parallel training over several processes and nodes with the Lightning DDP strategy. Lightning
+starts one process per device (--devices on each of --num_nodes nodes, rendezvous at MASTER_ADDR,
+MASTER_PORT with NODE_RANK per node), sets LOCAL_RANK, adds a DistributedSampler to every dataloader
+and averages the gradients. The gloo backend also runs on CPU-only clusters.
+"""
+
+def local_rank():
+    return int(os.environ.get("LOCAL_RANK", 0))
+
+
+def process_device(device):
+    """ device of this process for the module globals (SMPL-X, VPoser): its own GPU when several
+    processes share the GPUs of a node, the CPU when there is no CUDA """
+    if str(device).startswith("cuda") and torch.cuda.is_available():
+        return torch.device("cuda", local_rank())
+    return torch.device("cpu")
+
+
+def ddp_trainer_kwargs(args, gpus):
+    """ Trainer arguments of the trainer scripts: gpus without --strategy ddp*, otherwise the
+    devices come from --accelerator, --devices and --num_nodes """
+    if args.strategy is None or not str(args.strategy).startswith("ddp"):
+        return {"gpus": gpus}
+    # read by lightning when the process group is created
+    os.environ["PL_TORCH_DISTRIBUTED_BACKEND"] = args.dist_backend
+    return {}
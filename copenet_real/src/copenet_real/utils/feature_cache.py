@@ -0,0 +1,93 @@
+import os
+import json
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+"""
+Backbone feature cache for training the regressor head (fc1, fc2, dec*) with a frozen feature
+extractor. forward_feat_ext runs once over the (deterministically preprocessed) dataset, the 2048-d
+features of both views and the fields the losses need are stored as .npy files in cache_dir and
+memory-mapped by FeatureCacheDataset, so the head trains without loading a single image.
+"""
+
+# fields of the copenet_real samples used by fwd_pass_and_loss and get_loss besides the images
+CACHE_FIELDS = ["bb0","bb1","intr0","intr1","smpl_joints_2d0","smpl_joints_2d1","crop_info0","crop_info1"]
+PATH_FIELDS = ["im0_path","im1_path"]
+
+
+def build_feature_cache(model, dset, cache_dir, key=None, batch_size=64, num_workers=8):
+    """
+    model: network with forward_feat_ext, run in eval mode (BatchNorm running statistics)
+    key: json-able description of the data and weights the cache was built from, see load_feature_cache
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    dloader = DataLoader(dset, batch_size=batch_size, num_workers=num_workers, shuffle=False, drop_last=False)
+    device = next(model.parameters()).device
+    was_training = model.training
+    model.eval()
+
+    n = len(dset)
+    arrays = {}
+    paths = {k:[] for k in PATH_FIELDS}
+    start = 0
+    with torch.no_grad():
+        for batch in dloader:
+            fields = {"xf0": model.forward_feat_ext(batch["im0"].float().to(device)),
+                        "xf1": model.forward_feat_ext(batch["im1"].float().to(device))}
+            fields.update({k:batch[k] for k in CACHE_FIELDS})
+            for k, v in fields.items():
+                v = v.cpu().numpy()
+                if k not in arrays:
+                    arrays[k] = np.lib.format.open_memmap(os.path.join(cache_dir,k+".npy"), mode="w+",
+                                                            dtype=v.dtype, shape=(n,)+v.shape[1:])
+                arrays[k][start:start+v.shape[0]] = v
+            for k in PATH_FIELDS:
+                paths[k] += list(batch[k])
+            start += fields["xf0"].shape[0]
+            print("feature cache: {}/{}".format(start, n), end="\r")
+    model.train(was_training)
+
+    for v in arrays.values():
+        v.flush()
+    # written last, a cache without meta.json is incomplete and gets rebuilt
+    json.dump({"n":n, "key":key, "fields":list(arrays.keys()), "paths":paths},
+                open(os.path.join(cache_dir,"meta.json"),"w"))
+    return FeatureCacheDataset(cache_dir)
+
+
+def cache_key(hparams, dset):
+    """ data and backbone weights a cache of dset is built from """
+    return {"datapath": hparams.datapath,
+            "img_res": hparams.img_res,
+            "n": len(dset),
+            "weights": hparams.pretrained_checkpoint}
+
+
+def load_feature_cache(cache_dir, key=None):
+    """ FeatureCacheDataset of cache_dir, None if there is no complete cache built with the same key """
+    meta_file = os.path.join(cache_dir,"meta.json")
+    if not os.path.exists(meta_file):
+        return None
+    if json.load(open(meta_file,"r"))["key"] != key:
+        print("feature cache in {} was built for different data or weights".format(cache_dir))
+        return None
+    return FeatureCacheDataset(cache_dir)
+
+
+class FeatureCacheDataset(Dataset):
+    """ samples with the backbone features xf0, xf1 in place of the images im0, im1 """
+    def __init__(self, cache_dir):
+        super().__init__()
+        meta = json.load(open(os.path.join(cache_dir,"meta.json"),"r"))
+        self.n = meta["n"]
+        self.paths = meta["paths"]
+        self.arrays = {k:np.load(os.path.join(cache_dir,k+".npy"), mmap_mode="r") for k in meta["fields"]}
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, idx):
+        sample = {k:torch.from_numpy(np.array(v[idx])) for k,v in self.arrays.items()}
+        sample.update({k:v[idx] for k,v in self.paths.items()})
+        return sample
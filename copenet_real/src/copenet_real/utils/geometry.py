@@ -52,7 +52,19 @@ def rot6d_to_rotmat(x):
     Output:
         (B,3,3) Batch of corresponding rotation matrices
     """
-    x = x.reshape(-1,3,2)
+    # fp32 also under autocast (utils/amp.py), the Gram-Schmidt of fp16/bf16 vectors is far from orthonormal
+    if torch.is_autocast_enabled():
+        with torch.cuda.amp.autocast(enabled=False):
+            return rot6d_gram_schmidt(x)
+    # cpu autocast (bf16) only exists from torch 1.10
+    if hasattr(torch, "is_autocast_cpu_enabled") and torch.is_autocast_cpu_enabled():
+        with torch.autocast(device_type="cpu", enabled=False):
+            return rot6d_gram_schmidt(x)
+    return rot6d_gram_schmidt(x)
+
+def rot6d_gram_schmidt(x):
+    """ fp32 Gram-Schmidt of rot6d_to_rotmat """
+    x = x.float().reshape(-1,3,2)
     a1 = x[:, :, 0]
     a2 = x[:, :, 1]
     b1 = F.normalize(a1)
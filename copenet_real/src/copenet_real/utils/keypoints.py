@@ -0,0 +1,48 @@
+import torch
+
+from .body_model import NUM_BODY_JOINTS
+from .utils import transform_smpl
+from .geometry import perspective_projection, rot6d_to_rotmat
+
+"""
+2D keypoint error of the predictions, the accuracy measure of the evaluation scripts and of the
+loss weight sweep (comparable across loss weights, unlike the loss): distances in pixels between
+the projected predicted joints and the keypoints, weighted by the keypoint confidences.
+"""
+
+def project_pred_joints(smplx, pred_pose, pred_betas, focal_length, intr):
+    """
+    [B,J,2] image coordinates of the joints of a copenet prediction, pred_pose [B,3+22*6] is the
+    camera frame translation and the 6d rotations, intr [B,3,3] the camera intrinsics
+    """
+    device = pred_pose.device
+    pred_rotmat = rot6d_to_rotmat(pred_pose[:,3:]).view(-1, 22, 3, 3)
+    out = smplx.forward(betas=pred_betas,
+                        body_pose=pred_rotmat[:,1:],
+                        global_orient=torch.eye(3,device=device).float().unsqueeze(0).unsqueeze(1),
+                        transl=torch.zeros(1,3).float().to(device),
+                        pose2rot=False)
+    transf_mat = torch.cat([pred_rotmat[:,0], pred_pose[:,:3].unsqueeze(2)],dim=2)
+    _, pred_joints, _, _ = transform_smpl(transf_mat, out.vertices, out.joints)
+    return perspective_projection(pred_joints,
+                                    rotation=torch.eye(3).float().unsqueeze(0).to(device),
+                                    translation=torch.zeros(1,3).float().to(device),
+                                    focal_length=focal_length,
+                                    camera_center=intr[:,:2,2])
+
+
+def keypoint_error(pred_j2d, gt_j2d, num_joints=NUM_BODY_JOINTS):
+    """
+    confidence weighted 2D error of the first num_joints joints over the views
+    pred_j2d: [B,J,2] predicted joints of every view
+    gt_j2d: [B,J,3] keypoints of every view, the confidence last
+    returns the confidence weighted sum of the distances and the sum of the confidences, their
+    ratio is the mean error in pixels (sums, so that batches can be accumulated)
+    """
+    err = 0.
+    conf = 0.
+    for pred, gt in zip(pred_j2d, gt_j2d):
+        dist = torch.norm(pred[:,:num_joints] - gt[:,:num_joints,:2], dim=-1)
+        err += (dist*gt[:,:num_joints,2]).sum().item()
+        conf += gt[:,:num_joints,2].sum().item()
+    return err, conf
@@ -0,0 +1,42 @@
+import torch
+
+"""
+Loss aggregation without host syncs in the training loop: the loss terms stay tensors on the
+device, running sums are updated every step and copied to the host only when they are logged,
+all of them in one transfer.
+"""
+
+class LossAggregator(object):
+    """ running sums of the loss terms of the steps since the last compute() """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sums = {}
+        self.count = 0
+
+    def update(self, losses):
+        with torch.no_grad():
+            for k, v in losses.items():
+                v = torch.as_tensor(v).detach()
+                self.sums[k] = self.sums[k] + v if k in self.sums else v.clone()
+        self.count += 1
+
+    def compute(self, reset=True):
+        """ means since the last reset as python floats, one device to host copy """
+        if self.count == 0:
+            return {}
+        names = list(self.sums.keys())
+        with torch.no_grad():
+            means = (torch.stack([self.sums[k].float() for k in names])/self.count).tolist()
+        if reset:
+            self.reset()
+        return dict(zip(names, means))
+
+
+def mean_losses(loss_dicts):
+    """ means of a list of loss dicts (the validation outputs) in a single reduction """
+    names = list(loss_dicts[0].keys())
+    with torch.no_grad():
+        means = torch.stack([torch.stack([torch.as_tensor(x[k]).float() for k in names]) for x in loss_dicts]).mean(0).tolist()
+    return dict(zip(names, means))
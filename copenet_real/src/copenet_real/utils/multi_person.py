@@ -0,0 +1,171 @@
+import torch
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from torch.utils.data import Dataset
+
+from .utils import resize_with_pad
+from .. import constants as CONSTANTS
+
+"""
+Multi person inference for a frame pair: crop every detected person in both views, associate
+the people across the views, run all crops of a batch of frame pairs through the model at once
+and scatter the results back per person.
+"""
+
+def crop_person(img, j2d, intr, img_res=CONSTANTS.IMG_RES, normalize=None, border_buffer=50):
+    """
+    crop one person around its confident 2d keypoints as the single person datasets do.
+    Returns the normalized crop, bb [cx, cy, s] and crop_info [[ymin, xmin],[ymax, xmax]].
+    """
+    kps = j2d[j2d[:,2] != 0]
+    if len(kps) == 0:
+        kps = np.zeros([1,3])
+    xmin = max(int(np.min(kps[:,0]) - border_buffer), 0)
+    ymin = max(int(np.min(kps[:,1]) - border_buffer), 0)
+    xmax = min(int(np.max(kps[:,0]) + border_buffer), img.shape[1])
+    ymax = min(int(np.max(kps[:,1]) + border_buffer), img.shape[0])
+
+    im, s, _ = resize_with_pad(img[ymin:ymax,xmin:xmax,:], size=img_res)
+    # crop geometry stays in IMG_RES pixel units for any input resolution
+    s = s*CONSTANTS.IMG_RES/img_res
+    im = torch.from_numpy(im.transpose(2,0,1).copy()).float()
+    if normalize is not None:
+        im = normalize(im)
+    bb = torch.tensor([(xmin+xmax)/2, (ymin+ymax)/2]).float()/torch.from_numpy(intr[:2,2]).float() - 1
+    bb = torch.cat([bb, torch.tensor([s]).float()])
+    crop_info = torch.tensor([[ymin, xmin],[ymax, xmax]]).int()
+    return im, bb, crop_info
+
+
+def fundamental_matrix(intr0, intr1, extr0, extr1):
+    """ F with x1^T F x0 = 0, extr are 4x4 world to camera transforms """
+    R = extr1[:3,:3] @ extr0[:3,:3].T
+    t = extr1[:3,3] - R @ extr0[:3,3]
+    tx = np.array([[0, -t[2], t[1]], [t[2], 0, -t[0]], [-t[1], t[0], 0]])
+    return np.linalg.inv(intr1).T @ tx @ R @ np.linalg.inv(intr0)
+
+
+def epipolar_cost(j2d0, j2d1, F):
+    """ mean symmetric epipolar distance (pixels) over the keypoints confident in both views """
+    conf = (j2d0[:,2] != 0) & (j2d1[:,2] != 0)
+    if conf.sum() == 0:
+        return np.inf
+    x0 = np.concatenate([j2d0[conf,:2], np.ones([conf.sum(),1])], 1)
+    x1 = np.concatenate([j2d1[conf,:2], np.ones([conf.sum(),1])], 1)
+    l1 = x0 @ F.T
+    l0 = x1 @ F
+    d = np.abs(np.sum(x1*l1, 1))
+    return np.mean(d/np.linalg.norm(l1[:,:2], axis=1).clip(1e-9) + d/np.linalg.norm(l0[:,:2], axis=1).clip(1e-9))/2
+
+
+def associate_people(people0, people1, intr0, intr1, extr0=None, extr1=None, max_cost=100):
+    """
+    match people (lists of [J,3] keypoints with confidence) across the two views.
+    Uses the epipolar distance of the keypoints when the extrinsics are known, otherwise the
+    distance of the keypoint centroids in normalized image coordinates, then an optimal assignment.
+    Returns a list of (index in people0, index in people1).
+    """
+    if len(people0) == 0 or len(people1) == 0:
+        return []
+    cost = np.zeros([len(people0), len(people1)])
+    if extr0 is not None and extr1 is not None:
+        F = fundamental_matrix(intr0, intr1, np.array(extr0), np.array(extr1))
+        for i, p0 in enumerate(people0):
+            for j, p1 in enumerate(people1):
+                cost[i,j] = epipolar_cost(p0, p1, F)
+    else:
+        for i, p0 in enumerate(people0):
+            for j, p1 in enumerate(people1):
+                c0 = (p0[p0[:,2] != 0,:2].mean(0) - intr0[:2,2])/intr0[:2,2]
+                c1 = (p1[p1[:,2] != 0,:2].mean(0) - intr1[:2,2])/intr1[:2,2]
+                cost[i,j] = np.linalg.norm(c0 - c1)
+        max_cost = np.inf
+    cost[~np.isfinite(cost)] = 1e9
+    rows, cols = linear_sum_assignment(cost)
+    return [(i, j) for i, j in zip(rows, cols) if cost[i,j] < max_cost]
+
+
+def make_multi_person_sample(imgs, people, intrs, extrs=None, img_res=CONSTANTS.IMG_RES, normalize=None, max_cost=100):
+    """
+    imgs: the two full images, people: per view list of [J,3] keypoints, intrs/extrs: per view matrices.
+    Returns a dict with one row per associated person: im0/im1 crops, bb0/bb1, crop_info0/1,
+    smpl_joints_2d0/1 and the person index in each view.
+    """
+    if extrs is None:
+        extrs = [None, None]
+    pairs = associate_people(people[0], people[1], intrs[0], intrs[1], extrs[0], extrs[1], max_cost)
+    sample = {"im0":[], "im1":[], "bb0":[], "bb1":[], "crop_info0":[], "crop_info1":[],
+                "smpl_joints_2d0":[], "smpl_joints_2d1":[], "person_idx0":[], "person_idx1":[]}
+    for pair in pairs:
+        for v in range(2):
+            im, bb, crop_info = crop_person(imgs[v], people[v][pair[v]], intrs[v], img_res, normalize)
+            sample["im"+str(v)].append(im)
+            sample["bb"+str(v)].append(bb)
+            sample["crop_info"+str(v)].append(crop_info)
+            sample["smpl_joints_2d"+str(v)].append(torch.from_numpy(people[v][pair[v]]).float())
+            sample["person_idx"+str(v)].append(pair[v])
+    if len(pairs) == 0:
+        return {"n_people":0}
+    sample = {k:torch.stack(v) if torch.is_tensor(v[0]) else torch.tensor(v) for k,v in sample.items()}
+    sample["n_people"] = len(pairs)
+    sample["intr0"] = torch.from_numpy(intrs[0]).float()
+    sample["intr1"] = torch.from_numpy(intrs[1]).float()
+    return sample
+
+
+class multi_person_dataset(Dataset):
+    """ wraps a dataset with a get_multi_person(idx) method (copenet_real, aircapData_crop) """
+    def __init__(self, dset):
+        super().__init__()
+        self.dset = dset
+
+    def __len__(self):
+        return len(self.dset)
+
+    def __getitem__(self, idx):
+        sample = self.dset.get_multi_person(idx)
+        sample["frame_idx"] = idx
+        return sample
+
+
+def collate_multi_person(batch):
+    """ concatenate the people of all frame pairs, frame_idx/person_idx map the rows back """
+    batch = [b for b in batch if b["n_people"] > 0]
+    if len(batch) == 0:
+        return {"n_people":0}
+    out = {}
+    for k in ["im0", "im1", "bb0", "bb1", "crop_info0", "crop_info1", "smpl_joints_2d0", "smpl_joints_2d1", "person_idx0", "person_idx1"]:
+        out[k] = torch.cat([b[k] for b in batch])
+    out["intr0"] = torch.cat([b["intr0"].unsqueeze(0).expand(b["n_people"],-1,-1) for b in batch])
+    out["intr1"] = torch.cat([b["intr1"].unsqueeze(0).expand(b["n_people"],-1,-1) for b in batch])
+    out["frame_idx"] = torch.cat([torch.full([b["n_people"]], b["frame_idx"], dtype=torch.long) for b in batch])
+    out["n_people"] = int(sum([b["n_people"] for b in batch]))
+    return out
+
+
+def multi_person_forward(model, batch, iters=3, init_position=[0,0,10], trans_scale=0.05):
+    """
+    run every person of a collated batch through copenet in one forward and scatter the results
+    back: returns {frame_idx: [(person_idx0, person_idx1, pred_pose0, pred_betas0, pred_pose1, pred_betas1), ...]}
+    with the translation in the units of init_position.
+    """
+    if batch["n_people"] == 0:
+        return {}
+    device = next(model.parameters()).device
+    n = batch["n_people"]
+    position = trans_scale*torch.tensor(init_position).float().to(device).expand(n,-1)
+    pred_pose0, pred_betas0, pred_pose1, pred_betas1 = model.forward(x0=batch["im0"].to(device),
+                                                        x1=batch["im1"].to(device),
+                                                        bb0=batch["bb0"].to(device),
+                                                        bb1=batch["bb1"].to(device),
+                                                        init_position0=position,
+                                                        init_position1=position,
+                                                        iters=iters)
+    pred_pose0 = torch.cat([pred_pose0[:,:3]/trans_scale, pred_pose0[:,3:]],1)
+    pred_pose1 = torch.cat([pred_pose1[:,:3]/trans_scale, pred_pose1[:,3:]],1)
+
+    results = {}
+    for row in range(n):
+        results.setdefault(int(batch["frame_idx"][row]), []).append((int(batch["person_idx0"][row]), int(batch["person_idx1"][row]),
+                                                    pred_pose0[row], pred_betas0[row], pred_pose1[row], pred_betas1[row]))
+    return results
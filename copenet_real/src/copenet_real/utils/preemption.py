@@ -0,0 +1,144 @@
+import sys
+import time
+import random
+import signal
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data.distributed import DistributedSampler
+from pytorch_lightning import Callback
+
+"""
+Mid-epoch checkpoints for preemptible jobs. A signal (condor vacate, slurm --signal, Ctrl-C) only
+sets a flag, the next training batch end saves model, optimizers, schedulers, the RNG states and
+the position in the epoch and exits with EXIT_CHECKPOINTED, which is_cluster_mixedmap turns into a
+hold and release of the job. The position is a sample offset into the epoch's permutation of
+ResumableSampler, which depends only on the seed and the epoch.
+
+Resuming takes two parts: lightning (1.6) restores its loop state from the "loops" of the
+checkpoint, the fit loop's epoch progress puts current_epoch back at the interrupted epoch (the
+"epoch" key is only read for checkpoints without loop state) and the batch progress continues the
+batch_idx of that epoch. This callback restores the RNG states and sets the sample offset of the
+epoch's ResumableSampler, so the epoch goes on with the samples it had not seen yet.
+"""
+
+# on_exit_hold code of is_cluster_mixedmap ("Checkpointed, will resume")
+EXIT_CHECKPOINTED = 3
+
+
+class ResumableSampler(DistributedSampler):
+    """
+    training sampler that can start an epoch at a sample offset. Shards the dataset itself under
+    ddp (lightning keeps a DistributedSampler of the dataloader), one shard without a process group
+    """
+    def __init__(self, dataset, shuffle=True, seed=0):
+        distributed = dist.is_available() and dist.is_initialized()
+        super().__init__(dataset,
+                            num_replicas=dist.get_world_size() if distributed else 1,
+                            rank=dist.get_rank() if distributed else 0,
+                            shuffle=shuffle, seed=seed)
+        self.start = 0
+
+    def __iter__(self):
+        # the length stays that of the full epoch, lightning keeps counting the batches of a resumed epoch
+        indices = list(super().__iter__())[self.start:]
+        self.start = 0
+        return iter(indices)
+
+
+def rng_state():
+    state = {"python": random.getstate(),
+                "numpy": np.random.get_state(),
+                "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def train_loader(trainer):
+    # trainer.train_dataloader is a CombinedLoader around the module's DataLoader
+    return getattr(trainer.train_dataloader, "loaders", trainer.train_dataloader)
+
+
+class PreemptionCheckpoint(Callback):
+    """
+    ckpt_path: checkpoint the trainer resumes from (resume_from_checkpoint of the next run)
+    signals: names of the signals that request a checkpoint and exit
+    every_n_minutes: also save a mid-epoch checkpoint (without exiting) this often, bounds the lost
+    work when the job is killed without a signal
+    """
+    def __init__(self, ckpt_path, signals=("SIGTERM","SIGUSR1","SIGINT"), every_n_minutes=None):
+        super().__init__()
+        self.ckpt_path = ckpt_path
+        self.signals = signals
+        self.every_n_minutes = every_n_minutes
+        self.requested = False
+        self.position = None
+        self.resume = None
+        self.last_save = time.time()
+
+    def handler(self, signum, frame):
+        print("received {}, checkpointing at the end of the training step".format(signal.Signals(signum).name))
+        self.requested = True
+        # a second signal gets the default behaviour
+        signal.signal(signum, signal.SIG_DFL)
+
+    def setup(self, trainer, pl_module, stage=None):
+        for name in self.signals:
+            signal.signal(getattr(signal, name), self.handler)
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        if self.resume is None:
+            return
+        epoch, start = self.resume
+        self.resume = None
+        sampler = getattr(train_loader(trainer), "sampler", None)
+        if epoch != trainer.current_epoch or not isinstance(sampler, ResumableSampler):
+            print("cannot resume epoch {} at sample {}, starting epoch {} from the beginning".format(epoch, start,
+                    trainer.current_epoch))
+            return
+        sampler.start = start
+        print("resuming epoch {} at sample {} of {}".format(epoch, start, sampler.num_samples))
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, *args):
+        requested = self.requested
+        periodic = self.every_n_minutes is not None and time.time() - self.last_save > 60*self.every_n_minutes
+        if trainer.world_size > 1:
+            # every rank has to reach save_checkpoint
+            requested = trainer.strategy.reduce_boolean_decision(requested)
+            if self.every_n_minutes is not None:
+                periodic = trainer.strategy.reduce_boolean_decision(periodic)
+        if not (requested or periodic):
+            return
+
+        loader = train_loader(trainer)
+        # batch_idx counts from the start of the epoch, also in a resumed epoch (restored batch progress)
+        self.position = (trainer.current_epoch, (batch_idx + 1)*loader.batch_size)
+        trainer.save_checkpoint(self.ckpt_path)
+        self.position = None
+        self.last_save = time.time()
+        if requested:
+            print("checkpointed epoch {} step {} to {}, exiting".format(trainer.current_epoch, trainer.global_step,
+                    self.ckpt_path))
+            sys.stdout.flush()
+            sys.exit(EXIT_CHECKPOINTED)
+
+    def on_save_checkpoint(self, trainer, pl_module, checkpoint):
+        if self.position is None:
+            return {"position": None}
+        # the epoch to resume is in lightning's loop state, the position only adds the sample offset
+        return {"position": self.position, "rng": rng_state()}
+
+    def on_load_checkpoint(self, trainer, pl_module, callback_state):
+        if callback_state.get("position") is None:
+            return
+        self.resume = callback_state["position"]
+        set_rng_state(callback_state["rng"])
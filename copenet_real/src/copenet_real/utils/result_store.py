@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import pickle as pk
+import numpy as np
+import torch
+
+"""
+Columnar store of the test outputs, in place of pickles of res[dataset_idx][batch]["output"][key].
+Every field of a split is a column of chunk files <root>/<split>/<field>/<first frame:07d>.npy of
+chunk_frames frames (the last one shorter), written by ResultWriter as the test steps come and
+memory-mapped by ResultStore, which reads only the columns, and with frames= only the chunks, it
+is asked for. frame_id is a column too, the index of the frame in its dataset (in the order of the
+test dataloader unless the outputs have a frame_id). meta.json is written last by close, with the
+splits, their number of frames and the fields with dtype and frame shape.
+
+usage: python result_store.py <res.pkl> <store dir> [split names, default test,train]
+converts a pickle of the old list-of-batch-dict results
+"""
+
+# names of the test dataloaders, [test_dloader, train_dloader]
+TEST_SPLITS = ("test","train")
+
+
+def test_split(dset_idx):
+    return TEST_SPLITS[dset_idx] if dset_idx < len(TEST_SPLITS) else str(dset_idx)
+
+
+def chunk_file(root, split, field, start):
+    return os.path.join(root, split, field, "{:07d}.npy".format(start))
+
+
+class ResultWriter(object):
+    """
+    root: directory of the store
+    fields: output keys to store, None for every tensor of the outputs
+    dtype: dtype of the floating point fields (e.g. float16 for the vertices), None keeps it
+    chunk_frames: frames per chunk file, also the frames buffered per split
+    """
+    def __init__(self, root, fields=None, dtype=None, chunk_frames=512):
+        self.root = root
+        self.fields = fields
+        self.dtype = dtype
+        self.chunk_frames = chunk_frames
+        self.buffers = {}
+        self.meta = {}
+
+    def write(self, split, output):
+        """ output dict of a test step (tensors with the frames in the first dimension) of split """
+        if split not in self.meta:
+            self.meta[split] = {"n_frames": 0, "chunk_frames": self.chunk_frames, "fields": {}}
+            self.buffers[split] = []
+        keys = [k for k in (self.fields or output.keys()) if k in output and torch.is_tensor(output[k])]
+        columns = {k:output[k].detach().cpu().numpy() for k in keys}
+        if not columns:
+            return
+        n = next(iter(columns.values())).shape[0]
+        if "frame_id" not in columns:
+            buffered = sum(len(b["frame_id"]) for b in self.buffers[split])
+            start = self.meta[split]["n_frames"] + buffered
+            columns["frame_id"] = np.arange(start, start + n)
+        self.buffers[split].append(columns)
+        while sum(len(b["frame_id"]) for b in self.buffers[split]) >= self.chunk_frames:
+            self.flush(split, self.chunk_frames)
+
+    def flush(self, split, n=None):
+        """ writes the first n (all by default) buffered frames of split as a chunk """
+        buffer = self.buffers[split]
+        if not buffer:
+            return
+        columns = {k:np.concatenate([b[k] for b in buffer]) for k in buffer[0]}
+        n = len(columns["frame_id"]) if n is None else n
+        self.buffers[split] = [{k:v[n:] for k,v in columns.items()}] if n < len(columns["frame_id"]) else []
+        meta = self.meta[split]
+        for k, v in columns.items():
+            v = v[:n]
+            if self.dtype is not None and np.issubdtype(v.dtype, np.floating):
+                v = v.astype(self.dtype)
+            path = chunk_file(self.root, split, k, meta["n_frames"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.save(path, v)
+            meta["fields"][k] = {"dtype": v.dtype.str, "shape": list(v.shape[1:])}
+        meta["n_frames"] += n
+
+    def close(self):
+        for split in self.buffers:
+            self.flush(split)
+        if not self.meta:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        # other splits of an existing store are kept
+        meta_file = os.path.join(self.root, "meta.json")
+        meta = json.load(open(meta_file, "r")) if os.path.exists(meta_file) else {"splits": {}}
+        meta["splits"].update(self.meta)
+        json.dump(meta, open(meta_file, "w"), indent=1)
+        print("test results of {} written to {}".format(", ".join(self.meta.keys()), self.root))
+
+
+class ResultStore(object):
+    """ lazy reader of a store written by ResultWriter """
+    def __init__(self, root):
+        self.root = root
+        self.meta = json.load(open(os.path.join(root, "meta.json"), "r"))["splits"]
+        self.frame_ids = {}
+
+    def splits(self):
+        return list(self.meta.keys())
+
+    def fields(self, split):
+        return list(self.meta[split]["fields"].keys())
+
+    def num_frames(self, split):
+        return self.meta[split]["n_frames"]
+
+    def chunks(self, split, field):
+        """ memory maps of the chunks of a column """
+        meta = self.meta[split]
+        return [np.load(chunk_file(self.root, split, field, start), mmap_mode="r")
+                    for start in range(0, meta["n_frames"], meta["chunk_frames"])]
+
+    def rows(self, split, frames):
+        """ row of every frame id in frames """
+        if split not in self.frame_ids:
+            ids = self.load(split, "frame_id")
+            self.frame_ids[split] = (np.argsort(ids), np.sort(ids))
+        order, ids = self.frame_ids[split]
+        frames = np.asarray(frames)
+        pos = np.clip(np.searchsorted(ids, frames), 0, len(ids)-1)
+        if not np.all(ids[pos] == frames):
+            raise KeyError("frames {} not in split {}".format(frames[ids[pos] != frames][:10], split))
+        return order[pos]
+
+    def load(self, split, field, frames=None):
+        """
+        numpy array of a column, of the frame ids in frames (a range, slice or array) or all of them.
+        A column of a single chunk is returned as its read-only memory map
+        """
+        if field not in self.meta[split]["fields"]:
+            raise KeyError("{} not in split {} of {} (fields {})".format(field, split, self.root, self.fields(split)))
+        chunks = self.chunks(split, field)
+        if frames is None:
+            return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        if isinstance(frames, slice):
+            frames = range(*frames.indices(self.num_frames(split)))
+        rows = self.rows(split, frames)
+        chunk_frames = self.meta[split]["chunk_frames"]
+        chunk_idx = rows // chunk_frames
+        out = np.empty((len(rows),) + chunks[0].shape[1:], dtype=chunks[0].dtype)
+        # only the chunks of the requested frames are read
+        for c in np.unique(chunk_idx):
+            mask = chunk_idx == c
+            out[mask] = chunks[c][rows[mask] - c*chunk_frames]
+        return out
+
+    def tensor(self, split, field, frames=None, device="cpu"):
+        """ column as a tensor on device, floating point fields in float32 """
+        values = np.ascontiguousarray(self.load(split, field, frames))
+        if np.issubdtype(values.dtype, np.floating):
+            values = values.astype(np.float32)
+        return torch.from_numpy(values).to(device)
+
+
+def result_writer(pl_module, default_dir="test_results"):
+    """ ResultWriter of the --result_* arguments of pl_module, in <log dir>/test_results by default """
+    hparams = pl_module.hparams
+    root = hparams.get("result_store") or os.path.join(pl_module.trainer.log_dir or ".", default_dir)
+    fields = [f for f in hparams.get("result_fields", "").split(",") if f] or None
+    dtype = hparams.get("result_dtype", "none")
+    return ResultWriter(root, fields=fields, dtype=None if dtype.lower() == "none" else np.dtype(dtype),
+                        chunk_frames=hparams.get("result_chunk_frames", 512))
+
+
+def convert_pickle(pkl_file, root, split_names=TEST_SPLITS):
+    """ store of the list-of-batch-dict results res[dataset_idx][batch]["output"][key] in pkl_file """
+    res = pk.load(open(pkl_file, "rb"))
+    writer = ResultWriter(root)
+    for split, batches in zip(split_names, res):
+        for batch in batches:
+            writer.write(split, batch["output"])
+    writer.close()
+    return ResultStore(root)
+
+
+if __name__ == '__main__':
+    split_names = sys.argv[3].split(",") if len(sys.argv) > 3 else TEST_SPLITS
+    convert_pickle(sys.argv[1], sys.argv[2], split_names)
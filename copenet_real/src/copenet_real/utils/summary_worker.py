@@ -0,0 +1,165 @@
+import queue
+import cv2
+import torch
+import torch.multiprocessing as mp
+from torchvision.utils import make_grid
+
+from .. import constants as CONSTANTS
+
+"""
+Image summaries rendered off the training loop. The training process only slices the logged
+samples of a batch and copies them to the CPU (summary_view), a worker process renders them with
+pyrender and writes them to the TensorBoard log directory. The queue is bounded and a summary is
+dropped when the worker is still busy, so training never waits for the renderer.
+
+A job only carries the viewport, focal length, camera center and a faces key of each renderer, the
+faces themselves are sent with the first job that uses them. The worker keeps one renderer (one GL
+context) per distinct renderer for its whole lifetime and deletes them when it exits.
+"""
+
+def summary_view(input_batch, output, renderer, im_key, vertices_key, cam_t_key=None, background="crop",
+                    downsize=1, max_samples=4):
+    """
+    CPU copies of one view of a batch for render_summary, every batch_size//max_samples-th sample.
+    background: "crop" renders over the network input <im_key>, "frame" over the image at
+    <im_key>_path, "crop_in_frame" over that image pasted into a blank frame at crop_info
+    """
+    batch_size = input_batch[im_key].shape[0]
+    idx = slice(None,None,batch_size//min(max_samples,batch_size))
+    view = {"renderer": renderer,
+            "background": background,
+            "downsize": downsize,
+            "in_images": input_batch[im_key][idx].detach().float().cpu(),
+            "vertices": output[vertices_key][idx].detach().float().cpu()}
+    if cam_t_key is not None:
+        view["cam_t"] = output[cam_t_key][idx].detach().float().cpu()
+    else:
+        view["cam_t"] = torch.zeros(view["vertices"].shape[0],3)
+    if background != "crop":
+        view["paths"] = list(input_batch[im_key+"_path"][idx])
+    if background == "crop_in_frame":
+        view["crop_info"] = input_batch["crop_info"+im_key[2:]][idx].cpu()
+    return view
+
+
+def load_background(view, i, frame_size=(1080,1920)):
+    image = torch.from_numpy(cv2.imread(view["paths"][i])[:,:,::-1]/255.).float().permute(2,0,1)
+    if view["background"] == "frame":
+        return image
+    crop_info = view["crop_info"][i]
+    frame = torch.zeros(3,*frame_size).float()
+    frame[:,crop_info[0,0]:crop_info[1,0],crop_info[0,1]:crop_info[1,1]] = image
+    return frame
+
+
+def render_summary(views):
+    """ rendered predictions and input crops of the views, stacked vertically """
+    pred_images = []
+    in_images = []
+    for view in views:
+        im = view["in_images"]*torch.tensor(CONSTANTS.IMG_NORM_STD).reshape(1,3,1,1) + \
+                torch.tensor(CONSTANTS.IMG_NORM_MEAN).reshape(1,3,1,1)
+        n = im.shape[0]
+        if view["background"] == "crop":
+            backgrounds = im
+        else:
+            backgrounds = torch.stack([load_background(view, i) for i in range(n)])
+        rendered = view["renderer"].visualize_tb(view["vertices"],
+                                            view["cam_t"],
+                                            torch.eye(3).float().unsqueeze(0).repeat(n,1,1),
+                                            backgrounds)
+        pred_images.append(rendered[:,::view["downsize"],::view["downsize"]])
+        in_images.append(make_grid(im))
+    return torch.cat(pred_images,1), torch.cat(in_images,1)
+
+
+def renderer_spec(renderer):
+    """ what the worker needs to recreate a Renderer, the faces go by the key of the array """
+    return {"viewport": (renderer.renderer.viewport_width, renderer.renderer.viewport_height),
+            "focal_length": tuple(renderer.focal_length),
+            "camera_center": tuple(renderer.camera_center),
+            "faces_key": id(renderer.faces)}
+
+
+def worker_renderer(renderers, faces, spec):
+    """ the worker's Renderer of spec, created on first use and kept in renderers """
+    key = (spec["viewport"], spec["focal_length"], spec["camera_center"], spec["faces_key"])
+    if key not in renderers:
+        from .renderer import Renderer
+        renderer = Renderer(focal_length=list(spec["focal_length"]), img_res=list(spec["viewport"]),
+                            faces=faces[spec["faces_key"]])
+        renderer.camera_center = list(spec["camera_center"])
+        renderers[key] = renderer
+    return renderers[key]
+
+
+def summary_loop(log_dir, jobs):
+    from torch.utils.tensorboard import SummaryWriter
+    writer = SummaryWriter(log_dir)
+    renderers = {}
+    faces = {}
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            prefix, step, views, new_faces = job
+            faces.update(new_faces)
+            # a failed summary is skipped, the worker keeps serving the next ones
+            try:
+                for view in views:
+                    view["renderer"] = worker_renderer(renderers, faces, view["renderer"])
+                pred_image, in_image = render_summary(views)
+                writer.add_image(prefix + '_pred_shape_cam', pred_image, step)
+                writer.add_image(prefix + '_input_images', in_image, step)
+                writer.flush()
+            except Exception as e:
+                print("summary of step {} failed: {}".format(step, e))
+    finally:
+        for renderer in renderers.values():
+            renderer.renderer.delete()
+        writer.close()
+
+
+class SummaryWorker(object):
+    """
+    log_dir: TensorBoard log directory, the worker writes its own event file there
+    max_queue: summaries waiting to be rendered, submit drops a summary when the queue is full
+    """
+    def __init__(self, log_dir, max_queue=2):
+        ctx = mp.get_context("spawn")
+        self.jobs = ctx.Queue(max_queue)
+        self.process = ctx.Process(target=summary_loop, args=(log_dir, self.jobs), daemon=True)
+        self.process.start()
+        self.n_submitted = 0
+        self.n_dropped = 0
+        # faces keys the worker already has
+        self.sent_faces = set()
+
+    def submit(self, prefix, step, views):
+        """ queue the views of a summary without blocking, returns False when it was dropped """
+        jobs_views = []
+        new_faces = {}
+        for view in views:
+            spec = renderer_spec(view["renderer"])
+            if spec["faces_key"] not in self.sent_faces:
+                new_faces[spec["faces_key"]] = view["renderer"].faces
+            jobs_views.append(dict(view, renderer=spec))
+        try:
+            self.jobs.put_nowait((prefix, step, jobs_views, new_faces))
+        except queue.Full:
+            self.n_dropped += 1
+            return False
+        self.sent_faces.update(new_faces.keys())
+        self.n_submitted += 1
+        return True
+
+    def close(self, timeout=60):
+        """ let the worker finish the queued summaries """
+        try:
+            self.jobs.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -12,8 +12,10 @@ from human_body_prior.tools.model_loader import load_model
 from human_body_prior.models.vposer_model import VPoser
 from human_body_prior.body_model.body_model import BodyModel
 from copenet.smplx.smplx import SMPLX 
+from copenet.utils.body_model import SMPLXAnyBatch, JointsOnlySMPLX, sparse_regressor, regress_joints
 from copenet.utils.geometry import perspective_projection, rot6d_to_rotmat
 from copenet_real.utils.utils import transform_smpl
+from copenet_real.utils.result_store import ResultStore
 from pytorch3d import transforms
 import pickle as pkl
 from tqdm import tqdm
@@ -27,7 +29,7 @@ datapath = sys.argv[1]
 smplx_path = sys.argv[2]
 vposer_path = sys.argv[3]
 hmr_res_dir_path = sys.argv[4]
-copenet_twoview_real_pkl = sys.argv[5]
+copenet_twoview_real_results = sys.argv[5]
 smplx2j14 = sys.argv[6]
 datatype = sys.argv[7]
 
@@ -125,6 +127,9 @@ train_ds, test_ds = copenet_real.get_copenet_real_traintest(datapath,train_range
 smplx_model = BodyModel(bm_fname=smplx_path)
 smplx_model.to(device)
 smplx_model.eval()
+# the 2d fitting only looks at the first 24 joints (body, jaw, left eye), the vertices are
+# skinned once per chunk after the optimization
+smplx_joints = JointsOnlySMPLX(SMPLXAnyBatch(smplx_path), num_joints=24).to(device)
 
 vp_model = load_model(vposer_path, model_code=VPoser,remove_words_in_model_weights="vp_model.")[0]
 vp_model.to(device)
@@ -150,43 +155,43 @@ for dataset in tqdm([datatype]):
 
     ###################################################
     fname = hmr_res_dir_path
-    fname0 = os.path.join(fname,"epoch=388.pkl" + "0")
-    fname1 = os.path.join(fname,"epoch=388.pkl" + "1")
-    res0 = pkl.load(open(fname0,"rb"))
-    res1 = pkl.load(open(fname1,"rb"))
-    bl_smpl_angles0 = torch.cat([i["output"]["pred_angles"].to("cuda") for i in res0[res_id]])
+    fname0 = os.path.join(fname,"epoch=388_results" + "0")
+    fname1 = os.path.join(fname,"epoch=388_results" + "1")
+    res0 = ResultStore(fname0)
+    res1 = ResultStore(fname1)
+    bl_smpl_angles0 = res0.tensor(dataset, "pred_angles", device="cuda")
     bl_smpl_rotmat0 = transforms.rotation_conversions.axis_angle_to_matrix(bl_smpl_angles0)
     bl_smpl_wrt_cam0 = torch.eye(4,device=device).float().unsqueeze(0).expand([6990,-1,-1]).clone()
     bl_smpl_wrt_cam0[:,:3,:3] = bl_smpl_rotmat0[:,0]
-    bl_smpl_wrt_cam0[:,:3,3] = torch.cat([i["output"]["pred_smpltrans"].to(device) for i in res0[res_id]])
-    bl_smpl_angles1 = torch.cat([i["output"]["pred_angles"].to("cuda") for i in res1[res_id]])
+    bl_smpl_wrt_cam0[:,:3,3] = res0.tensor(dataset, "pred_smpltrans", device=device)
+    bl_smpl_angles1 = res1.tensor(dataset, "pred_angles", device="cuda")
     bl_smpl_rotmat1 = transforms.rotation_conversions.axis_angle_to_matrix(bl_smpl_angles1)
     bl_smpl_wrt_cam1 = torch.eye(4,device=device).float().unsqueeze(0).expand([6990,-1,-1]).clone()
     bl_smpl_wrt_cam1[:,:3,:3] = bl_smpl_rotmat1[:,0]
-    bl_smpl_wrt_cam1[:,:3,3] = torch.cat([i["output"]["pred_smpltrans"].to(device) for i in res1[res_id]])
+    bl_smpl_wrt_cam1[:,:3,3] = res1.tensor(dataset, "pred_smpltrans", device=device)
     bl_cam1_wrt_smpl = torch.inverse(bl_smpl_wrt_cam1)
     bl_cam1_wrt_cam0 = torch.matmul(bl_smpl_wrt_cam0,bl_cam1_wrt_smpl)
     ###################################################
 
     # Get data and initializations
     # fname = "/is/ps3/nsaini/projects/copenet_real/copenet_logs/copenet_twoview/version_5_cont_limbwght/checkpoints/epoch=761.pkl"
-    fname = copenet_twoview_real_pkl
-    res = pkl.load(open(fname,"rb"))
+    fname = copenet_twoview_real_results
+    res = ResultStore(fname)
 
-    smpl_angles0 = torch.cat([i["output"]["pred_angles0"].to(device) for i in res[res_id]])
+    smpl_angles0 = res.tensor(dataset, "pred_angles0", device=device)
     smpl_rootangle0 = smpl_angles0[:,0]
     smpl_z_init = vp_model.encode(smpl_angles0[:,1:]).mean
 
     smpl_rotmat0 = transforms.rotation_conversions.axis_angle_to_matrix(smpl_angles0)
     smpl_wrt_cam0 = torch.eye(4,device=device).float().unsqueeze(0).expand([6990,-1,-1]).clone()
     smpl_wrt_cam0[:,:3,:3] = smpl_rotmat0[:,0]
-    smpl_wrt_cam0[:,:3,3] = torch.cat([i["output"]["pred_smpltrans0"].to(device) for i in res[res_id]])
+    smpl_wrt_cam0[:,:3,3] = res.tensor(dataset, "pred_smpltrans0", device=device)
     pl_smpl_wrt_cam0 = smpl_wrt_cam0.detach().clone()
 
     smpl_wrt_cam1 = torch.eye(4,device=device).float().unsqueeze(0).expand([6990,-1,-1]).clone()
-    smpl_rootangle1 = torch.cat([i["output"]["pred_angles1"][:,0].to(device) for i in res[res_id]])
+    smpl_rootangle1 = res.tensor(dataset, "pred_angles1", device=device)[:,0]
     smpl_wrt_cam1[:,:3,:3] = transforms.rotation_conversions.axis_angle_to_matrix(smpl_rootangle1)
-    smpl_wrt_cam1[:,:3,3] = torch.cat([i["output"]["pred_smpltrans1"].to(device) for i in res[res_id]])
+    smpl_wrt_cam1[:,:3,3] = res.tensor(dataset, "pred_smpltrans1", device=device)
     pl_smpl_wrt_cam1 = smpl_wrt_cam1.detach().clone()
     cam1_wrt_smpl = torch.inverse(smpl_wrt_cam1)
     cam1_wrt_cam0 = torch.matmul(smpl_wrt_cam0,cam1_wrt_smpl)
@@ -207,11 +212,14 @@ for dataset in tqdm([datatype]):
     # joints2d_gt0 = torch.from_numpy(ds.apose_smpl_fmt.reshape(2,-1,24,3)[0][begin:end]).float().to(device)
     # joints2d_gt1 = torch.from_numpy(ds.apose_smpl_fmt.reshape(2,-1,24,3)[1][begin:end]).float().to(device)
     
-    j_regressor = torch.from_numpy(pkl.load(open(smplx2j14,"rb"),encoding="latin1")).float().to(device)
+    # SMPLX_to_J14 is mostly zeros, regress the J14 joints with a sparse (COO) matmul
+    j_regressor = sparse_regressor(torch.from_numpy(pkl.load(open(smplx2j14,"rb"),encoding="latin1")).float().to(device))
     # smplx2j14 = "/ps/project/common/expose_release/data/SMPLX_to_J14.pkl"
     
     pl_verts0 = np.zeros([6990,10475,3])
     pl_verts1 = np.zeros([6990,10475,3])
+    pl_j14_0 = np.zeros([6990,14,3])
+    pl_j14_1 = np.zeros([6990,14,3])
 
     for begin in tqdm([0,2000,4000,6000]):
 
@@ -305,11 +313,10 @@ for dataset in tqdm([datatype]):
                 
                 pl_smplxtheta_3d = vp_model.decode(pl_smplxtheta)["pose_body"].reshape(-1,63)
                 
-                # forward SMPLX
-                smplx_out = smplx_model.forward(betas=pl_smplxbeta.unsqueeze(0).expand([lseq,-1]), 
-                                            pose_body=pl_smplxtheta_3d,
-                                            root_orient=torch.zeros(lseq,3,device=device).float(),
-                                            trans = torch.zeros(lseq,3,device=device).float())
+                # forward kinematics of the joints only
+                smplx_joints_out = smplx_joints.forward(betas=pl_smplxbeta.unsqueeze(0).expand([lseq,-1]),
+                                            body_pose=pl_smplxtheta_3d,
+                                            global_orient=torch.zeros(lseq,3,device=device).float())
                 pl_smplxphi0_9d = transforms.rotation_6d_to_matrix(pl_smplxphi0).squeeze(0)
                 pl_smplxphi1_9d = transforms.rotation_6d_to_matrix(pl_smplxphi1).squeeze(0)
                 
@@ -317,12 +324,12 @@ for dataset in tqdm([datatype]):
                                     pl_smplxtau0.unsqueeze(2)],dim=2)
                 transf_mat1 = torch.cat([pl_smplxphi1_9d[:,:3,:3],
                                     pl_smplxtau1.unsqueeze(2)],dim=2)
-                verts0,joints3d0,_,_ = transform_smpl(transf_mat0,
-                                        smplx_out.v,
-                                        smplx_out.Jtr)
-                verts1,joints3d1,_,_ = transform_smpl(transf_mat1,
-                                        smplx_out.v,
-                                        smplx_out.Jtr)
+                _,joints3d0,_,_ = transform_smpl(transf_mat0,
+                                        None,
+                                        smplx_joints_out.joints)
+                _,joints3d1,_,_ = transform_smpl(transf_mat1,
+                                        None,
+                                        smplx_joints_out.joints)
 
                 # joints3d0 = torch.matmul(j_regressor,verts0)
                 # joints3d1 = torch.matmul(j_regressor,verts1)
@@ -400,6 +407,13 @@ for dataset in tqdm([datatype]):
                 loss.backward()
                 optim.step()
 
+        with torch.no_grad():
+            smplx_out = smplx_model.forward(betas=pl_smplxbeta.unsqueeze(0).expand([lseq,-1]), 
+                                        pose_body=vp_model.decode(pl_smplxtheta)["pose_body"].reshape(-1,63),
+                                        root_orient=torch.zeros(lseq,3,device=device).float(),
+                                        trans = torch.zeros(lseq,3,device=device).float())
+            verts0,_,_,_ = transform_smpl(transf_mat0,smplx_out.v)
+            verts1,_,_,_ = transform_smpl(transf_mat1,smplx_out.v)
         ########################################################
         pl_smpl_z[begin:end,:] = pl_smplxtheta.detach().clone()
         pl_smpl_wrt_cam0[begin:end,:3,:3] = pl_smplxphi0_9d
@@ -410,6 +424,8 @@ for dataset in tqdm([datatype]):
         pl_cam1_wrt_cam0[begin:end] = torch.matmul(pl_smpl_wrt_cam0[begin:end],torch.inverse(pl_smpl_wrt_cam1[begin:end]))
         pl_verts0[begin:end] = verts0.detach().cpu().numpy()
         pl_verts1[begin:end] = verts1.detach().cpu().numpy()
+        pl_j14_0[begin:end] = regress_joints(j_regressor, verts0).cpu().numpy()
+        pl_j14_1[begin:end] = regress_joints(j_regressor, verts1).cpu().numpy()
         ########################################################
     
     # %% baseline and airpose results load
@@ -772,7 +788,7 @@ for dataset in tqdm([datatype]):
     # airpose_pred_vertices_cam0 = torch.cat([i["output"]["pred_vertices_cam0"].to("cuda") for i in res[res_id]])
     # airpose_pred_vertices_cam1 = torch.cat([i["output"]["pred_vertices_cam1"].to("cuda") for i in res[res_id]])
 
-    # fname = copenet_twoview_real_pkl
+    # fname = copenet_twoview_real_results
     # fname0 = fname + "0"
     # fname1 = fname + "1"
     # res0 = pkl.load(open(fname0,"rb"))
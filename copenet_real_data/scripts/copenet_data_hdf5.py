@@ -41,6 +41,7 @@ import torch
 import h5py
 import pickle as pkl
 from pytorch3d import transforms
+from copenet_real.utils.result_store import ResultStore
 
 trn_range = range(0,7000)
 tst_range = range(8000,15000)
@@ -54,32 +55,32 @@ joints2d_train_gt1 = torch.cat([train_ds.get_j2d_only(i)["smpl_joints_2d1"].unsq
 joints2d_test_gt0 = torch.cat([test_ds.get_j2d_only(i)["smpl_joints_2d0"].unsqueeze(0) for i in range(len(test_ds))]).data.numpy()
 joints2d_test_gt1 = torch.cat([test_ds.get_j2d_only(i)["smpl_joints_2d1"].unsqueeze(0) for i in range(len(test_ds))]).data.numpy()
 
-fname = "/is/ps3/nsaini/projects/copenet_real/copenet_logs/copenet_twoview/version_5_cont_limbwght/checkpoints/epoch=761.pkl"
-res = pkl.load(open(fname,"rb"))
+fname = "/is/ps3/nsaini/projects/copenet_real/copenet_logs/copenet_twoview/version_5_cont_limbwght/checkpoints/epoch=761_results"
+res = ResultStore(fname)
 
-smpl_angles0_train = torch.cat([i["output"]["pred_angles0"] for i in res[1]])
+smpl_angles0_train = res.tensor("train", "pred_angles0")
 smpl_rotmat0_train = transforms.rotation_conversions.axis_angle_to_matrix(smpl_angles0_train)
 smpl_wrt_cam0_train = torch.eye(4).float().unsqueeze(0).expand([6990,-1,-1]).clone()
 smpl_wrt_cam0_train[:,:3,:3] = smpl_rotmat0_train[:,0]
-smpl_wrt_cam0_train[:,:3,3] = torch.cat([i["output"]["pred_smpltrans0"] for i in res[1]])
+smpl_wrt_cam0_train[:,:3,3] = res.tensor("train", "pred_smpltrans0")
 
-smpl_angles1_train = torch.cat([i["output"]["pred_angles0"] for i in res[1]])
+smpl_angles1_train = res.tensor("train", "pred_angles0")
 smpl_rotmat1_train = transforms.rotation_conversions.axis_angle_to_matrix(smpl_angles1_train)
 smpl_wrt_cam1_train = torch.eye(4).float().unsqueeze(0).expand([6990,-1,-1]).clone()
 smpl_wrt_cam1_train[:,:3,:3] = smpl_rotmat1_train[:,0]
-smpl_wrt_cam1_train[:,:3,3] = torch.cat([i["output"]["pred_smpltrans1"] for i in res[1]])
+smpl_wrt_cam1_train[:,:3,3] = res.tensor("train", "pred_smpltrans1")
 
-smpl_angles0_test = torch.cat([i["output"]["pred_angles0"] for i in res[0]])
+smpl_angles0_test = res.tensor("test", "pred_angles0")
 smpl_rotmat0_test = transforms.rotation_conversions.axis_angle_to_matrix(smpl_angles0_test)
 smpl_wrt_cam0_test = torch.eye(4).float().unsqueeze(0).expand([6990,-1,-1]).clone()
 smpl_wrt_cam0_test[:,:3,:3] = smpl_rotmat0_test[:,0]
-smpl_wrt_cam0_test[:,:3,3] = torch.cat([i["output"]["pred_smpltrans0"] for i in res[1]])
+smpl_wrt_cam0_test[:,:3,3] = res.tensor("train", "pred_smpltrans0")
 
-smpl_angles1_test = torch.cat([i["output"]["pred_angles0"] for i in res[0]])
+smpl_angles1_test = res.tensor("test", "pred_angles0")
 smpl_rotmat1_test = transforms.rotation_conversions.axis_angle_to_matrix(smpl_angles1_test)
 smpl_wrt_cam1_test = torch.eye(4).float().unsqueeze(0).expand([6990,-1,-1]).clone()
 smpl_wrt_cam1_test[:,:3,:3] = smpl_rotmat1_train[:,0]
-smpl_wrt_cam1_test[:,:3,3] = torch.cat([i["output"]["pred_smpltrans1"] for i in res[0]])
+smpl_wrt_cam1_test[:,:3,3] = res.tensor("test", "pred_smpltrans1")
 
 f.create_dataset("joints2d_train_gt0",data=joints2d_train_gt0)
 f.create_dataset("joints2d_train_gt1",data=joints2d_train_gt1)